@@ -1,6 +1,6 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import Dataset, ConcatDataset, DataLoader, RandomSampler, SequentialSampler
 from utils.parse_config import ConfigParser
 import argparse
 from utils.util import *
@@ -9,16 +9,17 @@ import json
 import random
 import time
 from utils.pytorchtools import *
+from utils.path_shards import PathShards
+from model.base_model import BaseModel
+from model.kg_features import KGFeatureStore
 
-class KPRN(nn.Module):
-    def __init__(self, config, doc_feature_embedding, entity_embedding, relation_embedding, device=torch.device('cpu')):
+class KPRN(BaseModel):
+    def __init__(self, config, kg_features, device=torch.device('cpu')):
         super(KPRN, self).__init__()
         self.device = device
         self.config = config
         self.gamma = config["gamma"]
-        self.doc_feature_embedding = doc_feature_embedding
-        self.entity_embedding = nn.Embedding.from_pretrained(entity_embedding)
-        self.relation_embedding = nn.Embedding.from_pretrained(relation_embedding)
+        self.kg_features = kg_features#shared KGFeatureStore, news are passed as rows of its doc_feature_embedding
         self.innews_relation = nn.Embedding(1, self.config['embedding_size']).to(device)
         self.news_compress = nn.Sequential(
                                 nn.Linear(self.config['doc_embedding_size'], self.config['embedding_size']),
@@ -45,13 +46,13 @@ class KPRN(nn.Module):
     def forward(self, data):
         batch_predict = []
         batch_path_scores = []
-        for item1, item2, paths, edges in zip(data['item1'], data['item2'], data['paths'], data['edges']):
-            news1 = self.news_compress(self.doc_feature_embedding[item1].to(self.device)).unsqueeze(dim=0)
-            news2 = self.news_compress(self.doc_feature_embedding[item2].to(self.device)).unsqueeze(dim=0)
+        news_embeddings1 = self.news_compress(self.kg_features.news(data['item1_row']))
+        news_embeddings2 = self.news_compress(self.kg_features.news(data['item2_row']))
+        for news1, news2, paths, edges, lengths in zip(news_embeddings1[:,None,:], news_embeddings2[:,None,:], data['paths'], data['edges'], data['lengths']):
             path_scores=[]
-            for path, edge in zip(paths, edges):
-                path_node_embeddings = self.entity_compress(self.entity_embedding(torch.tensor(path, dtype=torch.long)).to(self.device))#(path_len-2, embedding_size)
-                path_edge_embeddings = self.relation_compress(self.relation_embedding(torch.tensor(edge[1:], dtype=torch.long)).to(self.device))#(path_len-3, embedding_size)
+            for path, edge, length in zip(paths, edges, lengths.tolist()):
+                path_node_embeddings = self.kg_features.compressed_entities(path[:length], self.entity_compress)#(path_len-2, embedding_size)
+                path_edge_embeddings = self.kg_features.compressed_relations(edge[1:length], self.relation_compress)#(path_len-3, embedding_size)
                 path_node_embeddings = torch.cat((news1, path_node_embeddings, news2), dim=0) #(path_len, embedding_size)
                 path_edge_embeddings = torch.cat((self.innews_relation(torch.tensor([0]).to(self.device)), path_edge_embeddings, self.innews_relation(torch.tensor([0]).to(self.device)), torch.zeros([1, self.config['embedding_size']]).to(self.device)), dim=0) #(path_len, embedding_size)
                 path_node_embeddings = torch.unsqueeze(path_node_embeddings, 0)#(1, path_len, embedding_size)
@@ -69,16 +70,21 @@ class KPRN(nn.Module):
         loss = loss_fn(predicts, data['label'].to(self.device))
         return loss, predicts, batch_path_scores
 
-class KPRN_Dataset(Dataset):
-    def __init__(self, data):
-        self.data = data
+class KPRN_ShardDataset(Dataset):
+    """KPRN samples of a JSON lines file read from its memory-mapped packed shards (see utils.path_shards).
+
+    With a news vocabulary, samples also have the `item1_row`/`item2_row` rows of their news.
+    """
+    def __init__(self, filename, news_vocab=None):
+        self.shards = PathShards.load(filename)
+        if news_vocab is not None:
+            self.shards.set_vocab(news_vocab)
     def __len__(self):
-        return len(self.data)
+        return len(self.shards)
     def __getitem__(self, idx):
         if torch.is_tensor(idx):
             idx = idx.tolist()
-        sample = self.data[idx]
-        return sample
+        return self.shards.sample(idx)
 
 class KPRN_Trainer():
     def __init__(self, config, model, train_dataloader, dev_dataloader, test_dataloader, device) -> None:
@@ -164,13 +170,14 @@ class KPRN_Trainer():
                     item2 = batch['item2'][i]
                     paths = batch['paths'][i]
                     edges = batch['edges'][i]
+                    lengths = batch['lengths'][i]
                     try:
                         indices = batch_path_scores[i].reshape(-1).topk(2).indices.tolist()
                     except:
                         indices = [0]
                     for index in indices:
-                        path = paths[index]
-                        edge = edges[index]
+                        path = paths[index][:lengths[index]].tolist()
+                        edge = edges[index][:lengths[index]].tolist()
                         output_path.append({'label': label, 'item1': item1, 'item2': item2, 'paths': path, 'edges': edge})
         with open(self.config['datapath']+self.config['KPRN_predict_train_file'], "w") as f1:
             with open(self.config['datapath']+self.config['KPRN_predict_dev_file'], "w") as f2:
@@ -190,19 +197,18 @@ def collate_fn(data):
     batch['label'] = torch.tensor([item['label'] for item in data], dtype=torch.float)
     batch['item1'] = [item['item1'] for item in data]
     batch['item2'] = [item['item2'] for item in data]
+    batch['item1_row'] = torch.tensor([item['item1_row'] for item in data], dtype=torch.long)
+    batch['item2_row'] = torch.tensor([item['item2_row'] for item in data], dtype=torch.long)
     batch['paths'] = [item['paths'] for item in data]
-    batch['edges'] = [item['edges'] for item in data]
+    batch['edges'] = [item['edges'] for item in data]#(path_num, 3) each
+    batch['lengths'] = [item['lengths'] for item in data]
     return batch
 
 def create_dataloaders(config):
-    with open(config['datapath']+config['KPRN_train_file'], "r") as f:
-        train_data = [json.loads(line) for line in f.readlines()]
-    with open(config['datapath']+config['KPRN_val_file'], "r") as f:
-        dev_data = [json.loads(line) for line in f.readlines()]
-
-    train_dataset = KPRN_Dataset(train_data)
-    dev_dataset = KPRN_Dataset(dev_data)
-    test_dataset = KPRN_Dataset(train_data + dev_data)
+    news_vocab = NewsVocab.load(DocEmbeddingStore.ids_file(config['datapath']+config['doc_feature_embedding_file']))
+    train_dataset = KPRN_ShardDataset(config['datapath']+config['KPRN_train_file'], news_vocab)
+    dev_dataset = KPRN_ShardDataset(config['datapath']+config['KPRN_val_file'], news_vocab)
+    test_dataset = ConcatDataset([train_dataset, dev_dataset])
 
     train_dataloader = DataLoader(
         dataset=train_dataset,
@@ -246,11 +252,12 @@ if __name__ == '__main__':
     train_dataloader, dev_dataloader, test_dataloader = create_dataloaders(config)
 
     #model
-    doc_feature_embedding = np.load(config['cache_path']+"/doc_feature_embedding.npy", allow_pickle=True).item()
-    entity_embedding = torch.load(config['cache_path']+"/entity_embedding.pt")
-    relation_embedding = torch.load(config['cache_path']+"/relation_embedding.pt")
+    doc_feature_embedding = build_doc_feature_embedding(config)
+    entity_num = len(np.load(config['cache_path']+"/entity_id_dict.npy", allow_pickle=True).item())
+    relation_num = len(np.load(config['cache_path']+"/relation_id_dict.npy", allow_pickle=True).item())
+    entity_embedding, relation_embedding = build_entity_relation_embedding(config, entity_num, relation_num)
 
-    model = KPRN(config, doc_feature_embedding, entity_embedding, relation_embedding, device=device)
+    model = KPRN(config, KGFeatureStore(entity_embedding, relation_embedding, doc_feature_embedding, device=device), device=device)
 
     trainer = KPRN_Trainer(config, model, train_dataloader, dev_dataloader, test_dataloader, device=device)
 
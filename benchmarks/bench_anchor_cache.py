@@ -0,0 +1,67 @@
+"""Compare validation-style anchor inference with and without the AnchorGraphCache.
+
+    $ python -m benchmarks.bench_anchor_cache [num_pairs] [num_news] [device]
+
+Pairs mimic random_neg_sample_valid: each item1 appears in 1 + train_neg_num pairs and item2 follows the
+news popularity. Without the cache AnchorKG runs on both columns of every batch, with the cache it runs once
+per distinct news. The cached graphs are checked against the uncached greedy ones, against news run alone
+(greedy inference does not depend on the rest of the batch) and after a save/load round trip.
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from benchmarks.synthetic import anchor_model
+from model.anchor_cache import AnchorGraphCache
+
+def bench(num_pairs, num_news, device, batch_size=64, train_neg_num=4):
+    model, _ = anchor_model(num_news=num_news, device=device, config={'anchor_inference': 'greedy'})
+    model.eval()
+    vocab = model.kg_features.doc_feature_embedding.vocab
+    rng = np.random.default_rng(2022)
+    popularity = 1.0 / np.arange(1, num_news+1) ** 0.8
+    item1 = torch.from_numpy(np.repeat(rng.integers(0, num_news, num_pairs // (1+train_neg_num)), 1+train_neg_num))
+    item2 = torch.from_numpy(rng.choice(num_news, len(item1), p=popularity/popularity.sum()))
+    starts = range(0, len(item1), batch_size)
+
+    def run(infer):
+        graphs = []
+        t = time.time()
+        with torch.no_grad():
+            for start in starts:
+                for news in [item1[start:start+batch_size], item2[start:start+batch_size]]:
+                    graphs.append(infer(news))
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return graphs, time.time() - t
+
+    uncached, uncached_time = run(lambda news: model(news)[3:])
+    cache = AnchorGraphCache(num_news, vocab)
+    cached, cached_time = run(lambda news: cache.anchor_graphs(model, news))
+    computed = cache.misses
+    assert all(torch.equal(x, y) for graph1, graph2 in zip(uncached, cached) for x, y in zip(graph1[0] + graph1[1], graph2[0] + graph2[1]))
+    with torch.no_grad():
+        for row in item2[:20].tolist():
+            alone = model(torch.tensor([row]))
+            batch = cache.anchor_graphs(model, torch.tensor([row]))
+            assert all(torch.equal(x, y) for x, y in zip(alone[3] + alone[4], batch[0] + batch[1]))
+
+    with tempfile.TemporaryDirectory() as root:
+        cache.save(os.path.join(root, 'anchor_graph_cache.pt'))
+        restored = AnchorGraphCache(num_news, vocab)
+        loaded = restored.load(os.path.join(root, 'anchor_graph_cache.pt'), model)
+        reloaded, reloaded_time = run(lambda news: restored.anchor_graphs(model, news))
+        assert restored.misses == 0 and all(torch.equal(x, y) for graph1, graph2 in zip(cached, reloaded) for x, y in zip(graph1[0], graph2[0]))
+        with torch.no_grad():
+            model.news_compress[0].weight.add_(0.01)#a new model version
+        assert AnchorGraphCache(num_news, vocab).load(os.path.join(root, 'anchor_graph_cache.pt'), model) == 0
+
+    print("pairs: {}, news: {}, device: {}, graphs identical".format(len(item1), num_news, device))
+    print("uncached: {} anchor graphs in {:.2f}s, cached: {} anchor graphs in {:.2f}s ({:.1f}x), loaded from file ({} news): {:.2f}s".format(
+        2*len(item1), uncached_time, computed, cached_time, uncached_time/cached_time, loaded, reloaded_time))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+          torch.device(sys.argv[3] if len(sys.argv) > 3 else ('cuda' if torch.cuda.is_available() else 'cpu')))
@@ -0,0 +1,67 @@
+"""Compare the AnchorKG action selection engines.
+
+    $ python -m benchmarks.bench_anchor_selection [batch_size] [device]
+
+- training: Categorical sampling with replacement against Gumbel-top-k without replacement, on
+  (batch, parents, 20) action probabilities: repeated positions, the first action follows the
+  policy for both, speed of one call and distinct anchors per news in a full forward
+- inference: greedy topk against beam search, log probability of the anchor graphs and speed
+"""
+import sys
+import time
+import torch
+from benchmarks.synthetic import anchor_model
+
+def timeit(fn, repeat):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t = time.time()
+    for _ in range(repeat):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - t) / repeat
+
+def anchor_slots(anchor_graph):#mean number of non padding anchors and of distinct ones in the anchor graphs
+    nodes = torch.cat(anchor_graph, dim=-1)
+    return (nodes > 0).sum().item() / len(nodes), sum(len(set(row) - {0}) for row in nodes.tolist()) / len(nodes)
+
+def bench(batch_size, device, repeat=20):
+    torch.manual_seed(2022)
+    model, _ = anchor_model(num_news=5000, device=device)
+    for topk, parents in zip([5, 3, 2], [1, 5, 15]):
+        weights = torch.softmax(2 * torch.randn(batch_size, parents, 20, device=device), dim=-1)
+        engines = {}
+        for sampling in ['categorical', 'gumbel']:
+            model.config['anchor_sampling'] = sampling
+            acts_idx = model.select_actions(weights, topk)
+            repeated = (acts_idx.sort(dim=-1).values.diff(dim=-1) == 0).any(dim=-1).float().mean().item()
+            first = torch.stack([model.select_actions(weights[:1], topk)[0, 0, 0] for _ in range(4000)])
+            error = (torch.bincount(first, minlength=20) / len(first) - weights[0, 0]).abs().max().item()
+            engines[sampling] = (repeated, error, timeit(lambda: model.select_actions(weights, topk), repeat))
+        print("topk {} of 20, {} parents: parents with a repeated action: categorical {:.1%}, gumbel {:.1%}; "
+              "first action vs policy max error: {:.3f}, {:.3f}; per call: {:.3f}ms, {:.3f}ms".format(
+              topk, parents, engines['categorical'][0], engines['gumbel'][0], engines['categorical'][1], engines['gumbel'][1],
+              engines['categorical'][2]*1000, engines['gumbel'][2]*1000))
+        assert engines['gumbel'][0] == 0
+
+    news = torch.randint(0, 5000, (batch_size,))
+    for sampling in ['categorical', 'gumbel']:
+        model.config['anchor_sampling'] = sampling
+        anchor_graph = model(news)[3]
+        print("training forward, {}: {:.1f} non padding anchors per news out of 50, {:.1f} distinct, {:.1f}ms".format(
+              sampling, *anchor_slots(anchor_graph), timeit(lambda: model(news), 5)*1000))
+
+    model.eval()
+    with torch.no_grad():
+        for inference in ['greedy', 'beam']:
+            model.config['anchor_inference'] = inference
+            act_probs_steps, _, _, anchor_graph, _ = model(news, with_rewards=False)
+            log_prob = sum(torch.log(act_probs).sum(dim=-1) for act_probs in act_probs_steps).mean().item()
+            print("inference, {}: log probability {:.3f}, {:.1f} non padding anchors per news, {:.1f} distinct, {:.1f}ms".format(
+                  inference + (' (beam size {})'.format(model.config['anchor_beam_size']) if inference == 'beam' else ''),
+                  log_prob, *anchor_slots(anchor_graph), timeit(lambda: model(news, with_rewards=False), 5)*1000))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 64, torch.device(sys.argv[2] if len(sys.argv) > 2 else ('cuda' if torch.cuda.is_available() else 'cpu')))
@@ -0,0 +1,50 @@
+"""Compare the sparse co-click engine with the former nested loop of build_item2item_dataset.
+
+    $ python -m benchmarks.bench_coclick
+"""
+import math
+import time
+from benchmarks.synthetic import user_histories
+from utils.coclick import coclick_positive_pairs
+
+def loop_positive_pairs(user_history_dict, news_click_dict):#former implementation in build_item2item_dataset
+    doc_doc_dict = {}
+    for user in user_history_dict:
+        list_user_his = list(user_history_dict[user])
+        for i in range(len(list_user_his) - 1):
+            for j in range(i + 1, len(list_user_his)):
+                doc1 = list_user_his[i]
+                doc2 = list_user_his[j]
+                if doc1 != doc2:
+                    if (doc1, doc2) not in doc_doc_dict and (doc2, doc1) not in doc_doc_dict:
+                        doc_doc_dict[(doc1, doc2)] = 1
+                    elif (doc1, doc2) in doc_doc_dict and (doc2, doc1) not in doc_doc_dict:
+                        doc_doc_dict[(doc1, doc2)] = doc_doc_dict[(doc1, doc2)] + 1
+                    elif (doc2, doc1) in doc_doc_dict and (doc1, doc2) not in doc_doc_dict:
+                        doc_doc_dict[(doc2, doc1)] = doc_doc_dict[(doc2, doc1)] + 1
+    weight_doc_doc_dict = {}
+    for item in doc_doc_dict:
+        if item[0] in news_click_dict and item[1] in news_click_dict:
+            weight_doc_doc_dict[item] = doc_doc_dict[item] / math.sqrt(news_click_dict[item[0]] * news_click_dict[item[1]])
+    THRED_CLICK_TIME = 10
+    freq_news_set = set()
+    for news in news_click_dict:
+        if news_click_dict[news] > THRED_CLICK_TIME:
+            freq_news_set.add(news)
+    news_positive_pairs = []
+    for item in weight_doc_doc_dict:
+        if item[0] in freq_news_set and item[1] in freq_news_set and weight_doc_doc_dict[item]>0.05:
+            news_positive_pairs.append(item)
+    return news_positive_pairs, freq_news_set
+
+if __name__ == '__main__':
+    user_history_dict, news_click_dict = user_histories()
+    t1 = time.time()
+    loop_pairs, loop_freq_news = loop_positive_pairs(user_history_dict, news_click_dict)
+    t2 = time.time()
+    sparse_pairs, sparse_freq_news = coclick_positive_pairs(user_history_dict, news_click_dict)
+    t3 = time.time()
+    assert set(map(frozenset, loop_pairs)) == set(map(frozenset, sparse_pairs))
+    assert loop_freq_news == set(sparse_freq_news)
+    print("users: {}, news: {}, positive pairs: {}".format(len(user_history_dict), len(news_click_dict), len(sparse_pairs)))
+    print("loop: {:.3f}s, sparse: {:.3f}s, speedup: {:.1f}x".format(t2-t1, t3-t2, (t2-t1)/(t3-t2)))
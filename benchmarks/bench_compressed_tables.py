@@ -0,0 +1,60 @@
+"""Compare projecting every gathered entity with entity_compress against the KGFeatureStore compressed lookups.
+
+    $ python -m benchmarks.bench_compressed_tables [batch_size] [num_entities] [device]
+
+The ids mimic the neighbor table of an AnchorKG anchor graph, (batch, 50, 20) with a few popular entities.
+Training projects the unique ids of the batch, inference gathers from the table projected once.
+"""
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from model.kg_features import KGFeatureStore
+from utils.embedding_store import DocEmbeddingStore
+from utils.news_columns import NewsVocab
+
+def timeit(fn, repeat):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t = time.time()
+    for _ in range(repeat):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - t) / repeat
+
+def bench(batch_size, num_entities, device, repeat=20):
+    rng = np.random.default_rng(2022)
+    torch.manual_seed(2022)
+    store = KGFeatureStore(torch.randn(num_entities, 100), torch.randn(800, 100), DocEmbeddingStore(NewsVocab([]), np.zeros((0, 768), dtype=np.float32)), device=device)
+    compress = nn.Sequential(nn.Linear(100, 128, bias=False), nn.Tanh()).to(device)
+    ids = torch.from_numpy((rng.zipf(1.2, (batch_size, 50, 20)) - 1) % num_entities).to(device)
+    unique_num = len(torch.unique(ids))
+
+    naive = compress(store.entities(ids))
+    assert torch.allclose(naive, store.compressed_entities(ids, compress), atol=1e-6)
+    with torch.no_grad():
+        assert torch.allclose(naive, store.compressed_entities(ids, compress), atol=1e-6)
+
+    def train_step(lookup):
+        lookup().sum().backward()
+    train_naive = timeit(lambda: train_step(lambda: compress(store.entities(ids))), repeat)
+    train_unique = timeit(lambda: train_step(lambda: store.compressed_entities(ids, compress)), repeat)
+    with torch.no_grad():
+        infer_naive = timeit(lambda: compress(store.entities(ids)), repeat)
+        infer_cached = timeit(lambda: store.compressed_entities(ids, compress), repeat)#the table is projected by the warm up call
+        compress[0].weight.add_(0.01)#like an optimizer step, invalidates the table
+        assert torch.allclose(compress(store.entities(ids)), store.compressed_entities(ids, compress), atol=1e-6)
+
+    flops = lambda rows: 2 * rows * 100 * 128
+    print("ids: {} ({} unique), entities: {}, device: {}".format(ids.numel(), unique_num, num_entities, device))
+    print("training  fwd+bwd: every id {:.2f}ms ({:.1f} MFLOP), unique ids {:.2f}ms ({:.1f} MFLOP)".format(
+        train_naive*1000, flops(ids.numel())/1e6, train_unique*1000, flops(unique_num)/1e6))
+    print("inference forward: every id {:.2f}ms ({:.1f} MFLOP), cached table {:.2f}ms (0 MFLOP per batch, {:.1f} MFLOP per weight change)".format(
+        infer_naive*1000, flops(ids.numel())/1e6, infer_cached*1000, flops(num_entities)/1e6))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 64, int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+          torch.device(sys.argv[3] if len(sys.argv) > 3 else ('cuda' if torch.cuda.is_available() else 'cpu')))
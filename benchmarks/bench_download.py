@@ -0,0 +1,138 @@
+"""Download and extract a synthetic archive from a local HTTP server with range requests.
+
+    $ python -m benchmarks.bench_download [size_mb] [per_connection_mb_per_s]
+
+The server stands in for the MIND/KG blob storage: it answers HEAD and Range requests, limits the
+bandwidth of each connection and drops the first requests half way to check that downloads resume.
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from utils.download import download_file, extract_zip
+
+class RangeHandler(BaseHTTPRequestHandler):
+    root = None
+    rate = None#bytes per second per connection
+    fail_requests = 0#number of next GET requests dropped after half of their bytes
+    byte_budget = None#bytes served before every request is dropped, None for no limit
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def send_file_headers(self):
+        filename = os.path.join(self.root, self.path.lstrip('/'))
+        if not os.path.exists(filename):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(filename)
+        start, end = 0, size
+        if 'Range' in self.headers:
+            first, last = self.headers['Range'].split('=')[1].split('-')
+            start, end = int(first), min(int(last) + 1, size)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end-1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', '"{}"'.format(int(os.path.getmtime(filename))))
+        self.end_headers()
+        return filename, start, end
+
+    def do_HEAD(self):
+        self.send_file_headers()
+
+    def do_GET(self):
+        headers = self.send_file_headers()
+        if headers is None:
+            return
+        filename, start, end = headers
+        with RangeHandler.lock:
+            fail = RangeHandler.fail_requests > 0
+            RangeHandler.fail_requests -= fail
+            stop = start + (end - start) // 2 if fail else end
+            if RangeHandler.byte_budget is not None:
+                fail |= RangeHandler.byte_budget < stop - start
+                stop = start + min(stop - start, RangeHandler.byte_budget)
+                RangeHandler.byte_budget -= stop - start
+        block_bytes = 256*1024
+        t = time.time()
+        with open(filename, 'rb') as fp:
+            fp.seek(start)
+            position = start
+            while position < stop:
+                block = fp.read(min(block_bytes, stop - position))
+                self.wfile.write(block)
+                position += len(block)
+                if self.rate:
+                    time.sleep(max(0, (position - start) / self.rate - (time.time() - t)))
+        if fail:
+            self.close_connection = True
+
+def serve(root, rate):
+    RangeHandler.root = root
+    RangeHandler.rate = rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def write_archive(filename, size_mb):
+    rng = np.random.default_rng(2022)
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED) as fz:
+        fz.writestr('train/news.tsv', rng.integers(0, 255, size_mb * 1024 * 1024 // 2, dtype=np.uint8).tobytes())
+        fz.writestr('train/behaviors.tsv', rng.integers(0, 255, size_mb * 1024 * 1024 // 2, dtype=np.uint8).tobytes())
+
+def sha256(filename):
+    with open(filename, 'rb') as fp:
+        return 'sha256:' + hashlib.sha256(fp.read()).hexdigest()
+
+def bench(size_mb, rate_mb):
+    with tempfile.TemporaryDirectory() as root:
+        remote = os.path.join(root, 'remote')
+        os.makedirs(remote)
+        write_archive(os.path.join(remote, 'MINDdemo_train.zip'), size_mb)
+        checksum = sha256(os.path.join(remote, 'MINDdemo_train.zip'))
+        server = serve(remote, rate_mb * 1024 * 1024)
+        url = 'http://127.0.0.1:{}/MINDdemo_train.zip'.format(server.server_address[1])
+        timings = []
+        for num_connections in [1, 4]:
+            target = os.path.join(root, 'local{}'.format(num_connections), 'MINDdemo_train.zip')
+            t = time.time()
+            download_file(url, target, checksum, num_connections=num_connections, range_bytes=4*1024*1024)
+            timings.append(time.time() - t)
+            assert sha256(target) == checksum
+
+        target = os.path.join(root, 'resume', 'MINDdemo_train.zip')
+        RangeHandler.byte_budget = size_mb * 1024 * 1024 // 2#the connection is lost half way, the download stops with some ranges written
+        try:
+            download_file(url, target, checksum, num_connections=4, range_bytes=4*1024*1024)
+        except IOError:
+            pass
+        assert not os.path.exists(target) and os.path.exists(target + '.part.json')
+        RangeHandler.byte_budget = None
+        RangeHandler.fail_requests = 2#then two dropped connections are retried
+        download_file(url, target, checksum, num_connections=4, range_bytes=4*1024*1024)
+        assert sha256(target) == checksum and not os.path.exists(target + '.part')
+
+        mirror_file = download_file('http://127.0.0.1:1/unreachable.zip', os.path.join(root, 'mirrored', 'MINDdemo_train.zip'), checksum, mirror_dir=os.path.dirname(target))
+        assert mirror_file == target
+
+        t = time.time()
+        extract_zip(target, os.path.join(root, 'extracted'))
+        extract_time = time.time() - t
+        with zipfile.ZipFile(target) as fz:
+            for info in fz.infolist():
+                assert os.path.getsize(os.path.join(root, 'extracted', info.filename)) == info.file_size
+        server.shutdown()
+        print("archive: {}MB at {}MB/s per connection, 1 connection: {:.2f}s, 4 connections: {:.2f}s ({:.1f}x), resumed and verified, extract: {:.2f}s".format(
+            size_mb, rate_mb, timings[0], timings[1], timings[0]/timings[1], extract_time))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 64, float(sys.argv[2]) if len(sys.argv) > 2 else 32)
@@ -0,0 +1,88 @@
+"""Compare the CSR knowledge graph ingestion with the former line by line build_adj_matrix.
+
+    $ python -m benchmarks.bench_kg
+"""
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import torch
+from benchmarks.synthetic import write_kg
+from utils.kg_graph import read_id_file, read_triples, KnowledgeGraph
+
+def loop_adj_matrix(kg_dir, news_entity_num):#former build_ent_rel_2id + build_adj_matrix
+    id_dicts = []
+    for filename in ['entity2id.txt', 'relation2id.txt']:
+        id_dict = {}
+        fp = open(os.path.join(kg_dir, filename), 'r', encoding='utf-8')
+        _ = fp.readline()
+        for line in fp:
+            linesplit = line.split('\n')[0].split('\t')
+            id_dict[linesplit[0]] = int(linesplit[1])+1
+        id_dicts.append(id_dict)
+    entity_id_dict, relation_id_dict = id_dicts
+    adj = {}
+    for line in open(os.path.join(kg_dir, 'wikidata-graph.tsv'), 'r', encoding='utf-8'):
+        head, relation, tail = line.split('\n')[0].split('\t')
+        if entity_id_dict[head] not in adj:
+            adj[entity_id_dict[head]] = [(entity_id_dict[tail],relation_id_dict[relation])]
+        else:
+            adj[entity_id_dict[head]].append((entity_id_dict[tail],relation_id_dict[relation]))
+    entity_adj = torch.zeros([len(entity_id_dict)+1, news_entity_num], dtype=torch.long)
+    relation_adj = torch.zeros([len(entity_id_dict)+1, news_entity_num], dtype=torch.long)
+    for key in adj:
+        tail_rel = adj[key] + [(0,0)]*(news_entity_num-len(adj[key])) if len(adj[key])<news_entity_num else random.sample(adj[key], news_entity_num)
+        entity_adj[key] = torch.tensor([x[0] for x in tail_rel], dtype=torch.long)
+        relation_adj[key] = torch.tensor([x[1] for x in tail_rel], dtype=torch.long)
+    return entity_adj, relation_adj, adj
+
+def padded_adjacency(kg, neighbor_num, rng):
+    """Dense (num_entities, neighbor_num) neighbor tables of a KnowledgeGraph padded with 0, as build_adj_matrix built them.
+
+    An entity keeps all its edges if it has at most `neighbor_num` of them, otherwise
+    `neighbor_num` edges are sampled without replacement.
+
+    Returns:
+        np.ndarray: int64 neighbor entities and relations.
+    """
+    degree = kg.degree().astype(np.int64)
+    heads = np.repeat(np.arange(kg.num_entities), degree)
+    position = np.arange(kg.num_edges) - kg.indptr[heads]
+    key = position.astype(np.float64)
+    sampled = degree[heads] > neighbor_num
+    key[sampled] = rng.random(np.count_nonzero(sampled))#random order of the edges of high degree entities
+    order = np.lexsort((key, heads))
+    rank = np.empty(kg.num_edges, dtype=np.int64)
+    rank[order] = position
+    keep = rank < neighbor_num
+
+    entity_adj = np.zeros([kg.num_entities, neighbor_num], dtype=np.int64)
+    relation_adj = np.zeros([kg.num_entities, neighbor_num], dtype=np.int64)
+    entity_adj[heads[keep], rank[keep]] = kg.indices[keep]
+    relation_adj[heads[keep], rank[keep]] = kg.relations[keep]
+    return entity_adj, relation_adj
+
+def csr_adj_matrix(kg_dir, news_entity_num):
+    entity_id_dict = read_id_file(os.path.join(kg_dir, 'entity2id.txt'))
+    relation_id_dict = read_id_file(os.path.join(kg_dir, 'relation2id.txt'))
+    heads, relations, tails = read_triples(os.path.join(kg_dir, 'wikidata-graph.tsv'), entity_id_dict, relation_id_dict)
+    kg = KnowledgeGraph.from_triples(heads, relations, tails, len(entity_id_dict)+1)
+    entity_adj, relation_adj = padded_adjacency(kg, news_entity_num, np.random.default_rng(2022))
+    return torch.from_numpy(entity_adj), torch.from_numpy(relation_adj)
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as kg_dir:
+        write_kg(kg_dir, num_entities=1000000, num_relations=500, num_triples=3000000, embedding_size=1)
+        t1 = time.time()
+        loop_entity_adj, loop_relation_adj, adj = loop_adj_matrix(kg_dir, 20)
+        t2 = time.time()
+        entity_adj, relation_adj = csr_adj_matrix(kg_dir, 20)
+        t3 = time.time()
+    for key, edges in adj.items():#same rows for entities with <= 20 edges, sampled edges otherwise
+        if len(edges) < 20:
+            assert torch.equal(entity_adj[key], loop_entity_adj[key]) and torch.equal(relation_adj[key], loop_relation_adj[key])
+        else:
+            assert set(zip(entity_adj[key].tolist(), relation_adj[key].tolist())) <= set(edges)
+    print("entities: {}, triples: {}".format(entity_adj.shape[0]-1, sum(map(len, adj.values()))))
+    print("loop: {:.3f}s, csr: {:.3f}s, speedup: {:.1f}x".format(t2-t1, t3-t2, (t2-t1)/(t3-t2)))
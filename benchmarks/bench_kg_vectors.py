@@ -0,0 +1,41 @@
+"""Compare the entity vector loader with the former line by line float64 parsing.
+
+    $ python -m benchmarks.bench_kg_vectors [path/to/entity2vecd100.vec]
+
+Without a path, a synthetic file of 500k entities is generated.
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from utils.kg_vectors import load_vec, vec_sidecar
+
+def loop_vec(filename, num):#former build_entity_relation_embedding
+    embedding = np.zeros((num+1, 100))
+    for i, line in enumerate(open(filename, 'r', encoding='utf-8')):
+        embedding[i+1] = np.array(line.strip().split('\t')).astype(np.float64)
+    return embedding.astype(np.float32)
+
+def bench(filename):
+    num = sum(1 for _ in open(filename, 'rb'))
+    if os.path.exists(vec_sidecar(filename)):
+        os.remove(vec_sidecar(filename))
+    t1 = time.time()
+    loop_vectors = loop_vec(filename, num)
+    t2 = time.time()
+    vectors = load_vec(filename)#parse and write the sidecar
+    t3 = time.time()
+    cached_vectors = load_vec(filename)#memory-map the sidecar
+    t4 = time.time()
+    assert np.array_equal(vectors, loop_vectors) and np.array_equal(cached_vectors, loop_vectors)
+    print("vectors: {}, loop: {:.3f}s, bulk parse: {:.3f}s ({:.1f}x), sidecar: {:.4f}s".format(num, t2-t1, t3-t2, (t2-t1)/(t3-t2), t4-t3))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        bench(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as kg_dir:
+            filename = os.path.join(kg_dir, 'entity2vecd100.vec')
+            np.savetxt(filename, np.random.default_rng(2022).standard_normal((500000, 100)), fmt='%.6f', delimiter='\t')
+            bench(filename)
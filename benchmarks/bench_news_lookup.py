@@ -0,0 +1,57 @@
+"""Compare the ways of building a batch of news embeddings.
+
+    $ python -m benchmarks.bench_news_lookup [num_news] [batch_size] [device]
+
+- dict loop: a dict of per news tensors copied row by row into a zeroed batch, then moved to the device
+- store ids: DocEmbeddingStore.get_batch, a vocabulary lookup and a gather of the memory-mapped matrix
+- store rows: rows mapped in the dataset, one index_select on the matrix already on the device
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from benchmarks.synthetic import news_ids
+from utils.embedding_store import DocEmbeddingStore
+
+def timeit(fn, repeat):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t = time.time()
+    for _ in range(repeat):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - t) / repeat
+
+def bench(num_news, batch_size, device, repeat=200):
+    rng = np.random.default_rng(2022)
+    ids = news_ids(num_news)
+    embeddings = rng.standard_normal((num_news, 768)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as root:
+        store = DocEmbeddingStore.write(os.path.join(root, 'doc_feature_embedding.npy'), ids, embeddings)
+        store = DocEmbeddingStore.load(os.path.join(root, 'doc_feature_embedding.npy')).to(device)
+        mmap_store = DocEmbeddingStore.load(os.path.join(root, 'doc_feature_embedding.npy'), on_device=False).to(device)
+        doc_feature_embedding = {newsid: torch.from_numpy(embeddings[i]) for i, newsid in enumerate(ids)}
+        batch = [ids[i] for i in rng.integers(0, num_news, batch_size)]
+        rows = store.rows(batch)
+
+        def dict_loop():
+            news_embeddings = torch.zeros([len(batch), 768])
+            for i, newsid in enumerate(batch):
+                news_embeddings[i] = doc_feature_embedding[newsid]
+            return news_embeddings.to(device)
+
+        results = [dict_loop(), store.get_batch(batch).to(device), store.lookup(rows), mmap_store.lookup(rows)]
+        assert all(torch.equal(results[0], result) for result in results[1:])
+        timings = [timeit(dict_loop, repeat), timeit(lambda: store.get_batch(batch).to(device), repeat), timeit(lambda: store.lookup(rows), repeat),
+                   timeit(lambda: mmap_store.lookup(rows), repeat)]
+    print("news: {}, batch: {}, device: {}, per batch: dict loop {:.3f}ms, store ids {:.3f}ms, store rows {:.3f}ms ({:.0f}x), "
+          "memory-mapped rows {:.3f}ms".format(num_news, batch_size, device, timings[0]*1000, timings[1]*1000, timings[2]*1000,
+          timings[0]/timings[2], timings[3]*1000))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, int(sys.argv[2]) if len(sys.argv) > 2 else 256,
+          torch.device(sys.argv[3] if len(sys.argv) > 3 else ('cuda' if torch.cuda.is_available() else 'cpu')))
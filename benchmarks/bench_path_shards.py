@@ -0,0 +1,54 @@
+"""Compare loading KPRN path samples from packed shards with parsing the JSON lines file.
+
+    $ python -m benchmarks.bench_path_shards [path/to/train_data.json]
+
+Without a path, a synthetic file of 200k samples with up to 20 paths is generated.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from utils.path_shards import PathShards, shards_sidecar
+
+def write_samples(filename, num_samples, seed=2022):
+    rng = np.random.default_rng(seed)
+    with open(filename, 'w', encoding='utf-8') as fp:
+        for i in range(num_samples):
+            lengths = rng.integers(1, 4, rng.integers(1, 21))
+            paths = [rng.integers(1, 100000, length).tolist() for length in lengths]
+            edges = [[0] + rng.integers(1, 800, length-1).tolist() for length in lengths]
+            fp.write(json.dumps({"label": int(rng.random() < 0.3), "item1": "N{}".format(i % 5000), "item2": "N{}".format(rng.integers(5000)), "paths": paths, "edges": edges}) + "\n")
+
+def bench(filename):
+    shutil.rmtree(shards_sidecar(filename), ignore_errors=True)
+    t1 = time.time()
+    with open(filename, "r") as f:
+        data = [json.loads(line) for line in f.readlines()]
+    t2 = time.time()
+    PathShards.load(filename)#convert
+    t3 = time.time()
+    shards = PathShards.load(filename)#memory-map
+    t4 = time.time()
+    for i in range(len(data)):
+        torch.tensor(data[i]['paths'][0], dtype=torch.long)
+    t5 = time.time()
+    for i in range(len(shards)):
+        shards.sample(i)
+    t6 = time.time()
+    sample = shards.sample(len(shards) - 1)
+    assert len(shards) == len(data) and sample['paths'][0][:sample['lengths'][0]].tolist() == data[-1]['paths'][0]
+    print("samples: {}, json parse: {:.3f}s, convert: {:.3f}s, shard load: {:.4f}s, json tensors: {:.3f}s, shard samples: {:.3f}s".format(
+        len(data), t2-t1, t3-t2, t4-t3, t5-t4, t6-t5))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        bench(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            filename = os.path.join(data_dir, 'train_data.json')
+            write_samples(filename, 200000)
+            bench(filename)
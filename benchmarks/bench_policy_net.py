@@ -0,0 +1,63 @@
+"""Compare the fused AnchorKG policy network with the former one that tiled the state and ran actor_l1 twice.
+
+    $ python -m benchmarks.bench_policy_net [batch_size] [device]
+
+Both use the same parameters: outputs and gradients are checked to match and the state dict keys are unchanged.
+"""
+import sys
+import time
+import torch
+from model.AnchorKG import Net
+
+def tiled_forward(net, state_input, action_input):#former Net.forward
+    if len(state_input.shape) < len(action_input.shape):
+        if len(action_input.shape) == 3:
+            state_input = torch.unsqueeze(state_input, 1)
+            state_input = state_input.expand(state_input.shape[0], action_input.shape[1], state_input.shape[2])
+        else:
+            state_input = torch.unsqueeze(state_input, 1)
+            state_input = torch.unsqueeze(state_input, 1)
+            state_input = state_input.expand(state_input.shape[0], action_input.shape[1], action_input.shape[2], state_input.shape[3])
+    actor_x = net.elu(net.actor_l1(torch.cat([state_input, action_input], dim=-1)))
+    actor_out = net.elu(net.actor_l2(actor_x))
+    act_probs = net.softmax(net.actor_l3(actor_out))
+    critic_x = net.elu(net.actor_l1(torch.cat([state_input, action_input], dim=-1)))
+    critic_out = net.elu(net.critic_l2(critic_x))
+    values = net.critic_l3(critic_out).mean(dim=-2)
+    return act_probs, values
+
+def timeit(fn, repeat):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t = time.time()
+    for _ in range(repeat):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - t) / repeat
+
+def bench(batch_size, device, repeat=20):
+    torch.manual_seed(2022)
+    net = Net({'embedding_size': 128}, None, None).to(device)
+    assert sorted(net.state_dict()) == sorted(['actor_l1.weight', 'actor_l1.bias', 'actor_l2.weight', 'actor_l2.bias', 'actor_l3.weight', 'actor_l3.bias',
+                                                'critic_l2.weight', 'critic_l2.bias', 'critic_l3.weight', 'critic_l3.bias'])
+    state_input = torch.randn(batch_size, 128*3, device=device)
+    for action_shape in [(batch_size, 20, 128), (batch_size, 5, 20, 128), (batch_size, 15, 20, 128), (batch_size, 128)]:
+        action_input = torch.randn(*action_shape, device=device)
+        outputs = []
+        for forward in [tiled_forward, Net.forward]:
+            net.zero_grad()
+            act_probs, values = forward(net, state_input, action_input)
+            (act_probs.log().sum() + values.pow(2).sum()).backward()
+            outputs.append([act_probs, values] + [parameter.grad.clone() for parameter in net.parameters()])
+        assert all((x - y).abs().max() <= 1e-4 * max(y.abs().max(), 1) for x, y in zip(*outputs)), action_shape#the grad of actor_l3.bias is 0 up to rounding, softmax is shift invariant
+
+        def step(forward):
+            act_probs, values = forward(net, state_input, action_input)
+            (act_probs.log().sum() + values.pow(2).sum()).backward()
+        tiled, fused = timeit(lambda: step(tiled_forward), repeat), timeit(lambda: step(Net.forward), repeat)
+        print("action {}: forward+backward tiled {:.2f}ms, fused {:.2f}ms ({:.1f}x)".format(tuple(action_shape), tiled*1000, fused*1000, tiled/fused))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 64, torch.device(sys.argv[2] if len(sys.argv) > 2 else ('cuda' if torch.cuda.is_available() else 'cpu')))
@@ -0,0 +1,96 @@
+"""Compare running AnchorKG on both pair columns of a training batch with running it once per distinct news.
+
+    $ python -m benchmarks.bench_train_dedup [num_batches] [batch_size] [device]
+
+Pairs mimic random_neg_sample_train with train_neg_num=4: an item1 is in 5 consecutive pairs, the item1 and the
+item2 of the positive pair follow the news popularity and negatives are uniform. Batches are taken in file order
+(an item1 is 5 times in a batch) and shuffled as by the RandomSampler of the train dataloader (repeated news are
+mostly popular ones). Each step runs the anchor policy, the recommender and the backward of the recommender loss and
+of the actor critic loss with per pair terminal rewards, as in Trainer._train_epoch (the reasoner is left out, its
+paths are searched per pair either way).
+With greedy actions (no sampling) and fixed neighbor samples both ways take the same anchors: the losses and gradients
+are checked to match, so the rewards of every pair reach the actions of the shared anchor graph.
+"""
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+import torch
+from benchmarks.synthetic import anchor_model
+from model.Recommender import Recommender
+from trainer.trainer import Trainer
+
+def batches(num_batches, batch_size, num_news, shuffle, train_neg_num=4, num_pairs=100000, seed=2022):
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / np.arange(1, num_news+1) ** 0.8
+    popularity /= popularity.sum()
+    positives = num_pairs // (1+train_neg_num)
+    item1 = np.repeat(rng.choice(num_news, positives, p=popularity), 1+train_neg_num)
+    item2 = rng.integers(0, num_news, len(item1))
+    item2[::1+train_neg_num] = rng.choice(num_news, positives, p=popularity)
+    order = rng.permutation(len(item1)) if shuffle else np.arange(len(item1))
+    for start in range(0, num_batches * batch_size, batch_size):
+        index = order[start:start+batch_size]
+        yield torch.from_numpy(item1[index]), torch.from_numpy(item2[index])
+
+def train_step(trainer, forward, item1, item2, reasoning_loss):
+    outputs1, outputs2, embedding_predict = forward(item1, item2)
+    embedding_loss = (embedding_predict - 0.5) ** 2#any per pair loss of the recommender
+    actor_loss_list = []
+    critic_loss_list = []
+    trainer.actor_critic_loss(outputs1[2], outputs1[0], outputs1[1], embedding_loss, reasoning_loss, actor_loss_list, critic_loss_list)
+    trainer.actor_critic_loss(outputs2[2], outputs2[0], outputs2[1], embedding_loss, reasoning_loss, actor_loss_list, critic_loss_list)
+    loss = torch.stack(actor_loss_list).sum() + torch.stack(critic_loss_list).sum() + embedding_loss.mean()
+    trainer.model_anchor.zero_grad()
+    trainer.model_recommender.zero_grad()
+    loss.backward()
+    return loss
+
+def bench(num_batches, batch_size, device, num_news=5000):
+    model, _ = anchor_model(num_news=num_news, device=device, config={'anchor_inference': 'greedy'})
+    recommender = Recommender(model.config, model.kg_features, device)
+    recommender.get_neighbors = lambda entities: model.kg_features.neighbors(entities, model.config['news_entity_num'], fixed=True)
+    trainer = SimpleNamespace(model_anchor=model, model_recommender=recommender, device=device, config=dict(model.config, alpha1=0.9, alpha2=0.1, gamma=1.0, train_distinct_news=True))
+    trainer.actor_critic_loss = lambda *args: Trainer.actor_critic_loss(trainer, *args)
+
+    def per_column(item1, item2):
+        outputs1, outputs2 = model(item1), model(item2)
+        return outputs1, outputs2, recommender(item1, item2, outputs1[3], outputs2[3])[0]
+
+    def distinct_news(item1, item2):
+        news, outputs, index1, index2 = Trainer.pair_anchor_graphs(trainer, item1, item2)
+        gathered = [[Trainer.gather_steps(steps, index) for steps in outputs] for index in [index1, index2]]
+        return gathered[0], gathered[1], recommender.forward_distinct(news, outputs[3], index1, index2)[0]
+
+    model.eval()#greedy actions under autograd, the same anchors both ways
+    item1, item2 = next(batches(1, batch_size, num_news, False, seed=1))
+    reasoning_loss = torch.rand(len(item1), device=device)
+    gradients = []
+    for forward in [per_column, distinct_news]:
+        loss = train_step(trainer, forward, item1, item2, reasoning_loss)
+        gradients.append([loss] + [parameter.grad.clone() for parameter in list(model.parameters()) + list(recommender.parameters()) if parameter.grad is not None])
+    assert all(torch.allclose(x, y, atol=1e-5, rtol=1e-4) for x, y in zip(*gradients))
+    model.train()
+
+    print("batches: {} of {} pairs, news: {}, device: {}, losses and gradients match with greedy actions".format(num_batches, batch_size, num_news, device))
+    for shuffle in [False, True]:
+        timings = {}
+        distinct = 0
+        for name, forward in [('per column', per_column), ('distinct news', distinct_news)]:
+            torch.manual_seed(2022)
+            t = time.time()
+            for item1, item2 in batches(num_batches, batch_size, num_news, shuffle):
+                train_step(trainer, forward, item1, item2, torch.rand(len(item1), device=device))
+                distinct += len(torch.unique(torch.cat([item1, item2]))) if name == 'per column' else 0
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            timings[name] = time.time() - t
+        pairs = num_batches * batch_size
+        print("{}: {:.1f} distinct news per batch out of {}, anchor policy and recommender forward+backward: per column {:.2f}s ({:.0f} pairs/s), "
+              "distinct news {:.2f}s ({:.0f} pairs/s), {:.2f}x".format('shuffled' if shuffle else 'file order', distinct/num_batches, 2*batch_size,
+              timings['per column'], pairs/timings['per column'], timings['distinct news'], pairs/timings['distinct news'],
+              timings['per column']/timings['distinct news']))
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 50, int(sys.argv[2]) if len(sys.argv) > 2 else 64,
+          torch.device(sys.argv[3] if len(sys.argv) > 3 else ('cuda' if torch.cuda.is_available() else 'cpu')))
@@ -0,0 +1,64 @@
+"""Check that the out-of-core preprocessing writes the same files as the in-memory one, and compare their peak RSS.
+
+    $ python -m benchmarks.check_out_of_core [num_users] [num_impressions] [memory_budget_mb]
+
+build_item2item_dataset and build_doc_feature run on synthetic MIND files, once in memory and once with
+config['memory_budget_mb'], each in a process of its own (see utils.stage_graph). The sentence encoder is
+replaced by a deterministic random projection so no model is downloaded.
+"""
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import utils.doc_encoder as doc_encoder
+from benchmarks.synthetic import write_behaviors, write_news
+from utils.stage_graph import Stage, run_stages
+from utils.util import build_item2item_dataset, build_doc_feature
+
+class HashEncoder:#stands in for SentenceTransformer
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def encode(self, texts, batch_size, show_progress_bar):
+        return np.stack([np.random.default_rng(list(text.encode('utf-8'))).standard_normal(768).astype(np.float32) for text in texts])
+
+OUTPUTS = ['pos_train_file', 'pos_val_file', 'pos_test_file', 'all_news_file', 'doc_feature_entity_file', 'doc_feature_embedding_file']
+
+def write_data(datapath, num_users, num_impressions, num_news):
+    for part, seed in [('train', 1), ('valid', 2)]:
+        os.makedirs(os.path.join(datapath, 'mind', part))
+        write_behaviors(os.path.join(datapath, 'mind', part, 'behaviors.tsv'), num_users, num_news, num_impressions, seed)
+        write_news(os.path.join(datapath, 'mind', part, 'news.tsv'), num_news, seed=seed)
+
+def run(config, datapath, memory_budget_mb):
+    config = dict(config, datapath=datapath, cache_path=datapath + '/cache', memory_budget_mb=memory_budget_mb)
+    stages = [Stage('item2item', build_item2item_dataset), Stage('doc_feature', build_doc_feature)]
+    return run_stages(stages, config, config['cache_path'], 1)
+
+def check(num_users, num_impressions, memory_budget_mb):
+    doc_encoder.SentenceTransformer = HashEncoder#inherited by the forked stage processes
+    with open('config/data_config.json', 'r', encoding='utf-8') as fp:
+        config = json.load(fp)
+    config['num_workers'] = 2
+    with tempfile.TemporaryDirectory() as root:
+        in_memory, out_of_core = os.path.join(root, 'in_memory'), os.path.join(root, 'out_of_core')
+        write_data(in_memory, num_users, num_impressions, num_news=num_users // 2)
+        shutil.copytree(in_memory, out_of_core)
+        sizes = sum(os.path.getsize(os.path.join(in_memory, 'mind', part, name)) for part in ['train', 'valid'] for name in ['behaviors.tsv', 'news.tsv'])
+        reports = [run(config, in_memory, None), run(config, out_of_core, memory_budget_mb)]
+        for name in OUTPUTS:
+            files = [datapath + config[name] for datapath in [in_memory, out_of_core]]
+            if name == 'doc_feature_embedding_file':
+                assert np.array_equal(np.load(files[0]), np.load(files[1])), name
+                files = [file[:-len('.npy')] + '_ids.txt' for file in files]
+            assert filecmp.cmp(files[0], files[1], shallow=False), name
+    print("input: {:.0f}MB, memory budget: {}MB, outputs identical".format(sizes / 2**20, memory_budget_mb))
+    for stage in ['item2item', 'doc_feature']:
+        print("{:<12} in memory: {:6.1f}s {:6.0f}MB peak rss, out of core: {:6.1f}s {:6.0f}MB peak rss".format(
+            stage, reports[0][stage]['wall_time'], reports[0][stage]['peak_rss'] / 2**20, reports[1][stage]['wall_time'], reports[1][stage]['peak_rss'] / 2**20))
+
+if __name__ == '__main__':
+    check(int(sys.argv[1]) if len(sys.argv) > 1 else 20000, int(sys.argv[2]) if len(sys.argv) > 2 else 200000, int(sys.argv[3]) if len(sys.argv) > 3 else 64)
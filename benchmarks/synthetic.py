@@ -0,0 +1,100 @@
+"""Synthetic MIND-like data for the benchmarks, popularity of news follows a zipf distribution."""
+import os
+import json
+import numpy as np
+
+def news_ids(num_news):
+    return ['N' + str(i) for i in range(1, num_news+1)]
+
+def user_histories(num_users=20000, num_news=5000, mean_history=20, seed=2022):
+    """user_history_dict and news_click_dict as built by build_item2item_dataset."""
+    rng = np.random.default_rng(seed)
+    all_news = news_ids(num_news)
+    popularity = 1.0 / np.arange(1, num_news+1) ** 0.8
+    popularity /= popularity.sum()
+    user_history_dict = {}
+    news_click_dict = {}
+    for user in range(num_users):
+        history = rng.choice(num_news, size=rng.poisson(mean_history)+1, p=popularity)
+        user_history_dict['U' + str(user)] = set(all_news[i] for i in history)
+        for i in history:
+            news_click_dict[all_news[i]] = news_click_dict.get(all_news[i], 0) + 1
+    return user_history_dict, news_click_dict
+
+def write_behaviors(filename, num_users=2000, num_news=1000, num_impressions=10000, seed=2022):
+    """MIND behaviors.tsv: index, user id, time, history, impressions."""
+    rng = np.random.default_rng(seed)
+    all_news = news_ids(num_news)
+    popularity = 1.0 / np.arange(1, num_news+1) ** 0.8
+    popularity /= popularity.sum()
+    histories = [[all_news[i] for i in rng.choice(num_news, size=rng.poisson(10), p=popularity)] for _ in range(num_users)]
+    with open(filename, 'w', encoding='utf-8') as fp:
+        for index in range(num_impressions):
+            user = int(rng.integers(num_users))
+            impressions = rng.choice(num_news, size=rng.integers(1, 10), p=popularity)
+            labels = rng.random(len(impressions)) < 0.3
+            behavior = ' '.join(all_news[i] + '-' + str(int(label)) for i, label in zip(impressions, labels))
+            fp.write('\t'.join([str(index+1), 'U' + str(user), '11/11/2019 9:05:58 AM', ' '.join(histories[user]), behavior]) + '\n')
+
+def write_kg(kg_dir, num_entities=500, num_relations=20, num_triples=5000, embedding_size=100, seed=2022):
+    """Wikidata graph files: triples, entity2id, relation2id and TransE vectors."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(kg_dir, exist_ok=True)
+    with open(os.path.join(kg_dir, 'entity2id.txt'), 'w', encoding='utf-8') as fp:
+        fp.write(str(num_entities) + '\n')
+        for i in range(num_entities):
+            fp.write('Q' + str(i+1) + '\t' + str(i) + '\n')
+    with open(os.path.join(kg_dir, 'relation2id.txt'), 'w', encoding='utf-8') as fp:
+        fp.write(str(num_relations) + '\n')
+        for i in range(num_relations):
+            fp.write('P' + str(i+1) + '\t' + str(i) + '\n')
+    heads = np.where(rng.random(num_triples) < 0.8, rng.integers(0, num_entities, size=num_triples), rng.zipf(1.5, size=num_triples) % num_entities)#a few hubs
+    with open(os.path.join(kg_dir, 'wikidata-graph.tsv'), 'w', encoding='utf-8') as fp:
+        for head, relation, tail in zip(heads, rng.integers(0, num_relations, size=num_triples), rng.integers(0, num_entities, size=num_triples)):
+            fp.write('Q' + str(head+1) + '\tP' + str(relation+1) + '\tQ' + str(tail+1) + '\n')
+    for filename, num in [('entity2vecd100.vec', num_entities), ('relation2vecd100.vec', num_relations)]:
+        np.savetxt(os.path.join(kg_dir, filename), rng.standard_normal((num, embedding_size)), fmt='%.6f', delimiter='\t')
+
+def write_news(filename, num_news=1000, num_entities=500, seed=2022):
+    """MIND news.tsv, each news mentions a few Wikidata entities Q1..Q<num_entities>."""
+    rng = np.random.default_rng(seed)
+    with open(filename, 'w', encoding='utf-8') as fp:
+        for newsid in news_ids(num_news):
+            entities = [{'WikidataId': 'Q' + str(int(i)+1)} for i in rng.choice(num_entities, size=rng.integers(0, 6), replace=False)]
+            title = ' '.join('word' + str(int(i)) for i in rng.integers(0, 1000, size=rng.integers(3, 12)))
+            fp.write('\t'.join([newsid, 'news', 'sub', title, 'abstract of ' + newsid, 'url', json.dumps(entities[:2]), json.dumps(entities[2:])]) + '\n')
+
+ANCHOR_CONFIG = {'doc_embedding_size': 768, 'entity_embedding_size': 100, 'embedding_size': 128, 'news_entity_num': 20,
+                 'neighbor_sampling': 'uniform', 'topk': [5, 3, 2],
+                 'anchor_sampling': 'categorical', 'anchor_inference': 'sample', 'anchor_beam_size': 3}
+
+def anchor_model(num_news=5000, num_entities=20000, num_triples=200000, device='cpu', config=None, seed=2022):
+    """AnchorKG on in-memory random data: zipf popular entities, news mentioning up to 8 entities, random hit pairs.
+
+    Returns:
+        AnchorKG, HitGraph: the model (random parameters) and the train hit graph of its news rows.
+    """
+    import torch
+    from model.AnchorKG import AnchorKG
+    from model.kg_features import KGFeatureStore
+    from utils.embedding_store import DocEmbeddingStore
+    from utils.kg_graph import KnowledgeGraph
+    from utils.news_columns import CSRMap, HitGraph, NewsVocab
+    rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    heads = (rng.zipf(1.3, num_triples) + rng.integers(0, num_entities, num_triples)) % (num_entities-1) + 1#0 is padding
+    kg_graph = KnowledgeGraph.from_triples(heads, rng.integers(1, 20, num_triples).astype(np.int32), rng.integers(1, num_entities, num_triples).astype(np.int32), num_entities)
+    doc_entity = np.zeros((num_news, 20), dtype=np.int32)
+    mentions = rng.integers(1, 9, num_news)
+    for row, mention in enumerate(mentions):
+        doc_entity[row, :mention] = (rng.zipf(1.3, mention) + rng.integers(0, 100, mention)) % (num_entities-1) + 1
+    news_of_mention = np.repeat(np.arange(num_news), 20)
+    entity_news = CSRMap.from_pairs(doc_entity.reshape(-1)[doc_entity.reshape(-1) > 0], news_of_mention[doc_entity.reshape(-1) > 0], num_entities)
+    pairs = rng.integers(0, num_news, (2, num_news * 4))
+    hit_graph = HitGraph.from_pairs((pairs[0], pairs[1]), (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)), num_news)
+    doc_store = DocEmbeddingStore(NewsVocab(news_ids(num_news)), rng.standard_normal((num_news, 768)).astype(np.float32))
+    kg_features = KGFeatureStore(torch.randn(num_entities, 100), torch.randn(21, 100), doc_store, kg_graph, device)
+    neibor_num = torch.from_numpy(np.diff(entity_news.indptr)).float().clamp(min=1)
+    model = AnchorKG(dict(ANCHOR_CONFIG, **(config or {})), kg_features, doc_entity, entity_news, hit_graph.view('train'), {},
+                     torch.randn(num_entities, 768), neibor_num, torch.device(device))
+    return model, hit_graph.view('train')
@@ -1,69 +1,112 @@
 from torch.utils.data import Dataset, DataLoader, RandomSampler, SequentialSampler
 from utils.util import *
-from KPRN_train import KPRN_Dataset
+from utils.cache_manifest import CacheManifest
+from utils.news_columns import CSRMap, HitGraph
+from KPRN_train import KPRN_ShardDataset
 
 class NewsDataset(Dataset):
-    def __init__(self, dic_data, transform=None):
+    def __init__(self, dic_data, news_vocab, transform=None):
         self.dic_data = dic_data
+        self.item1_rows = news_vocab.rows(dic_data['item1'])#rows of the doc embedding matrix, mapped once
+        self.item2_rows = news_vocab.rows(dic_data['item2'])
         self.transform = transform
     def __len__(self):
         return len(self.dic_data['label'])
     def __getitem__(self, idx):
         if torch.is_tensor(idx):
             idx = idx.tolist()
-        sample = {'item1': self.dic_data['item1'][idx], 'item2': self.dic_data['item2'][idx], 'label': self.dic_data['label'][idx]}
+        sample = {'item1': self.dic_data['item1'][idx], 'item2': self.dic_data['item2'][idx], 'label': self.dic_data['label'][idx],
+                  'item1_row': self.item1_rows[idx], 'item2_row': self.item2_rows[idx]}
         return sample
 
+def cached_artifact(manifest, name, key, output_files, build, save, load):#load an artifact if its key is unchanged, otherwise build and save it
+    if manifest.is_fresh(name, key, output_files):
+        print("{} is up to date, loading from cache ...".format(name))
+        return load()
+    artifact = build()
+    save(artifact)
+    manifest.record(name, key, output_files)
+    return artifact
+
+def cache_kg(config, manifest):
+    """Build or load the knowledge graph artifacts, they do not depend on the news.
+
+    Returns:
+        entity_id_dict, relation_id_dict, kg_graph, entity_embedding, relation_embedding
+    """
+    cache_path = config['cache_path']
+    datapath = config['datapath']
+
+    key = manifest.artifact_key('id_dict', 1, [datapath+config['entity2id_file'], datapath+config['relation2id_file']], {}, [])
+    entity_id_dict, relation_id_dict = cached_artifact(manifest, 'id_dict', key, [cache_path+"/entity_id_dict.npy", cache_path+"/relation_id_dict.npy"],
+        lambda: build_ent_rel_2id(config),
+        lambda artifact: (np.save(cache_path+"/entity_id_dict.npy", artifact[0]), np.save(cache_path+"/relation_id_dict.npy", artifact[1])),
+        lambda: (np.load(cache_path+"/entity_id_dict.npy", allow_pickle=True).item(), np.load(cache_path+"/relation_id_dict.npy", allow_pickle=True).item()))
+
+    key = manifest.artifact_key('kg_graph', 1, [datapath+config['kg_file']], {}, ['id_dict'])
+    kg_graph = cached_artifact(manifest, 'kg_graph', key, [cache_path+"/kg_graph/"+name+".npy" for name in ['indptr', 'indices', 'relations']],
+        lambda: build_knowledge_graph(config, entity_id_dict, relation_id_dict),
+        lambda artifact: artifact.save(cache_path+"/kg_graph"),
+        lambda: KnowledgeGraph.load(cache_path+"/kg_graph"))
+
+    entity_embedding, relation_embedding = build_entity_relation_embedding(config, len(entity_id_dict), len(relation_id_dict))#cached in .npy sidecars
+    return entity_id_dict, relation_id_dict, kg_graph, entity_embedding, relation_embedding
+
+def process_kg_and_cache(config):
+    os.makedirs(config['cache_path'], exist_ok=True)
+    cache_kg(config, CacheManifest(config['cache_path']))
+
 def process_data_and_cache(config):
-    entity_id_dict, relation_id_dict = build_ent_rel_2id(config)
-    entity_adj, relation_adj = build_adj_matrix(config, entity_id_dict, relation_id_dict)
-    entity_embedding, relation_embedding = build_entity_relation_embedding(config, len(entity_id_dict), len(relation_id_dict))
-    doc_entity_dict, entity_doc_dict = load_news_entity(config, entity_id_dict)
+    """Build the cached artifacts whose inputs changed since the last run and load the others.
+
+    Each artifact is keyed by its input files, the config keys it uses and its dependencies
+    (see CacheManifest), artifacts are processed in dependency order.
+    """
+    cache_path = config['cache_path']
+    datapath = config['datapath']
+    os.makedirs(cache_path, exist_ok=True)
+    manifest = CacheManifest(cache_path)
+
+    entity_id_dict, relation_id_dict, kg_graph, entity_embedding, relation_embedding = cache_kg(config, manifest)
     doc_feature_embedding = build_doc_feature_embedding(config)
-    neibor_embedding, neibor_num = build_neibor_embedding(config, entity_doc_dict, doc_feature_embedding, entity_id_dict)
-    hit_dict, train_val_hit_dict = build_hit_dict(config)
-    negative_sampling(config)
 
-    os.makedirs(config['cache_path'], exist_ok=True)
-    np.save(config['cache_path']+"/entity_id_dict.npy", entity_id_dict)
-    np.save(config['cache_path']+"/relation_id_dict.npy", relation_id_dict)
-    torch.save(entity_adj, config['cache_path']+"/entity_adj.pt")
-    torch.save(relation_adj, config['cache_path']+"/relation_adj.pt")
-    torch.save(entity_embedding, config['cache_path']+"/entity_embedding.pt")
-    torch.save(relation_embedding, config['cache_path']+"/relation_embedding.pt")
-    np.save(config['cache_path']+"/doc_entity_dict.npy", doc_entity_dict)
-    np.save(config['cache_path']+"/entity_doc_dict.npy", entity_doc_dict)
-    np.save(config['cache_path']+"/doc_feature_embedding.npy", doc_feature_embedding)
-    torch.save(neibor_embedding, config['cache_path']+"/neibor_embedding.pt")
-    torch.save(neibor_num, config['cache_path']+"/neibor_num.pt")
-    np.save(config['cache_path']+"/hit_dict.npy", hit_dict)
-    np.save(config['cache_path']+"/train_val_hit_dict.npy", train_val_hit_dict)
-    return entity_id_dict, relation_id_dict, entity_adj, relation_adj, entity_embedding, relation_embedding, doc_entity_dict, entity_doc_dict, doc_feature_embedding, neibor_embedding, neibor_num, hit_dict, train_val_hit_dict
+    doc_feature_embedding_file = datapath+config['doc_feature_embedding_file']
+    news_vocab = doc_feature_embedding.vocab#rows of all news keyed arrays
+    key = manifest.artifact_key('news_entity', 2, [datapath+config['doc_feature_entity_file'], DocEmbeddingStore.ids_file(doc_feature_embedding_file)], {'news_entity_num': config['news_entity_num']}, ['id_dict'])
+    doc_entity, entity_news = cached_artifact(manifest, 'news_entity', key, [cache_path+"/doc_entity.npy", cache_path+"/entity_news/indptr.npy", cache_path+"/entity_news/indices.npy"],
+        lambda: load_news_entity(config, entity_id_dict, news_vocab),
+        lambda artifact: (np.save(cache_path+"/doc_entity.npy", artifact[0]), artifact[1].save(cache_path+"/entity_news")),
+        lambda: (np.load(cache_path+"/doc_entity.npy", mmap_mode='r'), CSRMap.load(cache_path+"/entity_news")))
+
+    key = manifest.artifact_key('neibor_embedding', 1, [doc_feature_embedding_file, DocEmbeddingStore.ids_file(doc_feature_embedding_file)], {'doc_embedding_size': config['doc_embedding_size']}, ['news_entity'])
+    neibor_embedding, neibor_num = cached_artifact(manifest, 'neibor_embedding', key, [cache_path+"/neibor_embedding.pt", cache_path+"/neibor_num.pt"],
+        lambda: build_neibor_embedding(config, entity_news, doc_feature_embedding, entity_id_dict),
+        lambda artifact: (torch.save(artifact[0], cache_path+"/neibor_embedding.pt"), torch.save(artifact[1], cache_path+"/neibor_num.pt")),
+        lambda: (torch.load(cache_path+"/neibor_embedding.pt"), torch.load(cache_path+"/neibor_num.pt")))
+
+    key = manifest.artifact_key('hit_graph', 1, [datapath+config['pos_train_file'], datapath+config['pos_val_file'], DocEmbeddingStore.ids_file(doc_feature_embedding_file)], {}, [])
+    full_hit_graph = cached_artifact(manifest, 'hit_graph', key, [cache_path+"/hit_graph/"+layer+"/"+array+".npy" for layer in ['train', 'val'] for array in ['indptr', 'indices']],
+        lambda: build_hit_graph(config, news_vocab),
+        lambda artifact: artifact.save(cache_path+"/hit_graph"),
+        lambda: HitGraph.load(cache_path+"/hit_graph"))
+    hit_graph, train_val_hit_graph = full_hit_graph.view('train'), full_hit_graph.view('train_val')
+
+    key = manifest.artifact_key('negative_sampling', 3, [datapath+config['all_news_file'], datapath+config['pos_train_file'], datapath+config['pos_val_file']], {'train_neg_num': config['train_neg_num'], 'knowledge_neg_num': config['knowledge_neg_num'], 'seed': config['seed']}, ['news_entity', 'hit_graph'])
+    cached_artifact(manifest, 'negative_sampling', key, [datapath+config['train_file'], datapath+config['val_file']],
+        lambda: negative_sampling(config, news_vocab, doc_entity, entity_news, full_hit_graph),
+        lambda artifact: None,#negative_sampling writes train_file and val_file
+        lambda: None)
+
+    return entity_id_dict, relation_id_dict, kg_graph, entity_embedding, relation_embedding, doc_entity, entity_news, doc_feature_embedding, neibor_embedding, neibor_num, hit_graph, train_val_hit_graph
 
 def load_data(config):
 
-    if os.path.exists(config['cache_path']):
-        print("Loading data from cache...")
-        entity_id_dict = np.load(config['cache_path']+"/entity_id_dict.npy", allow_pickle=True).item()
-        #relation_id_dict = np.load(config['cache_path']+"/relation_id_dict.npy", allow_pickle=True).item()
-        entity_adj = torch.load(config['cache_path']+"/entity_adj.pt")
-        relation_adj = torch.load(config['cache_path']+"/relation_adj.pt")
-        entity_embedding = torch.load(config['cache_path']+"/entity_embedding.pt")
-        relation_embedding = torch.load(config['cache_path']+"/relation_embedding.pt")
-        doc_entity_dict = np.load(config['cache_path']+"/doc_entity_dict.npy", allow_pickle=True).item()
-        entity_doc_dict = np.load(config['cache_path']+"/entity_doc_dict.npy", allow_pickle=True).item()
-        doc_feature_embedding = np.load(config['cache_path']+"/doc_feature_embedding.npy", allow_pickle=True).item()
-        neibor_embedding = torch.load(config['cache_path']+"/neibor_embedding.pt")
-        neibor_num = torch.load(config['cache_path']+"/neibor_num.pt")
-        hit_dict = np.load(config['cache_path']+"/hit_dict.npy", allow_pickle=True).item()
-        train_val_hit_dict = np.load(config['cache_path']+"/train_val_hit_dict.npy", allow_pickle=True).item()
-    else:
-        entity_id_dict, relation_id_dict, entity_adj, relation_adj, entity_embedding, relation_embedding, doc_entity_dict, entity_doc_dict, doc_feature_embedding, neibor_embedding, neibor_num, hit_dict, train_val_hit_dict = process_data_and_cache(config)
+    entity_id_dict, relation_id_dict, kg_graph, entity_embedding, relation_embedding, doc_entity, entity_news, doc_feature_embedding, neibor_embedding, neibor_num, hit_graph, train_val_hit_graph = process_data_and_cache(config)
 
     Train_data = build_train(config)
     Val_data = build_val(config)
     Test_data = build_test(config)
-    train_dataset = NewsDataset(Train_data)
+    train_dataset = NewsDataset(Train_data, doc_feature_embedding.vocab)
     train_dataloader = DataLoader(
         dataset=train_dataset, 
         batch_size=config['batch_size'],
@@ -72,29 +115,19 @@ def load_data(config):
     )
 
     if config['warm_up']:
-        with open(config['datapath']+config['warm_up_train_file'], "r") as f:
-            warmup_train_data = [json.loads(line) for line in f.readlines()]
-        with open(config['datapath']+config['warm_up_dev_file'], "r") as f:
-            warmup_dev_data = [json.loads(line) for line in f.readlines()]
-        
-        warmup_train_dataset = KPRN_Dataset(warmup_train_data)
-        warmup_dev_dataset = KPRN_Dataset(warmup_dev_data)
-
-        def collate_fn(data):
-            batch = {'label':[], 'item1':[], 'item2':[], 'paths':[], 'edges':[]}
-            for item in data:
-                path_len = len(item['paths'])
-                batch['label'].append([item['label']]*path_len + [-1]*(3-path_len))
-                batch['item1'].append(item['item1'])
-                batch['item2'].append(item['item2'])
-                batch['paths'].append(item['paths']+[0]*(3-path_len))
-                batch['edges'].append(item['edges']+[0]*(3-path_len))
-
-            batch['label'] = torch.tensor(batch['label'], dtype=torch.float)
+        warmup_train_dataset = KPRN_ShardDataset(config['datapath']+config['warm_up_train_file'], doc_feature_embedding.vocab)
+        warmup_dev_dataset = KPRN_ShardDataset(config['datapath']+config['warm_up_dev_file'], doc_feature_embedding.vocab)
+
+        def collate_fn(data):#single path samples, padded to 3 entities, labels of the padding are -1
+            batch = {}
+            label = torch.tensor([item['label'] for item in data], dtype=torch.float)
+            lengths = torch.stack([item['lengths'] for item in data])
+            batch['label'] = torch.where(torch.arange(3)[None, :] < lengths[:, None], label[:, None], torch.full([1, 3], -1.0))
             batch['item1'] = [item['item1'] for item in data]
             batch['item2'] = [item['item2'] for item in data]
-            batch['paths'] = torch.tensor(batch['paths'], dtype=torch.long)
-            batch['edges'] = torch.tensor(batch['edges'], dtype=torch.long)
+            batch['item1_row'] = torch.tensor([item['item1_row'] for item in data], dtype=torch.long)
+            batch['paths'] = torch.stack([item['paths'] for item in data])
+            batch['edges'] = torch.stack([item['edges'] for item in data])
             return batch
 
         warmup_train_dataloader = DataLoader(
@@ -117,5 +150,5 @@ def load_data(config):
 
     print("fininsh loading data!")
 
-    return warmup_train_dataloader, warmup_dev_dataloader, train_dataloader, Val_data, Test_data, doc_feature_embedding, entity_adj, relation_adj, entity_id_dict, doc_entity_dict, entity_doc_dict, neibor_embedding, neibor_num, entity_embedding, relation_embedding, hit_dict, train_val_hit_dict
+    return warmup_train_dataloader, warmup_dev_dataloader, train_dataloader, Val_data, Test_data, doc_feature_embedding, kg_graph, entity_id_dict, doc_entity, entity_news, neibor_embedding, neibor_num, entity_embedding, relation_embedding, hit_graph, train_val_hit_graph
 
@@ -2,45 +2,74 @@ import sys
 import os
 sys.path.append('')
 import argparse
-from utils.util import process_mind_data, get_mind_data_set, download_deeprec_resources, process_KPRN_data, seed_everything
-from data_loader.data_loaders import process_data_and_cache
+from functools import partial
+from utils.util import build_item2item_dataset, build_doc_feature, get_mind_data_set, download_deeprec_resources, process_KPRN_data, seed_everything
+from utils.stage_graph import Stage, run_stages, format_report
+from utils.embedding_store import DocEmbeddingStore
+from data_loader.data_loaders import process_kg_and_cache, process_data_and_cache
 from utils.parse_config import ConfigParser
 
-
-parser = argparse.ArgumentParser(description='data processing')
-parser.add_argument('-c', '--config', default="./config/data_config.json", type=str, help='config file path (default: None)')
-parser.add_argument('-r', '--resume', default=None, type=str, help='path to latest checkpoint (default: None)')
-parser.add_argument('-d', '--device', default=None, type=str, help='indices of GPUs to enable (default: all)')
-parser.add_argument('--use_nni', action='store_true', help='use nni to tune hyperparameters')
-
-config = ConfigParser.from_args(parser)
-seed_everything(config['seed'])
-
-# Options: demo, small, large
-# The download speed here is a bit slow, you can go to the corresponding url to download the zip and put it in the corresponding directory
-MIND_type = config['MIND_type']
-data_path = config['datapath']
-
-train_news_file = data_path + config['train_news']#"train_news": "/mind/train/news.tsv",
-valid_news_file = data_path + config['valid_news']
-knowledge_graph_file = data_path + config['kg_file']
-
-mind_url, mind_train_dataset, mind_dev_dataset, _ = get_mind_data_set(MIND_type)
-
 kg_url = "https://kredkg.blob.core.windows.net/wikidatakg/"
 
-if not os.path.exists(train_news_file):
-    download_deeprec_resources(mind_url, train_news_file.rsplit("/", 1)[0], mind_train_dataset)
-    
-if not os.path.exists(valid_news_file):
-    download_deeprec_resources(mind_url, valid_news_file.rsplit("/", 1)[0], mind_dev_dataset)
+def download_resource(config, name):#name: 'train', 'valid' or 'kg'
+    # Archives already downloaded can be put in config['download_mirror_dir'], interrupted downloads are resumed
+    # The download speed here is a bit slow, you can go to the corresponding url to download the zip and put it in the corresponding directory
+    data_path = config['datapath']
+    mind_url, mind_train_dataset, mind_dev_dataset, _ = get_mind_data_set(config['MIND_type'])
+    download_options = {'mirror_dir': config['download_mirror_dir'], 'num_connections': config['download_connections']}
+    if name == 'train' and not os.path.exists(data_path + config['train_news']):
+        download_deeprec_resources(mind_url, (data_path + config['train_news']).rsplit("/", 1)[0], mind_train_dataset, checksum=config['download_checksums'].get(mind_train_dataset), **download_options)
+    if name == 'valid' and not os.path.exists(data_path + config['valid_news']):
+        download_deeprec_resources(mind_url, (data_path + config['valid_news']).rsplit("/", 1)[0], mind_dev_dataset, checksum=config['download_checksums'].get(mind_dev_dataset), **download_options)
+    if name == 'kg' and not os.path.exists(data_path + config['kg_file']):
+        download_deeprec_resources(kg_url, os.path.join(data_path, 'kg'), "kg.zip", checksum=config['download_checksums'].get("kg.zip"), **download_options)
 
-if not os.path.exists(knowledge_graph_file):
-    download_deeprec_resources(kg_url, os.path.join(data_path, 'kg'), "kg.zip")
+def data_stages(config):
+    """Stage graph of the data processing, see utils.stage_graph.
 
+    Downloads, the item2item pairs, the news features (doc encoding) and the knowledge graph only
+    depend on the raw files and can run concurrently; the cache needs all of them and KPRN paths need the cache.
+    """
+    data = lambda name: config['datapath'] + config[name]
+    cache = lambda name: config['cache_path'] + name
+    doc_feature_embedding_file = data('doc_feature_embedding_file')
+    return [
+        Stage('download_train', partial(download_resource, name='train'), outputs=[data('train_news'), data('train_behavior')], config_keys=['MIND_type']),
+        Stage('download_valid', partial(download_resource, name='valid'), outputs=[data('valid_news'), data('valid_behavior')], config_keys=['MIND_type']),
+        Stage('download_kg', partial(download_resource, name='kg'),
+              outputs=[data(name) for name in ['kg_file', 'entity_embedding_file', 'relation_embedding_file', 'entity2id_file', 'relation2id_file']]),
+        Stage('item2item', build_item2item_dataset,
+              inputs=[data('train_behavior'), data('valid_behavior')],
+              outputs=[data(name) for name in ['pos_train_file', 'pos_val_file', 'pos_test_file', 'all_news_file']],
+              config_keys=['seed'], deps=['download_train', 'download_valid']),
+        Stage('doc_feature', build_doc_feature,
+              inputs=[data('train_news'), data('valid_news')],
+              outputs=[data('doc_feature_entity_file'), doc_feature_embedding_file, DocEmbeddingStore.ids_file(doc_feature_embedding_file)],
+              config_keys=['doc_encoder_model', 'doc_embedding_dtype'], deps=['download_train', 'download_valid']),
+        Stage('kg', process_kg_and_cache,
+              inputs=[data(name) for name in ['kg_file', 'entity2id_file', 'relation2id_file', 'entity_embedding_file', 'relation_embedding_file']],
+              outputs=[cache("/entity_id_dict.npy"), cache("/relation_id_dict.npy")] + [cache("/kg_graph/"+name+".npy") for name in ['indptr', 'indices', 'relations']],
+              deps=['download_kg']),
+        Stage('cache', process_data_and_cache,
+              outputs=[cache("/doc_entity.npy"), cache("/neibor_embedding.pt"), data('train_file'), data('val_file')],
+              config_keys=['news_entity_num', 'doc_embedding_size', 'train_neg_num', 'knowledge_neg_num', 'seed'],
+              deps=['item2item', 'doc_feature', 'kg']),
+        Stage('kprn', process_KPRN_data,
+              outputs=[data('KPRN_train_file'), data('KPRN_val_file')],
+              config_keys=['news_entity_num', 'neighbor_sampling', 'seed'], deps=['cache']),
+    ]
 
-process_mind_data(config)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='data processing')
+    parser.add_argument('-c', '--config', default="./config/data_config.json", type=str, help='config file path (default: None)')
+    parser.add_argument('-r', '--resume', default=None, type=str, help='path to latest checkpoint (default: None)')
+    parser.add_argument('-d', '--device', default=None, type=str, help='indices of GPUs to enable (default: all)')
+    parser.add_argument('--use_nni', action='store_true', help='use nni to tune hyperparameters')
 
-process_data_and_cache(config)
+    config = ConfigParser.from_args(parser)
+    seed_everything(config['seed'])
 
-process_KPRN_data(config)
\ No newline at end of file
+    # Options: demo, small, large
+    # Stages whose inputs did not change since the last run are skipped, see cache_path/stages.json
+    report = run_stages(data_stages(config), config, config['cache_path'], config['stage_workers'])
+    print(format_report(report))
@@ -3,6 +3,7 @@ from data_loader.data_loaders import *
 from model.AnchorKG import AnchorKG
 from model.Recommender import Recommender
 from model.Reasoner import Reasoner
+from model.kg_features import KGFeatureStore
 from trainer.trainer import Trainer
 from utils.parse_config import ConfigParser
 
@@ -11,11 +12,12 @@ def main(config):
     seed_everything(config['seed'])
     device, _ = prepare_device(config['n_gpu'])
     data = load_data(config)
-    _, _, _, _, _, doc_feature_embedding, entity_adj, relation_adj, entity_id_dict, doc_entity_dict, entity_doc_dict, neibor_embedding, neibor_num, entity_embedding, relation_embedding, hit_dict, _ = data
+    _, _, _, _, _, doc_feature_embedding, kg_graph, entity_id_dict, doc_entity, entity_news, neibor_embedding, neibor_num, entity_embedding, relation_embedding, hit_graph, _ = data
     
-    model_anchor = AnchorKG(config, doc_entity_dict, entity_doc_dict, doc_feature_embedding, entity_adj, relation_adj, hit_dict, entity_id_dict, neibor_embedding, neibor_num, entity_embedding, relation_embedding, device)
-    model_recommender = Recommender(config, doc_feature_embedding, entity_embedding, relation_embedding, entity_adj, relation_adj, device)
-    model_reasoner = Reasoner(config, doc_feature_embedding, entity_embedding, relation_embedding, device)
+    kg_features = KGFeatureStore(entity_embedding, relation_embedding, doc_feature_embedding, kg_graph, device)#shared by the three models
+    model_anchor = AnchorKG(config, kg_features, doc_entity, entity_news, hit_graph, entity_id_dict, neibor_embedding, neibor_num, device)
+    model_recommender = Recommender(config, kg_features, device)
+    model_reasoner = Reasoner(config, kg_features, device)
 
     trainer = Trainer(config, model_anchor, model_recommender, model_reasoner, device, data)
     trainer.logger.info("config {}".format(config.config))
@@ -1,6 +1,7 @@
 from model.base_model import BaseModel
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 from torch.distributions import Categorical
 
@@ -24,39 +25,35 @@ class Net(BaseModel):
         self.softmax = torch.nn.Softmax(dim=-2)
 
     def forward(self, state_input, action_input):
-        if len(state_input.shape) < len(action_input.shape):
-            if len(action_input.shape) == 3:
-                state_input = torch.unsqueeze(state_input, 1)
-                state_input = state_input.expand(state_input.shape[0], action_input.shape[1], state_input.shape[2])
-            else:
-                state_input = torch.unsqueeze(state_input, 1)
-                state_input = torch.unsqueeze(state_input, 1)
-                state_input = state_input.expand(state_input.shape[0], action_input.shape[1], action_input.shape[2], state_input.shape[3])
+        #actor_l1 on cat([state, action]) split into a state and an action projection with the same parameters,
+        #the state projection is computed once per state and broadcast over the actions instead of tiling the state
+        state_size = state_input.shape[-1]
+        state_x = F.linear(state_input, self.actor_l1.weight[:, :state_size], self.actor_l1.bias)
+        action_x = F.linear(action_input, self.actor_l1.weight[:, state_size:])
+        while state_x.dim() < action_x.dim():
+            state_x = torch.unsqueeze(state_x, 1)#(batch, 1, 128), (batch, 1, 1, 128)
+        x = self.elu(state_x + action_x)#first layer shared by the actor and the critic
 
         # Actor
-        actor_x = self.elu(self.actor_l1(torch.cat([state_input, action_input], dim=-1)))
-        actor_out = self.elu(self.actor_l2(actor_x))
+        actor_out = self.elu(self.actor_l2(x))
         act_probs = self.softmax(self.actor_l3(actor_out))#out: (batch, 20, 1),(batch, 5, 20, 1),(batch, 15, 20, 1)
 
         # Critic
-        critic_x = self.elu(self.actor_l1(torch.cat([state_input, action_input], dim=-1)))
-        critic_out = self.elu(self.critic_l2(critic_x))
+        critic_out = self.elu(self.critic_l2(x))
         values = self.critic_l3(critic_out).mean(dim=-2)#out: (batch,1), (batch,5,1), (batch,15,1)
 
         return act_probs, values
 
 class AnchorKG(BaseModel):
 
-    def __init__(self, config, doc_entity_dict, entity_doc_dict, doc_feature_embedding, entity_adj, relation_adj, hit_dict, entity_id_dict, neibor_embedding, neibor_num, entity_embedding, relation_embedding, device=torch.device('cpu')):
+    def __init__(self, config, kg_features, doc_entity, entity_news, hit_graph, entity_id_dict, neibor_embedding, neibor_num, device=torch.device('cpu')):
         super(AnchorKG, self).__init__()
         self.device=device
         self.config = config
-        self.doc_entity_dict = doc_entity_dict
-        self.entity_doc_dict = entity_doc_dict
-        self.doc_feature_embedding = doc_feature_embedding
-        self.entity_adj = entity_adj
-        self.relation_adj = relation_adj
-        self.hit_dict = hit_dict
+        self.kg_features = kg_features#shared KGFeatureStore, news are passed as rows of its doc_feature_embedding
+        self.doc_entity = doc_entity#(num_news, news_entity_num), rows of doc_feature_embedding.vocab
+        self.entity_news = entity_news.to(device)#hit rewards are computed on the device
+        self.hit_graph = hit_graph.to(device)
         self.entity_id_dict = entity_id_dict
         self.neibor_embedding = nn.Embedding.from_pretrained(neibor_embedding)
         self.neibor_num = neibor_num.to(device)
@@ -65,8 +62,6 @@ class AnchorKG(BaseModel):
         self.cos = nn.CosineSimilarity(dim=-1)
         self.softmax = nn.Softmax(dim=-2)
 
-        self.entity_embedding = nn.Embedding.from_pretrained(entity_embedding)
-        self.relation_embedding = nn.Embedding.from_pretrained(relation_embedding)
         self.news_compress = nn.Sequential(
                                 nn.Linear(self.config['doc_embedding_size'], self.config['embedding_size']),
                                 nn.ELU(),
@@ -92,27 +87,22 @@ class AnchorKG(BaseModel):
                                 nn.Linear(self.config['embedding_size'], 1, bias=False),
                             ).to(device)
 
-        self.policy_net = Net(self.config, self.entity_id_dict, self.doc_feature_embedding).to(device)
+        self.policy_net = Net(self.config, self.entity_id_dict, self.kg_features.doc_feature_embedding).to(device)
 
-    def get_news_embedding_batch(self, newsids):#(batch, 768)
-        news_embeddings = torch.zeros([len(newsids), self.config['doc_embedding_size']])
-        for i, newsid in enumerate(newsids):
-            news_embeddings[i] = self.doc_feature_embedding[newsid]
-        return news_embeddings.to(self.device)
+    def get_news_embedding_batch(self, news_rows):#(batch, 768)
+        return self.kg_features.news(news_rows)
     
-    def get_news_entities_batch(self, newsids):#entity contained in current news
-        news_entities = torch.zeros(len(newsids), self.config['news_entity_num'], dtype=torch.long)
-        news_relations = torch.zeros(len(newsids), self.config['news_entity_num'], dtype=torch.long)
-        for i in range(len(newsids)):
-            news_entities[i] = self.doc_entity_dict[newsids[i]]
+    def get_news_entities_batch(self, news_rows):#entity contained in current news
+        news_entities = torch.from_numpy(self.doc_entity[news_rows.cpu().numpy()].astype(np.int64))
+        news_relations = torch.zeros(len(news_rows), self.config['news_entity_num'], dtype=torch.long)
         return news_entities, news_relations
     
     def get_state_input(self, news_embedding, depth, anchor_graph, history_entity, history_relation):
         if depth == 0:
             state_embedding = torch.cat([news_embedding, torch.zeros([news_embedding.shape[0], 128*2], dtype=torch.float32).to(self.device)], dim=-1)
         else:
-            history_entity_embedding = self.entity_compress(self.entity_embedding(history_entity.to(self.entity_embedding.weight.device)).to(self.device))
-            history_relation_embedding = self.relation_compress(self.relation_embedding(history_relation.to(self.relation_embedding.weight.device)).to(self.device)) if depth>1 else self.innews_relation(history_relation)
+            history_entity_embedding = self.kg_features.compressed_entities(history_entity, self.entity_compress)
+            history_relation_embedding = self.kg_features.compressed_relations(history_relation, self.relation_compress) if depth>1 else self.innews_relation(history_relation)
             state_embedding_new = history_relation_embedding + history_entity_embedding
             state_embedding_new = torch.mean(state_embedding_new, dim=1, keepdim=False)
             anchor_embedding = self.get_anchor_graph_embedding(anchor_graph)
@@ -120,11 +110,11 @@ class AnchorKG(BaseModel):
         return state_embedding
     
     def get_anchor_graph_embedding(self, anchor_graph):
-        anchor_graph_nodes  = torch.cat(anchor_graph, dim=-1).to(self.entity_adj.device)
-        anchor_graph_nodes_embedding = self.entity_compress(self.entity_embedding(anchor_graph_nodes).to(self.device))
+        anchor_graph_nodes  = torch.cat(anchor_graph, dim=-1)
+        anchor_graph_nodes_embedding = self.kg_features.compressed_entities(anchor_graph_nodes, self.entity_compress)
         neibor_entities, neibor_relations = self.get_neighbors(anchor_graph_nodes)#first-order neighbors for each entity
-        neibor_entities_embedding = self.entity_compress(self.entity_embedding(neibor_entities).to(self.device))
-        neibor_relations_embedding = self.relation_compress(self.relation_embedding(neibor_relations).to(self.device))
+        neibor_entities_embedding = self.kg_features.compressed_entities(neibor_entities, self.entity_compress)
+        neibor_relations_embedding = self.kg_features.compressed_relations(neibor_relations, self.relation_compress)
         anchor_embedding = torch.cat([anchor_graph_nodes_embedding, torch.sum(neibor_entities_embedding+neibor_relations_embedding, dim=-2)], dim=-1)
 
         anchor_embedding = self.anchor_embedding_layer(anchor_embedding)#(batch, 50, 128)
@@ -132,21 +122,78 @@ class AnchorKG(BaseModel):
         anchor_embedding = torch.sum(anchor_embedding * anchor_embedding_weight, dim=-2)
         return anchor_embedding
     
-    def get_neighbors(self, entities):
-        neighbor_entities = self.entity_adj[entities]
-        neighbor_relations = self.relation_adj[entities]
-        return neighbor_entities, neighbor_relations
-
-    def get_anchor_nodes(self, weights, action_id_input, relation_id_input, topk):
+    def get_neighbors(self, entities):#news_entity_num neighbors sampled at each call, the same ones in deterministic mode
+        return self.kg_features.neighbors(entities, self.config['news_entity_num'], self.config['neighbor_sampling'] == 'degree', self.deterministic())
+
+    def deterministic(self):#greedy or beam inference: the anchor graph of a news only depends on the parameters, see AnchorGraphCache
+        return not self.training and self.config['anchor_inference'] in ['greedy', 'beam']
+
+    def select_actions(self, weights, topk):
+        """Positions of the topk actions taken by each parent, in one call over all the parents of the batch.
+
+        Training samples with config['anchor_sampling']: "categorical" draws topk actions with replacement,
+        "gumbel" draws topk distinct actions (Gumbel-top-k, the topk largest log(p) + Gumbel noise) in their
+        order of sampling without replacement, see get_anchor_nodes for their probabilities.
+        Deterministic inference takes the topk most probable actions.
+
+        Args:
+            weights (torch.Tensor): (batch, parents, actions) action probabilities.
+            topk (int): actions per parent.
+
+        Returns:
+            torch.Tensor: (batch, parents, topk) int64 action positions.
+        """
+        if self.deterministic():
+            return weights.topk(topk, dim=-1).indices
+        if self.config['anchor_sampling'] == 'gumbel':
+            gumbel = -torch.empty_like(weights).exponential_().log()
+            return (weights.log() + gumbel).topk(topk, dim=-1).indices
+        return Categorical(weights).sample(sample_shape=torch.Size([topk])).permute(1,2,0)#may sample the same position multiple times
+
+    def beam_select(self, weights, topk, beam_scores):
+        """One step of the beam search over anchor layers, hypotheses are scored by the sum of the log probabilities of their actions.
+
+        Each hypothesis extends into its greedy selection and the beam_size-1 best selections that differ by one action:
+        the last action selected for one parent is replaced by its next most probable one. The beam_size best
+        extensions of each news are kept, in decreasing score.
+
+        Args:
+            weights (torch.Tensor): (batch*beam_size, parents, actions) action probabilities of each hypothesis.
+            topk (int): actions per parent.
+            beam_scores (torch.Tensor): (batch, beam_size) scores of the hypotheses.
+
+        Returns:
+            torch.Tensor, torch.Tensor, torch.Tensor: (batch*beam_size, parents, topk) action positions, (batch*beam_size)
+            hypothesis extended by each new hypothesis and the (batch, beam_size) new scores.
+        """
+        batch_size, beam_size = beam_scores.shape
+        log_weights, order = weights.log().sort(dim=-1, descending=True)
+        greedy_scores = log_weights[..., :topk].sum(dim=(-1, -2))#(batch*beam_size)
+        swap_costs = torch.nan_to_num(log_weights[..., topk-1] - log_weights[..., topk], nan=float('inf'))#(batch*beam_size, parents)
+        swap_costs, swap_parents = swap_costs.topk(min(beam_size-1, swap_costs.shape[1]), dim=-1, largest=False)
+        candidate_scores = torch.cat([greedy_scores[:, None], greedy_scores[:, None] - swap_costs], dim=-1)#(batch*beam_size, candidates)
+        candidate_num = candidate_scores.shape[1]
+        scores = (beam_scores.reshape(-1, 1) + candidate_scores).reshape(batch_size, beam_size * candidate_num)
+        beam_scores, best = scores.topk(beam_size, dim=-1)
+        origin = (best // candidate_num + torch.arange(batch_size, device=best.device)[:, None] * beam_size).reshape(-1)
+        candidate = (best % candidate_num).reshape(-1)
+
+        acts_idx = order[origin, :, :topk].clone()
+        swapped = torch.nonzero(candidate > 0).squeeze(1)
+        parents = swap_parents[origin[swapped], candidate[swapped]-1]
+        acts_idx[swapped, parents, topk-1] = order[origin[swapped], parents, topk]
+        return acts_idx, origin, beam_scores
+
+    def get_anchor_nodes(self, weights, action_id_input, relation_id_input, topk, acts_idx=None):#acts_idx: (batch, parents, topk) positions chosen by beam_select, select_actions if None
         if len(weights.shape) <= 3:
             weights =torch.unsqueeze(weights, 1)
             action_id_input = torch.unsqueeze(action_id_input, 1)
             relation_id_input = torch.unsqueeze(relation_id_input, 1)
 
         weights = weights.squeeze(-1)
-        m = Categorical(weights)
-        acts_idx = m.sample(sample_shape=torch.Size([topk]))#may sample the same position multiple times
-        acts_idx = acts_idx.permute(1,2,0)
+        without_replacement = acts_idx is None and not self.deterministic() and self.config['anchor_sampling'] == 'gumbel'
+        if acts_idx is None:
+            acts_idx = self.select_actions(weights, topk)
         shape0 = acts_idx.shape[0]
         shape1 = acts_idx.shape[1]
         acts_idx = acts_idx.reshape(acts_idx.shape[0] * acts_idx.shape[1], acts_idx.shape[2])#(batch,topk)
@@ -156,6 +203,8 @@ class AnchorKG(BaseModel):
         relation_id_input = relation_id_input.reshape(relation_id_input.shape[0] * relation_id_input.shape[1], relation_id_input.shape[2])
 
         weights = weights.gather(1, acts_idx)
+        if without_replacement:#probability of each action given the ones drawn before it (Plackett-Luce), their product is the probability of the drawn sequence
+            weights = weights / (1 - (weights.cumsum(dim=1) - weights)).clamp(min=1e-12)
         state_id_input_value = action_id_input.gather(1, acts_idx)#selected entity id,(batch,topk)
         relation_id_selected = relation_id_input.gather(1, acts_idx)#selected relation id,(batch,topk)
         
@@ -164,10 +213,10 @@ class AnchorKG(BaseModel):
         relation_id_selected = relation_id_selected.reshape(shape0, shape1 *  relation_id_selected.shape[1])
         return weights, state_id_input_value, relation_id_selected
 
-    def get_reward(self, newsid, news_embedding, anchor_nodes):
+    def get_reward(self, news_rows, news_embedding, anchor_nodes):
         neibor_news_embedding_avg = self.get_neiborhood_news_embedding_batch(news_embedding, anchor_nodes)#如果没有其他news呢？
         sim_reward = self.get_sim_reward_batch(news_embedding, neibor_news_embedding_avg)
-        hit_reward = self.get_hit_rewards_batch(newsid, anchor_nodes)
+        hit_reward = self.get_hit_rewards_batch(news_rows, anchor_nodes)
         reward = 0.5*hit_reward + (1-0.5)*sim_reward
         return reward
     
@@ -181,20 +230,23 @@ class AnchorKG(BaseModel):
         cos_rewards = self.cos(news_embedding_batch[:,None,:], neibor_news_embedding_avg_batch)
         return cos_rewards #(batch, 5/15/30)
     
-    def get_hit_rewards_batch(self, newsid_batch, anchor_nodes):
-        hit_rewards = torch.zeros([len(newsid_batch), len(anchor_nodes[0])], dtype=torch.float32)
-        for i in range(len(newsid_batch)):
-            for j in range(len(anchor_nodes[i])):
-                idx = anchor_nodes[i][j].item()
-                if idx in self.entity_doc_dict and newsid_batch[i] in self.hit_dict:
-                    entity_neibor = set(self.entity_doc_dict[idx])
-                    entity_neibor.discard(newsid_batch[i])#entity neiborhood news
-                    news_hit_neibor = self.hit_dict[newsid_batch[i]]#similarity doc
-                    if len(entity_neibor & news_hit_neibor)>0:
-                        hit_rewards[i][j] = 1.0
-        return hit_rewards.to(self.device)
-
-    def forward(self, news):
+    def get_hit_rewards_batch(self, news_rows, anchor_nodes):#1 if a news of the anchor entity (except the news itself) is a hit of the news
+        news_rows = news_rows.to(self.device)
+        segment, hit_rows = self.hit_graph.neighbors(news_rows)#hit news of each news, usually far fewer than the news of an entity
+        keep = hit_rows != news_rows[segment]
+        segment, hit_rows = segment[keep], hit_rows[keep]
+        anchors = anchor_nodes.to(self.device)[segment]#(hit num, anchor num)
+        hit = self.entity_news.contains(anchors, hit_rows[:, None].expand_as(anchors))#the hit news is a neiborhood news of the anchor
+        hit_rewards = torch.zeros(anchor_nodes.shape, dtype=torch.float32, device=self.device).index_add_(0, segment, hit.to(torch.float32))
+        return (hit_rewards > 0).to(torch.float32)
+
+    def forward(self, news, with_rewards=True):#news: int64 rows of doc_feature_embedding, rewards_steps is empty without rewards
+        beam_size = self.config['anchor_beam_size'] if self.deterministic() and self.config['anchor_inference'] == 'beam' else 1
+        if beam_size > 1:#hypotheses of a news are consecutive rows, the first one has the best score
+            batch_size = len(news)
+            news = torch.as_tensor(news).repeat_interleave(beam_size)
+            beam_scores = torch.full([batch_size, beam_size], -float('inf'), device=self.device)
+            beam_scores[:, 0] = 0#the hypotheses start identical, extend only one
         depth = 0
         history_entity = []
         history_relation = []
@@ -209,7 +261,7 @@ class AnchorKG(BaseModel):
         news_embedding = self.news_compress(news_embedding_origin)#(batch, 128)
         
         action_id, relation_id = self.get_news_entities_batch(news)#entities and relations in current news, relation id==0, cpu
-        action_embedding = self.entity_compress(self.entity_embedding(action_id).to(self.device))#(batch, 20, 128)
+        action_embedding = self.kg_features.compressed_entities(action_id, self.entity_compress)#(batch, 20, 128)
         relation_embedding = self.innews_relation(relation_id.to(self.device))        #self.relation_compress(self.relation_embedding(relation_id).to(self.device))
         action_embedding = action_embedding + relation_embedding#(batch, 20, 128)
         
@@ -218,7 +270,15 @@ class AnchorKG(BaseModel):
         while (depth < self.MAX_DEPTH):
             act_probs, state_values = self.policy_net(state_input, action_embedding)
             topk = self.config['topk'][depth]
-            anchor_act_probs, anchor_nodes, anchor_relations = self.get_anchor_nodes(act_probs, action_id.to(self.device), relation_id.to(self.device), topk)#take action
+            action_id, relation_id = action_id.to(self.device), relation_id.to(self.device)
+            if beam_size > 1:
+                acts_idx, origin, beam_scores = self.beam_select(act_probs.reshape(len(news), -1, act_probs.shape[-2]), topk, beam_scores)
+                act_probs, state_values, action_id, relation_id = act_probs[origin], state_values[origin], action_id[origin], relation_id[origin]
+                for steps in [act_probs_steps, state_values_steps, rewards_steps, anchor_graph, anchor_relation]:
+                    steps[:] = [step[origin] for step in steps]
+                anchor_act_probs, anchor_nodes, anchor_relations = self.get_anchor_nodes(act_probs, action_id, relation_id, topk, acts_idx)
+            else:
+                anchor_act_probs, anchor_nodes, anchor_relations = self.get_anchor_nodes(act_probs, action_id, relation_id, topk)#take action
             
             history_entity = anchor_nodes#newly adds entities
             history_relation = anchor_relations
@@ -231,19 +291,24 @@ class AnchorKG(BaseModel):
             state_input = self.get_state_input(news_embedding, depth, anchor_graph, history_entity, history_relation)#next state
 
             action_id, relation_id = self.get_neighbors(anchor_nodes)#(r,e) space for next action, (batch, 5, 20) / (batch, 5*3, 20)
-            action_embedding = self.entity_compress(self.entity_embedding(action_id).to(self.device)) + self.relation_compress(self.relation_embedding(relation_id).to(self.device))
+            action_embedding = self.kg_features.compressed_entities(action_id, self.entity_compress) + self.kg_features.compressed_relations(relation_id, self.relation_compress)
 
-            step_reward = self.get_reward(news, news_embedding_origin, anchor_nodes)
-            rewards_steps.append(step_reward)
+            if with_rewards:
+                step_reward = self.get_reward(news, news_embedding_origin, anchor_nodes)
+                rewards_steps.append(step_reward)
 
+        if beam_size > 1:
+            best = torch.arange(batch_size, device=self.device) * beam_size
+            act_probs_steps, state_values_steps, rewards_steps, anchor_graph, anchor_relation = [[step[best] for step in steps]
+                for steps in [act_probs_steps, state_values_steps, rewards_steps, anchor_graph, anchor_relation]]
         return act_probs_steps, state_values_steps, rewards_steps, anchor_graph, anchor_relation #only act_probs_steps, state_values_steps have gradients
 
     def warm_train(self, batch):
         loss_fn = nn.BCELoss()
-        news_embedding = self.get_news_embedding_batch(batch['item1'])
+        news_embedding = self.get_news_embedding_batch(batch['item1_row'])
         news_embedding = self.news_compress(news_embedding)
-        path_node_embeddings = self.entity_compress(self.entity_embedding(batch['paths']).to(self.device))#(batch, depth, embedding_size)
-        path_edge_embeddings = self.relation_compress(self.relation_embedding(batch['edges'][:,1:]).to(self.device))#(batch, depth-1, embedding_size)
+        path_node_embeddings = self.kg_features.compressed_entities(batch['paths'], self.entity_compress)#(batch, depth, embedding_size)
+        path_edge_embeddings = self.kg_features.compressed_relations(batch['edges'][:,1:], self.relation_compress)#(batch, depth-1, embedding_size)
         innews_relation_embedding = self.innews_relation(torch.zeros([batch['paths'].shape[0],1], dtype=torch.long).to(self.device))#(batch, 1, embedding_size)
         path_edge_embeddings = torch.cat([innews_relation_embedding, path_edge_embeddings], dim=1)
         path_embeddings = path_node_embeddings + path_edge_embeddings#(batch, depth, 128)
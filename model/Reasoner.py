@@ -6,14 +6,12 @@ from model.base_model import BaseModel
 
 class Reasoner(BaseModel):
 
-    def __init__(self, config, doc_feature_embedding, entity_embedding, relation_embedding, device=torch.device('cpu')):
+    def __init__(self, config, kg_features, device=torch.device('cpu')):
         super(Reasoner, self).__init__()
         self.device = device
         self.config = config
         self.sigmoid = nn.Sigmoid()
-        self.doc_feature_embedding = doc_feature_embedding
-        self.entity_embedding = nn.Embedding.from_pretrained(entity_embedding)
-        self.relation_embedding = nn.Embedding.from_pretrained(relation_embedding)
+        self.kg_features = kg_features#shared KGFeatureStore, news are passed as rows of its doc_feature_embedding
         self.innews_relation = nn.Embedding(1, self.config['embedding_size']).to(device)
         self.news_compress = nn.Sequential(
                                 nn.Linear(self.config['doc_embedding_size'], self.config['embedding_size']),
@@ -101,23 +99,30 @@ class Reasoner(BaseModel):
                 reasoning_edges[-1].append([])
         return reasoning_paths, reasoning_edges
 
-    def forward(self, news1, news2, anchor_graph1, anchor_graph2, anchor_relation1, anchor_relation2):
+    def forward(self, news1, news2, anchor_graph1, anchor_graph2, anchor_relation1, anchor_relation2, news_embeddings1=None, news_embeddings2=None):
+        #news: int64 rows of doc_feature_embedding, news_embeddings: their news_compress embeddings when already computed
 
         anchor_graph_list1_flat, anchor_graph_list1 = self.get_anchor_graph_list(anchor_graph1, len(news1))
         anchor_graph_list2_flat, anchor_graph_list2 = self.get_anchor_graph_list(anchor_graph2, len(news2))
         overlap_entity_num, anchor_graph1_num, anchor_graph2_num, overlap_entity_num_cpu = self.get_overlap_entities(anchor_graph_list1_flat, anchor_graph_list2_flat)
-        reasoning_paths, reasoning_edges = self.get_reasoning_paths(news1, news2, anchor_graph_list1, anchor_graph_list2, anchor_relation1, anchor_relation2, overlap_entity_num_cpu)
+        news_nodes1 = [('news', row) for row in news1.tolist()]#graph nodes of the news, distinct from the entity ids
+        news_nodes2 = [('news', row) for row in news2.tolist()]
+        reasoning_paths, reasoning_edges = self.get_reasoning_paths(news_nodes1, news_nodes2, anchor_graph_list1, anchor_graph_list2, anchor_relation1, anchor_relation2, overlap_entity_num_cpu)
         batch_predict = []
         batch_path_scores = []
+        if news_embeddings1 is None:
+            news_embeddings1 = self.news_compress(self.kg_features.news(news1))
+        if news_embeddings2 is None:
+            news_embeddings2 = self.news_compress(self.kg_features.news(news2))
         for i in range(len(reasoning_paths)):
             paths = reasoning_paths[i]
             edges = reasoning_edges[i]
-            news_embeeding_1 = self.news_compress(self.doc_feature_embedding[news1[i]].to(self.device)).unsqueeze(dim=0)
-            news_embedding_2 = self.news_compress(self.doc_feature_embedding[news2[i]].to(self.device)).unsqueeze(dim=0)
+            news_embeeding_1 = news_embeddings1[i:i+1]
+            news_embedding_2 = news_embeddings2[i:i+1]
             path_scores=[]
             for j in range(len(paths)):
-                path_node_embeddings = self.entity_compress(self.entity_embedding(torch.tensor(paths[j], dtype=torch.long)).to(self.device))
-                path_edge_embeddings = self.relation_compress(self.relation_embedding(torch.tensor(edges[j], dtype=torch.long)).to(self.device))
+                path_node_embeddings = self.kg_features.compressed_entities(paths[j], self.entity_compress)
+                path_edge_embeddings = self.kg_features.compressed_relations(edges[j], self.relation_compress)
                 path_node_embeddings = torch.cat((news_embeeding_1, path_node_embeddings, news_embedding_2), dim=0) #(path_len, embedding_size)
                 path_edge_embeddings = torch.cat((self.innews_relation(torch.tensor([0]).to(self.device)), path_edge_embeddings, self.innews_relation(torch.tensor([0]).to(self.device)), torch.zeros([1, self.config['embedding_size']]).to(self.device)), dim=0) #(path_len, embedding_size)
                 path_node_embeddings = torch.unsqueeze(path_node_embeddings, 0)#(1, path_len, embedding_size)
@@ -138,6 +143,13 @@ class Reasoner(BaseModel):
        
         return predicts, reasoning_paths, reasoning_edges, batch_predict, batch_path_scores
     
+    def forward_distinct(self, news, anchor_graph, anchor_relation, index1, index2):
+        """Predict the pairs (news[index1], news[index2]) with one news embedding per distinct news, gathered for each pair."""
+        news_embeddings = self.news_compress(self.kg_features.news(news))
+        news_index1, news_index2 = index1.to(news.device), index2.to(news.device)
+        return self.forward(news[news_index1], news[news_index2], [step[index1] for step in anchor_graph], [step[index2] for step in anchor_graph],
+                            [step[index1] for step in anchor_relation], [step[index2] for step in anchor_relation], news_embeddings[index1], news_embeddings[index2])
+
     # def get_path_score(self, reasoning_paths):
     #     predict_scores = []
     #     for paths in reasoning_paths:
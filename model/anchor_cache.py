@@ -0,0 +1,92 @@
+import hashlib
+import os
+from collections import OrderedDict
+import torch
+
+class AnchorGraphCache:
+    """
+    Bounded LRU cache of the anchor graphs predicted by AnchorKG in deterministic mode (anchor_inference: greedy or beam),
+    so validation, test and serving compute the anchor graph of a news once per model version instead of once
+    per occurrence of the news.
+
+    Entries are keyed by news row and belong to one model version, the digest of the trainable AnchorKG
+    parameters: an optimizer step or a load_state_dict empties the cache. save()/load() keep the entries
+    of a checkpoint in a file keyed by news id, and load() ignores a file written for other parameters.
+    """
+    def __init__(self, capacity, news_vocab):
+        self.capacity = capacity
+        self.news_vocab = news_vocab
+        self.entries = OrderedDict()#news row -> int64 cat(anchor_graph + anchor_relation), least recently used first
+        self.widths = None#number of nodes of each depth
+        self.parameter_state = None#(data_ptr, version) of the parameters the entries were computed with
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def check_version(self, model):#empty the cache if the parameters changed since the last call
+        parameter_state = tuple((parameter.data_ptr(), parameter._version) for parameter in model.parameters())
+        if parameter_state != self.parameter_state:
+            version = model_version(model)
+            if version != self.version:
+                self.entries.clear()
+            self.parameter_state = parameter_state
+            self.version = version
+
+    def anchor_graphs(self, model, news_rows):
+        """anchor_graph and anchor_relation of model(news_rows), computing only the news not in the cache.
+
+        Args:
+            model (AnchorKG): in eval mode with greedy or beam anchor inference, called under torch.no_grad().
+            news_rows (torch.Tensor): int64 rows of doc_feature_embedding.
+
+        Returns:
+            list, list: (batch, 5), (batch, 15), (batch, 30) anchor nodes and relations on the model device.
+        """
+        assert model.deterministic(), "the anchor graph cache needs a model in eval mode with greedy or beam anchor inference"
+        self.check_version(model)
+        rows = news_rows.tolist()
+        missing = list(dict.fromkeys(row for row in rows if row not in self.entries))
+        if missing:
+            _, _, _, anchor_graph, anchor_relation = model(torch.tensor(missing, dtype=torch.long), with_rewards=False)
+            self.widths = [nodes.shape[1] for nodes in anchor_graph]
+            for row, entry in zip(missing, torch.cat(anchor_graph + anchor_relation, dim=-1).cpu()):
+                self.entries[row] = entry
+        self.misses += len(missing)
+        self.hits += len(rows) - len(missing)
+        for row in rows:
+            self.entries.move_to_end(row)
+        batch = torch.stack([self.entries[row] for row in rows]).to(model.device)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        layers = list(torch.split(batch, self.widths * 2, dim=-1))
+        return layers[:len(self.widths)], layers[len(self.widths):]
+
+    def save(self, filename):
+        rows = list(self.entries)
+        torch.save({'version': self.version, 'widths': self.widths,
+                    'news_ids': [self.news_vocab.ids[row] for row in rows],
+                    'entries': torch.stack([self.entries[row] for row in rows]) if rows else None}, filename)
+
+    def load(self, filename, model):#returns the number of entries loaded, 0 if the file is missing or for other parameters
+        self.check_version(model)
+        if not os.path.exists(filename):
+            return 0
+        state = torch.load(filename)
+        if state['version'] != self.version or state['entries'] is None:
+            return 0
+        self.widths = state['widths']
+        known = [(self.news_vocab.row(newsid), entry) for newsid, entry in zip(state['news_ids'], state['entries']) if newsid in self.news_vocab]
+        for row, entry in known[max(len(known) - self.capacity, 0):]:
+            self.entries[row] = entry
+        return min(len(known), self.capacity)
+
+def model_version(model):#digest of the trainable parameters and the inference settings
+    digest = hashlib.sha1(str((model.config['anchor_inference'], model.config['anchor_beam_size'], model.config['topk'], model.config['news_entity_num'], model.config['neighbor_sampling'])).encode())
+    for name, parameter in model.named_parameters():
+        if parameter.requires_grad:
+            digest.update(name.encode())
+            digest.update(parameter.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
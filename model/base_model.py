@@ -7,6 +7,12 @@ class BaseModel(nn.Module):
     """
     Base class for all models
     """
+    FROZEN_TABLES = ['entity_embedding.weight', 'relation_embedding.weight']#per model copies of the KGFeatureStore tables in older checkpoints
+
+    def load_state_dict(self, state_dict, strict=True):
+        """Load a checkpoint, ignoring the frozen tables saved by models that did not share a KGFeatureStore."""
+        state_dict = {key: value for key, value in state_dict.items() if key not in self.FROZEN_TABLES}
+        return super().load_state_dict(state_dict, strict)
     @abstractmethod
     def forward(self, *inputs):
         """
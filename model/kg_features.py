@@ -0,0 +1,58 @@
+import torch
+import torch.nn.functional as F
+
+class KGFeatureStore:
+    """
+    Frozen inputs shared by AnchorKG, Recommender, Reasoner and KPRN: the entity and relation TransE tables,
+    the knowledge graph and the doc embedding store, placed once on the compute device at load time.
+
+    It is not a module, so the models hold a reference to the same tables and their checkpoints do not
+    contain them. Lookups take indices on any device and return tensors on the store device.
+    """
+    def __init__(self, entity_embedding, relation_embedding, doc_feature_embedding, kg_graph=None, device=torch.device('cpu')):
+        self.device = torch.device(device)
+        self.entity_weight = entity_embedding.to(self.device, torch.float32)
+        self.relation_weight = relation_embedding.to(self.device, torch.float32)
+        self.doc_feature_embedding = doc_feature_embedding.to(self.device)
+        self.kg_graph = kg_graph.to(self.device) if kg_graph is not None else None
+        #id(compress module) -> (id(table), parameter versions, compressed table), see compressed(). A module keeps one
+        #(table rows x embedding_size) float32 table on the device while it runs without autograd, e.g. 4 bytes x
+        #num_entities x 128 for each entity_compress of AnchorKG, Recommender and Reasoner; training frees it.
+        self.compressed_tables = {}
+
+    def entities(self, entity_ids):#(..., entity_embedding_size)
+        return F.embedding(torch.as_tensor(entity_ids, dtype=torch.long).to(self.device), self.entity_weight)
+
+    def relations(self, relation_ids):#(..., entity_embedding_size)
+        return F.embedding(torch.as_tensor(relation_ids, dtype=torch.long).to(self.device), self.relation_weight)
+
+    def compressed(self, table, ids, compress):
+        """compress(table[ids]) for a frozen table and a compress module of a model, projecting each distinct row once.
+
+        With autograd disabled (validation, test, serving) the whole table is projected once and kept until the
+        parameters of `compress` change, e.g. after an optimizer step or load_state_dict: one table per module, the
+        previous one is freed before projecting again. With autograd, only the unique ids of the batch are projected
+        and gathered back, and the table of `compress` is freed.
+        """
+        ids = torch.as_tensor(ids, dtype=torch.long).to(self.device)
+        if not torch.is_grad_enabled():
+            version = tuple((parameter.data_ptr(), parameter._version) for parameter in compress.parameters())#bumped by in-place updates
+            if self.compressed_tables.get(id(compress), (None, None))[:2] != (id(table), version):
+                self.compressed_tables.pop(id(compress), None)#free the stale table before projecting the new one
+                self.compressed_tables[id(compress)] = (id(table), version, compress(table))
+            return F.embedding(ids, self.compressed_tables[id(compress)][2])
+        self.compressed_tables.pop(id(compress), None)
+        unique_ids, inverse = torch.unique(ids, return_inverse=True)
+        return compress(F.embedding(unique_ids, table))[inverse]
+
+    def compressed_entities(self, entity_ids, compress):#(..., embedding_size)
+        return self.compressed(self.entity_weight, entity_ids, compress)
+
+    def compressed_relations(self, relation_ids, compress):#(..., embedding_size)
+        return self.compressed(self.relation_weight, relation_ids, compress)
+
+    def news(self, news_rows):#(batch, doc_embedding_size), rows of doc_feature_embedding
+        return self.doc_feature_embedding.lookup(news_rows)
+
+    def neighbors(self, entities, neighbor_num, weighted=False, fixed=False):#(..., neighbor_num) sampled neighbor entities and relations, on the device
+        return self.kg_graph.sample_neighbors(entities, neighbor_num, weighted, fixed=fixed)
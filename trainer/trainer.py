@@ -4,6 +4,7 @@ from utils.metrics import *
 from utils.pytorchtools import *
 from utils.logger import *
 from model.AnchorKG import *
+from model.anchor_cache import AnchorGraphCache
 from tqdm import tqdm
 import nni
 import json
@@ -39,7 +40,41 @@ class Trainer():
         self.train_dataloader = data[2]
         self.val_data = data[3]
         self.test_data = data[4]
-        self.train_val_hit_dict = data[-1]
+        self.news_vocab = data[5].vocab
+        self.val_rows = (torch.from_numpy(self.news_vocab.rows(self.val_data['item1'])), torch.from_numpy(self.news_vocab.rows(self.val_data['item2'])))#models take news rows
+        self.train_val_hit_graph = data[-1]
+        self.anchor_cache = AnchorGraphCache(config['anchor_cache_size'], self.news_vocab)
+
+    def infer_anchor_graph(self, news_rows):#anchor nodes and relations at inference, computed once per news and model version in greedy or beam mode
+        if self.model_anchor.deterministic():
+            return self.anchor_cache.anchor_graphs(self.model_anchor, news_rows)
+        _, _, _, anchor_graph, anchor_relation = self.model_anchor(news_rows, with_rewards=False)
+        return anchor_graph, anchor_relation
+
+    def pair_anchor_graphs(self, item1, item2):
+        """Run the anchor policy on the news of a batch of pairs, in one call.
+
+        With config['train_distinct_news'], each distinct news gets one anchor graph, shared by all its pairs (an item1
+        is in 1 + train_neg_num pairs of a batch and popular news also come back as item2). Otherwise, as by default,
+        each pair position samples its own anchor graph. The recommender and the reasoner take the news with the
+        positions of item1 and item2, and gather_steps keeps the per pair layout of actor_critic_loss, so the
+        rewards of every pair are attributed to the actions of its anchor graph.
+
+        Returns:
+            tensor, list, tensor, tensor: the news rows, model_anchor outputs (act_probs_steps, state_values_steps,
+            rewards_steps, anchor_graph, anchor_relation) for them, positions of item1 and of item2 in them on the device.
+        """
+        if self.config['train_distinct_news']:
+            news, inverse = torch.unique(torch.cat([item1, item2]), return_inverse=True)
+        else:
+            news = torch.cat([item1, item2])
+            inverse = torch.arange(len(news))
+        index1, index2 = inverse.to(self.device).split([len(item1), len(item2)])
+        return news, self.model_anchor(news), index1, index2
+
+    @staticmethod
+    def gather_steps(steps, index):#per pair steps from the per distinct news steps
+        return [step[index] for step in steps]
 
     def actor_critic_loss(self, rewards_steps, act_probs_steps, state_values_steps, embedding_loss, reasoning_loss, actor_loss_list, critic_loss_list):
         #rewards_steps:[(batch, 5), (batch, 15), (batch, 30);  
@@ -81,12 +116,12 @@ class Trainer():
         time_optimize = 0
         for _, batch in tqdm(enumerate(self.train_dataloader), total=len(self.train_dataloader)):
             t1=time.time()
-            act_probs_steps1, state_values_steps1, rewards_steps1, anchor_graph1, anchor_relation1 = self.model_anchor(batch['item1'])
-            act_probs_steps2, state_values_steps2, rewards_steps2, anchor_graph2, anchor_relation2 = self.model_anchor(batch['item2'])
+            news, anchor_outputs, index1, index2 = self.pair_anchor_graphs(batch['item1_row'], batch['item2_row'])
+            act_probs_steps, state_values_steps, rewards_steps, anchor_graph, anchor_relation = anchor_outputs
             t2=time.time()
-            embedding_predict = self.model_recommender(batch['item1'], batch['item2'], anchor_graph1, anchor_graph2)[0]#similarities between item1 and item2，normalize to [0,1]
+            embedding_predict = self.model_recommender.forward_distinct(news, anchor_graph, index1, index2)[0]#similarities between item1 and item2，normalize to [0,1]
             t3=time.time()
-            reasoning_predict = self.model_reasoner(batch['item1'], batch['item2'], anchor_graph1, anchor_graph2, anchor_relation1, anchor_relation2)[0]
+            reasoning_predict = self.model_reasoner.forward_distinct(news, anchor_graph, anchor_relation, index1, index2)[0]
             t4=time.time()
 
             embedding_loss = self.criterion(embedding_predict, batch['label'].to(self.device).float())
@@ -108,8 +143,9 @@ class Trainer():
 
             actor_loss_list = []
             critic_loss_list = []
-            self.actor_critic_loss(rewards_steps1, act_probs_steps1, state_values_steps1, embedding_loss, reasoning_loss, actor_loss_list, critic_loss_list)
-            self.actor_critic_loss(rewards_steps2, act_probs_steps2, state_values_steps2, embedding_loss, reasoning_loss, actor_loss_list, critic_loss_list)
+            for index in [index1, index2]:
+                self.actor_critic_loss(self.gather_steps(rewards_steps, index), self.gather_steps(act_probs_steps, index), self.gather_steps(state_values_steps, index),
+                                       embedding_loss, reasoning_loss, actor_loss_list, critic_loss_list)
 
             actor_losses = torch.stack(actor_loss_list).sum()
             critic_losses = torch.stack(critic_loss_list).sum()
@@ -152,16 +188,18 @@ class Trainer():
         with torch.no_grad():
             for start in tqdm(start_list, total=len(start_list)):
                 end = start + self.config['batch_size']
-                _, _, _, anchor_graph1, anchor_relation1 = self.model_anchor(self.val_data['item1'][start:end])
-                _, _, _, anchor_graph2, anchor_relation2 = self.model_anchor(self.val_data['item2'][start:end])
-                embedding_predict = self.model_recommender(self.val_data['item1'][start:end], self.val_data['item2'][start:end], anchor_graph1, anchor_graph2)[0]
-                reasoning_predict = self.model_reasoner(self.val_data['item1'][start:end], self.val_data['item2'][start:end], anchor_graph1, anchor_graph2, anchor_relation1, anchor_relation2)[0]
+                news1, news2 = self.val_rows[0][start:end], self.val_rows[1][start:end]
+                anchor_graph1, anchor_relation1 = self.infer_anchor_graph(news1)
+                anchor_graph2, anchor_relation2 = self.infer_anchor_graph(news2)
+                embedding_predict = self.model_recommender(news1, news2, anchor_graph1, anchor_graph2)[0]
+                reasoning_predict = self.model_reasoner(news1, news2, anchor_graph1, anchor_graph2, anchor_relation1, anchor_relation2)[0]
                 predict = self.config['alpha1'] * embedding_predict + (1-self.config['alpha1']) * reasoning_predict
                 y_pred.extend(predict.cpu().data.numpy())
 
         truth = self.val_data['label']
         auc_score = cal_auc(truth, y_pred)
         self.logger.info("epoch: {}, auc: {:.5f}".format(epoch, auc_score))
+        self.logger.debug("anchor graph cache: {} news, {} hits, {} misses".format(len(self.anchor_cache), self.anchor_cache.hits, self.anchor_cache.misses))
         return auc_score
 
     def _save_checkpoint(self, epoch, save_best=False):
@@ -276,6 +314,15 @@ class Trainer():
         if self.config['use_nni']:
             nni.report_final_result({"default": early_stopping.best_score})
 
+    def load_anchor_cache(self):#anchor graphs saved for the loaded checkpoint, if any
+        if self.model_anchor.deterministic():
+            loaded = self.anchor_cache.load(str(self.checkpoint_dir / 'anchor_graph_cache.pt'), self.model_anchor)
+            self.logger.info("anchor graph cache: {} news loaded".format(loaded))
+
+    def save_anchor_cache(self):
+        if self.model_anchor.deterministic():
+            self.anchor_cache.save(str(self.checkpoint_dir / 'anchor_graph_cache.pt'))
+
     def test(self):
         self.logger.info('testing')
         #load model
@@ -290,27 +337,38 @@ class Trainer():
         self.model_anchor.eval()
         self.model_recommender.eval()
         self.model_reasoner.eval()
+        self.load_anchor_cache()
 
         # get all news embeddings
         doc_list = list(self.test_data.keys())
         self.logger.info('len(doc_list) : {}'.format(len(doc_list)))
         start_list = list(range(0, len(doc_list), self.config['batch_size']))
+        doc_rows = torch.from_numpy(self.news_vocab.rows(doc_list))
         doc_embedding = torch.zeros([len(doc_list), self.config['embedding_size']]).to(self.device)
         with torch.no_grad():
             for start in start_list:
                 end = start + self.config['batch_size']
-                _, _, _, anchor_graph, _ = self.model_anchor(doc_list[start:end])
-                doc_embs = self.model_recommender(doc_list[start:end], doc_list[start:end], anchor_graph, anchor_graph)[1]
+                anchor_graph, _ = self.infer_anchor_graph(doc_rows[start:end])
+                doc_embs = self.model_recommender(doc_rows[start:end], doc_rows[start:end], anchor_graph, anchor_graph)[1]
                 doc_embedding[start:end,:] = doc_embs
-            
+        self.save_anchor_cache()
+
         topk = 10
         predict_dict = {}
-        for i, doc in enumerate(doc_list):
-            score, topk_items = torch.topk(torch.nn.functional.cosine_similarity(doc_embedding[i], doc_embedding, dim=-1), topk+len(self.train_val_hit_dict[doc])+1 if doc in self.train_val_hit_dict else topk+1)
-            topk_items = topk_items.tolist()
-            hit_set = self.train_val_hit_dict[doc] if doc in self.train_val_hit_dict else set()
-            filter_hit = [doc_list[item] for item in topk_items if doc_list[item] not in hit_set and item!=i]
-            predict_dict[doc] = filter_hit[:topk]
+        doc_position = torch.full([len(self.news_vocab)], -1, dtype=torch.long)#position in doc_list of each news row
+        doc_position[doc_rows] = torch.arange(len(doc_list))
+        for start in start_list:
+            end = min(start + self.config['batch_size'], len(doc_list))
+            segment, hit_rows = self.train_val_hit_graph.neighbors(doc_rows[start:end])
+            segment, hit_position = segment.cpu(), doc_position[hit_rows.cpu()]
+            hit_mask = torch.zeros([end-start, len(doc_list)], dtype=torch.bool)#hits and the news itself are not recommended
+            hit_mask[segment[hit_position>=0], hit_position[hit_position>=0]] = True
+            hit_mask[torch.arange(end-start), torch.arange(start, end)] = True
+            hit_mask = hit_mask.to(self.device)
+            for i in range(start, end):
+                score = torch.nn.functional.cosine_similarity(doc_embedding[i], doc_embedding, dim=-1).masked_fill(hit_mask[i-start], -float('inf'))
+                score, topk_items = torch.topk(score, min(topk, len(doc_list)))
+                predict_dict[doc_list[i]] = [doc_list[item] for item, item_score in zip(topk_items.tolist(), score.tolist()) if item_score > -float('inf')]
 
         # compute metric
         avg_precision, avg_recall, avg_ndcg, avg_hit, invalid_users = evaluate(predict_dict, self.test_data)
@@ -327,17 +385,21 @@ class Trainer():
         self.model_anchor.eval()
         self.model_recommender.eval()
         self.model_reasoner.eval()
+        self.load_anchor_cache()
 
         results=[]
         doc_list = list(self.test_data.keys())
+        doc_rows = torch.from_numpy(self.news_vocab.rows(doc_list))
         start_list = list(range(0, len(doc_list), self.config['batch_size']))
-        for start in start_list:
-            end = start + self.config['batch_size']
-            _, _, _, anchor_nodes, anchor_relations = self.model_anchor(doc_list[start:end])
-            _, nodes_list = self.model_reasoner.get_anchor_graph_list(anchor_nodes, anchor_nodes[0].shape[0])
-            _, relations_list = self.model_reasoner.get_anchor_graph_list(anchor_relations, anchor_nodes[0].shape[0])
-            for i in range(len(nodes_list)):
-                results.append({'news_id':doc_list[start+i], 'nodes':nodes_list[i], 'relations':relations_list[i]})
+        with torch.no_grad():
+            for start in start_list:
+                end = start + self.config['batch_size']
+                anchor_nodes, anchor_relations = self.infer_anchor_graph(doc_rows[start:end])
+                _, nodes_list = self.model_reasoner.get_anchor_graph_list(anchor_nodes, anchor_nodes[0].shape[0])
+                _, relations_list = self.model_reasoner.get_anchor_graph_list(anchor_relations, anchor_nodes[0].shape[0])
+                for i in range(len(nodes_list)):
+                    results.append({'news_id':doc_list[start+i], 'nodes':nodes_list[i], 'relations':relations_list[i]})
+        self.save_anchor_cache()
 
         with open('anchor_graph.json', 'w') as f:
             for item in results:
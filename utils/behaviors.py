@@ -0,0 +1,139 @@
+import os
+import hashlib
+from multiprocessing import Pool
+import numpy as np
+
+def behavior_shards(filenames, shard_bytes):
+    """Split behaviors files into byte ranges.
+
+    The layout only depends on the file sizes and `shard_bytes`, not on the number of workers,
+    so merging the shards in order always gives the same result.
+
+    Args:
+        filenames (list): behaviors.tsv files.
+        shard_bytes (int): size of each byte range.
+
+    Returns:
+        list: [(filename, start, end), ...] in file order.
+    """
+    shards = []
+    for filename in filenames:
+        file_size = os.path.getsize(filename)
+        for start in range(0, file_size, shard_bytes):
+            shards.append((filename, start, min(start + shard_bytes, file_size)))
+    return shards
+
+def parse_behavior_shard(shard):
+    """Parse the lines starting inside a byte range of a behaviors file.
+
+    Returns:
+        dict: partial user_history_dict, history clicked news id set for each user.
+        dict: partial news_click_dict, number of clicks for each news.
+    """
+    filename, start, end = shard
+    user_history_dict = {}
+    news_click_dict = {}
+    with open(filename, 'rb') as fp:
+        if start > 0:#a line belongs to the shard it starts in
+            fp.seek(start - 1)
+            fp.readline()
+        while fp.tell() < end:
+            line = fp.readline()
+            if not line:
+                break
+            index, userid, imp_time, history, behavior = line.decode('utf-8').strip().split('\t')
+            if userid not in user_history_dict:
+                user_history_dict[userid] = set()
+            for news in behavior.split(' '):
+                newsid, news_label = news.split('-')
+                if newsid=='':
+                    continue
+                if news_label == "1":
+                    user_history_dict[userid].add(newsid)
+                    news_click_dict[newsid] = news_click_dict.get(newsid, 0) + 1
+            for newsid in history.split(' '):#history may be empty
+                if newsid=='':
+                    continue
+                user_history_dict[userid].add(newsid)
+                news_click_dict[newsid] = news_click_dict.get(newsid, 0) + 1
+    return user_history_dict, news_click_dict
+
+def merge_behavior_counters(user_history_dict, news_click_dict, partial):
+    """Merge the counters of a shard into the global ones, in place."""
+    partial_user_history_dict, partial_news_click_dict = partial
+    for userid, history in partial_user_history_dict.items():
+        if userid in user_history_dict:
+            user_history_dict[userid] |= history
+        else:
+            user_history_dict[userid] = history
+    for newsid, clicks in partial_news_click_dict.items():
+        news_click_dict[newsid] = news_click_dict.get(newsid, 0) + clicks
+
+def parse_behaviors(filenames, num_workers=1, shard_bytes=64*1024*1024):
+    """Stream behaviors files shard by shard and count user histories and news clicks.
+
+    Shards are parsed in a process pool and merged in file order as soon as they are done,
+    so only a few partial counters are alive at the same time. The result does not depend on `num_workers`.
+
+    Args:
+        filenames (list): behaviors.tsv files.
+        num_workers (int): number of parsing processes, parse in the current process if <= 1.
+        shard_bytes (int): size of the byte range parsed by one task.
+
+    Returns:
+        dict: history clicked news id set for each user, including history and behavior.
+        dict: the total number of clicks each news was clicked by all users.
+    """
+    shards = behavior_shards(filenames, shard_bytes)
+    user_history_dict = {}
+    news_click_dict = {}
+    if num_workers <= 1:
+        for shard in shards:
+            merge_behavior_counters(user_history_dict, news_click_dict, parse_behavior_shard(shard))
+    else:
+        with Pool(num_workers) as pool:
+            for partial in pool.imap(parse_behavior_shard, shards):
+                merge_behavior_counters(user_history_dict, news_click_dict, partial)
+    return user_history_dict, news_click_dict
+
+def user_hash(userid):#63 bit id of a user, the same in every process
+    return int.from_bytes(hashlib.blake2b(userid.encode('utf-8'), digest_size=8).digest(), 'little') >> 1
+
+def parse_behavior_pairs_shard(shard):
+    """Parse the lines starting inside a byte range of a behaviors file into (user, news) click pairs.
+
+    The compact counterpart of parse_behavior_shard for the out-of-core mode: users are hashed and news are
+    numbered in the order of their first click in the shard, the order in which news_click_dict inserts them.
+
+    Returns:
+        list: news ids of the shard, in first click order.
+        np.ndarray: int64 number of clicks of each of them.
+        np.ndarray: int64 user hash of each click pair.
+        np.ndarray: int64 news of each click pair, positions in the news ids.
+    """
+    filename, start, end = shard
+    news_index = {}
+    clicks = []
+    users = []
+    news = []
+    with open(filename, 'rb') as fp:
+        if start > 0:#a line belongs to the shard it starts in
+            fp.seek(start - 1)
+            fp.readline()
+        while fp.tell() < end:
+            line = fp.readline()
+            if not line:
+                break
+            index, userid, imp_time, history, behavior = line.decode('utf-8').strip().split('\t')
+            user = user_hash(userid)
+            clicked = [item[:-2] for item in behavior.split(' ') if item.endswith('-1') and len(item) > 2]
+            clicked += [newsid for newsid in history.split(' ') if newsid != '']
+            for newsid in clicked:
+                if newsid not in news_index:
+                    news_index[newsid] = len(clicks)
+                    clicks.append(0)
+                position = news_index[newsid]
+                clicks[position] += 1
+                users.append(user)
+                news.append(position)
+    return list(news_index), np.array(clicks, dtype=np.int64), np.array(users, dtype=np.int64), np.array(news, dtype=np.int64)
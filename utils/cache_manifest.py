@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = 'manifest.json'
+
+def file_digest(filename, block_bytes=16*1024*1024):
+    """sha1 of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        while True:
+            block = fp.read(block_bytes)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+class CacheManifest:
+    """
+    Records, for every artifact of the cache directory, the key of the inputs it was built from.
+
+    The key of an artifact hashes its version, the content of its input files, the values of the
+    config keys it uses and the keys of the artifacts it depends on, so an artifact is stale as soon as
+    one of them changes, including through a dependency. Content digests of input files are memoized
+    by (size, mtime) in the manifest, an unchanged file is not read again.
+    """
+    def __init__(self, cache_path, manifest_name=MANIFEST_FILE):
+        self.cache_path = cache_path
+        self.manifest_file = os.path.join(cache_path, manifest_name)
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding='utf-8') as fp:
+                manifest = json.load(fp)
+        else:
+            manifest = {}
+        self.artifacts = manifest.get('artifacts', {})
+        self.files = manifest.get('files', {})
+        self.keys = {}#keys computed in this run
+
+    def input_digest(self, filename):
+        stat = os.stat(filename)
+        record = self.files.get(os.path.abspath(filename))
+        if record is None or record['size'] != stat.st_size or record['mtime_ns'] != stat.st_mtime_ns:
+            record = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_digest(filename)}
+            self.files[os.path.abspath(filename)] = record
+        return record['sha1']
+
+    def artifact_key(self, name, version, input_files, config_values, deps):
+        """Key of an artifact, the keys of `deps` must have been computed before."""
+        content = {
+            'name': name,
+            'version': version,
+            'inputs': [self.input_digest(filename) for filename in input_files],
+            'config': config_values,
+            'deps': [self.keys[dep] for dep in deps],
+        }
+        key = hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+        self.keys[name] = key
+        return key
+
+    def is_fresh(self, name, key, output_files):
+        record = self.artifacts.get(name)
+        return record is not None and record['key'] == key and all(os.path.exists(filename) for filename in output_files)
+
+    def record(self, name, key, output_files):
+        self.artifacts[name] = {'key': key, 'outputs': output_files}
+        self.save()
+
+    def save(self):
+        os.makedirs(self.cache_path, exist_ok=True)
+        with open(self.manifest_file + '.tmp', 'w', encoding='utf-8') as fp:#write then rename, an interrupted run keeps the old manifest
+            json.dump({'artifacts': self.artifacts, 'files': self.files}, fp, indent=4)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
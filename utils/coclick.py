@@ -0,0 +1,182 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import scipy.sparse as sp
+from utils.behaviors import behavior_shards, parse_behavior_pairs_shard
+from utils.external_sort import save_run, load_run, sum_runs
+
+THRED_CLICK_TIME = 10#news clicked no more than this are not used for positive pairs
+THRED_COCLICK_WEIGHT = 0.05#minimal normalized co-click weight of a positive pair
+
+def encode_user_news(user_history_dict, news_click_dict):
+    """Integer-encode users and news into a binary user x news click matrix.
+
+    Args:
+        user_history_dict (dict): clicked news id set for each user.
+        news_click_dict (dict): total number of clicks for each news.
+
+    Returns:
+        list: news ids, the position of a news id is its column in the matrix (first click order).
+        scipy.sparse.csr_matrix: (user_num, news_num) matrix, 1 if the user clicked the news.
+        np.ndarray: int64 click number for each column.
+    """
+    news_ids = list(news_click_dict)
+    news_index = {news: i for i, news in enumerate(news_ids)}
+    clicks = np.fromiter(news_click_dict.values(), dtype=np.int64, count=len(news_ids))
+
+    history_len = np.fromiter((len(history) for history in user_history_dict.values()), dtype=np.int64, count=len(user_history_dict))
+    indptr = np.zeros(len(user_history_dict)+1, dtype=np.int64)
+    np.cumsum(history_len, out=indptr[1:])
+    indices = np.fromiter((news_index[news] for history in user_history_dict.values() for news in history), dtype=np.int32, count=indptr[-1])
+    data = np.ones(len(indices), dtype=np.int32)
+    user_news = sp.csr_matrix((data, indices, indptr), shape=(len(user_history_dict), len(news_ids)))
+    return news_ids, user_news, clicks
+
+def coclick_positive_pairs(user_history_dict, news_click_dict, thred_click_time=THRED_CLICK_TIME, thred_weight=THRED_COCLICK_WEIGHT, chunk_size=4096):
+    """Positive news pairs from co-clicks, computed with sparse products.
+
+    The co-click number of (doc1, doc2) is the number of users who clicked both, it is normalized by
+    sqrt(clicks(doc1) * clicks(doc2)). A pair is positive if both news are clicked more than
+    `thred_click_time` times and the normalized weight is larger than `thred_weight`.
+
+    Args:
+        user_history_dict (dict): clicked news id set for each user.
+        news_click_dict (dict): total number of clicks for each news.
+        thred_click_time (int): click threshold for frequent news.
+        thred_weight (float): weight threshold for positive pairs.
+        chunk_size (int): number of news rows of the co-click matrix computed at a time, bounds the memory.
+
+    Returns:
+        list: positive pairs [(news1, news2), ...], ordered by the first click order of news1 then news2.
+        list: frequent news ids.
+    """
+    news_ids, user_news, clicks = encode_user_news(user_history_dict, news_click_dict)
+    freq_news = np.flatnonzero(clicks > thred_click_time)#only pairs of frequent news can be positive
+    freq_clicks = clicks[freq_news]
+    user_freq_news = user_news[:, freq_news].tocsc()
+    user_freq_news_t = user_freq_news.T.tocsr()
+
+    pair_rows = []
+    pair_cols = []
+    for start in range(0, len(freq_news), chunk_size):
+        end = min(start + chunk_size, len(freq_news))
+        coclick = (user_freq_news_t[start:end] @ user_freq_news).tocsr()#(chunk, freq_news_num)
+        coclick.sort_indices()
+        coclick = coclick.tocoo()
+        rows = coclick.row.astype(np.int64) + start
+        cols = coclick.col.astype(np.int64)
+        upper = cols > rows#(doc1, doc2) and (doc2, doc1) are the same pair
+        rows, cols, counts = rows[upper], cols[upper], coclick.data[upper]
+        weights = counts / np.sqrt((freq_clicks[rows] * freq_clicks[cols]).astype(np.float64))
+        positive = weights > thred_weight
+        pair_rows.append(rows[positive])
+        pair_cols.append(cols[positive])
+
+    pair_rows = freq_news[np.concatenate(pair_rows)] if pair_rows else np.zeros(0, dtype=np.int64)
+    pair_cols = freq_news[np.concatenate(pair_cols)] if pair_cols else np.zeros(0, dtype=np.int64)
+    news_positive_pairs = [(news_ids[doc1], news_ids[doc2]) for doc1, doc2 in zip(pair_rows.tolist(), pair_cols.tolist())]
+    return news_positive_pairs, [news_ids[news] for news in freq_news.tolist()]
+
+CLICK_BYTES = 7#behaviors bytes per click, a news id and a separator
+PAIR_BYTES = 64#memory per click pair while a partition is processed: arrays, sort and sparse matrices
+SHARD_OBJECT_BYTES = 16#memory of the parsed python objects per byte of a behaviors shard
+
+def coclick_positive_pairs_external(behavior_files, work_dir, memory_budget, num_workers=1, shard_bytes=64*1024*1024,
+                                    thred_click_time=THRED_CLICK_TIME, thred_weight=THRED_COCLICK_WEIGHT, chunk_size=4096):
+    """coclick_positive_pairs of behaviors files without holding the click histories in memory.
+
+    1. Shards of the behaviors files are parsed into (user hash, news) click pairs, news are numbered in the
+       order of news_click_dict. Pairs are spilled to partition files by user, so a user is in one partition.
+    2. The co-click counts of the frequent news of each partition are computed with sparse products and
+       spilled as runs sorted by pair.
+    3. The runs are merged, summing the counts of a pair over the partitions, and the weights thresholded.
+    The number of partitions and the shard and block sizes follow from `memory_budget`.
+
+    Args:
+        behavior_files (list): behaviors.tsv files.
+        work_dir (str): directory of the spilled partitions and runs, emptied by the caller.
+        memory_budget (int): bytes of memory the computation aims to stay under.
+        num_workers (int): number of parsing processes, parse in the current process if <= 1.
+        shard_bytes (int): maximum size of the byte range parsed by one task.
+        thred_click_time, thred_weight, chunk_size: see coclick_positive_pairs.
+
+    Returns:
+        list: news ids, in the order of news_click_dict.
+        np.ndarray: int64 first news of the positive pairs, positions in the news ids, ordered as coclick_positive_pairs.
+        np.ndarray: int64 second news of the positive pairs.
+        np.ndarray: int64 frequent news, positions in the news ids.
+    """
+    total_bytes = sum(os.path.getsize(filename) for filename in behavior_files)
+    partition_num = max(1, int(np.ceil(total_bytes / CLICK_BYTES * PAIR_BYTES / memory_budget)))
+    shard_bytes = max(1<<20, min(shard_bytes, memory_budget // (SHARD_OBJECT_BYTES * (max(num_workers, 1) + 1))))
+    partition_files = [(os.path.join(work_dir, 'users_{}.bin'.format(p)), os.path.join(work_dir, 'news_{}.bin'.format(p))) for p in range(partition_num)]
+    for files in partition_files:
+        for filename in files:
+            open(filename, 'wb').close()
+
+    news_index = {}
+    clicks = np.zeros(0, dtype=np.int64)
+    def spill(result):
+        nonlocal clicks
+        shard_news, shard_clicks, users, news = result
+        mapping = np.fromiter((news_index.setdefault(newsid, len(news_index)) for newsid in shard_news), dtype=np.int64, count=len(shard_news))
+        clicks = np.concatenate([clicks, np.zeros(len(news_index) - len(clicks), dtype=np.int64)])
+        clicks[mapping] += shard_clicks
+        news = mapping[news]
+        partition = users % partition_num
+        for p, (users_file, news_file) in enumerate(partition_files):
+            with open(users_file, 'ab') as fp:
+                users[partition == p].tofile(fp)
+            with open(news_file, 'ab') as fp:
+                news[partition == p].tofile(fp)
+    shards = behavior_shards(behavior_files, shard_bytes)
+    if num_workers <= 1:
+        for shard in shards:
+            spill(parse_behavior_pairs_shard(shard))
+    else:
+        with Pool(num_workers) as pool:
+            for result in pool.imap(parse_behavior_pairs_shard, shards):
+                spill(result)
+    news_ids = list(news_index)
+    del news_index
+
+    freq_news = np.flatnonzero(clicks > thred_click_time)#only pairs of frequent news can be positive
+    freq_clicks = clicks[freq_news]
+    freq_num = len(freq_news)
+    freq_position = np.full(len(news_ids), -1, dtype=np.int64)
+    freq_position[freq_news] = np.arange(freq_num)
+    runs = []
+    for p, (users_file, news_file) in enumerate(partition_files):
+        users = np.fromfile(users_file, dtype=np.int64)
+        news = freq_position[np.fromfile(news_file, dtype=np.int64)]
+        os.remove(users_file)
+        os.remove(news_file)
+        users, news = users[news >= 0], news[news >= 0]
+        order = np.lexsort((news, users))
+        users, news = users[order], news[order]
+        first = np.concatenate([[True], (users[1:] != users[:-1]) | (news[1:] != news[:-1])])#a user clicks a news once
+        users, news = users[first], news[first]
+        user_rows = np.cumsum(np.concatenate([[False], users[1:] != users[:-1]])) if len(users) else users
+        user_freq_news = sp.csr_matrix((np.ones(len(news), dtype=np.int32), (user_rows, news)), shape=(int(user_rows[-1])+1 if len(users) else 0, freq_num)).tocsc()
+        user_freq_news_t = user_freq_news.T.tocsr()
+        del users, news, user_rows
+        for start in range(0, freq_num, chunk_size):
+            coclick = (user_freq_news_t[start:min(start + chunk_size, freq_num)] @ user_freq_news).tocoo()
+            rows = coclick.row.astype(np.int64) + start
+            cols = coclick.col.astype(np.int64)
+            upper = cols > rows#(doc1, doc2) and (doc2, doc1) are the same pair
+            if upper.any():
+                runs.append(save_run(work_dir, 'coclick_{}_{}'.format(p, start), rows[upper] * freq_num + cols[upper], coclick.data[upper].astype(np.int64)))
+
+    pair_rows = []
+    pair_cols = []
+    block_items = max(1024, memory_budget // (PAIR_BYTES * max(len(runs), 1)))
+    for keys, counts in sum_runs([load_run(files) for files in runs], block_items):
+        rows, cols = keys // freq_num, keys % freq_num
+        weights = counts / np.sqrt((freq_clicks[rows] * freq_clicks[cols]).astype(np.float64))
+        positive = weights > thred_weight
+        pair_rows.append(freq_news[rows[positive]])
+        pair_cols.append(freq_news[cols[positive]])
+    pair_rows = np.concatenate(pair_rows) if pair_rows else np.zeros(0, dtype=np.int64)
+    pair_cols = np.concatenate(pair_cols) if pair_cols else np.zeros(0, dtype=np.int64)
+    return news_ids, pair_rows, pair_cols, freq_news
@@ -0,0 +1,165 @@
+import os
+import hashlib
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+def text_key(text, model_name):
+    """Cache key of a text, the same text encoded by another model gets another key."""
+    return hashlib.sha1((model_name + '\t' + text).encode('utf-8')).hexdigest()
+
+class EncodingCache:
+    """
+    Persistent sentence embedding cache, a key array and a float32 embedding matrix saved as .npy files.
+
+    Embeddings added by a run are saved as a new segment (keys_<i>.npy, embeddings_<i>.npy) instead of
+    rewriting the cache, and segments are memory-mapped, so only the embeddings asked for are read.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.segments = []#memory-mapped embeddings of each segment
+        keys = []
+        while os.path.exists(self.segment_files(len(self.segments))[1]):
+            keys_file, embeddings_file = self.segment_files(len(self.segments))
+            keys.append(np.load(keys_file))
+            self.segments.append(np.load(embeddings_file, mmap_mode='r'))
+        self.saved_segment_num = len(self.segments)
+        self.keys = np.concatenate(keys) if keys else np.zeros(0, dtype='<U40')
+        self.key_index = {key: i for i, key in enumerate(self.keys.tolist())}
+
+    def segment_files(self, segment):
+        suffix = '' if segment == 0 else '_{}'.format(segment)
+        return os.path.join(self.cache_dir, 'keys{}.npy'.format(suffix)), os.path.join(self.cache_dir, 'embeddings{}.npy'.format(suffix))
+
+    def __contains__(self, key):
+        return key in self.key_index
+
+    def get(self, keys):
+        positions = np.fromiter((self.key_index[key] for key in keys), dtype=np.int64, count=len(keys))
+        embeddings = np.zeros((len(keys), self.segments[0].shape[1] if self.segments else 0), dtype=np.float32)
+        start = 0
+        for matrix in self.segments:
+            in_segment = (positions >= start) & (positions < start + len(matrix))
+            if in_segment.any():
+                embeddings[in_segment] = matrix[positions[in_segment] - start]
+            start += len(matrix)
+        return embeddings
+
+    def add(self, keys, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        self.key_index.update({key: len(self.keys)+i for i, key in enumerate(keys)})
+        self.keys = np.concatenate([self.keys, np.array(keys, dtype='<U40')])
+        self.segments.append(embeddings)
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        start = sum(len(matrix) for matrix in self.segments[:self.saved_segment_num])
+        for segment in range(self.saved_segment_num, len(self.segments)):
+            matrix = self.segments[segment]
+            keys_file, embeddings_file = self.segment_files(segment)
+            for filename, array in [(keys_file, self.keys[start:start+len(matrix)]), (embeddings_file, matrix)]:#embeddings last, they mark a complete segment
+                with open(filename + '.tmp', 'wb') as fp:#write then rename, an interrupted run keeps the old cache
+                    np.save(fp, array)
+                os.replace(filename + '.tmp', filename)
+            self.segments[segment] = np.load(embeddings_file, mmap_mode='r')#saved embeddings are read back from the file, not held in memory
+            start += len(matrix)
+        self.saved_segment_num = len(self.segments)
+
+    def merge(self):
+        """Save the cache as a single segment, so that the next runs do not open one segment per run or per chunk."""
+        self.save()
+        if len(self.segments) <= 1:
+            return
+        keys_file, embeddings_file = self.segment_files(0)
+        embeddings = np.lib.format.open_memmap(embeddings_file + '.tmp', mode='w+', dtype=np.float32, shape=(len(self.keys), self.segments[0].shape[1]))
+        start = 0
+        for matrix in self.segments:
+            embeddings[start:start+len(matrix)] = matrix
+            start += len(matrix)
+        embeddings.flush()
+        del embeddings
+        with open(keys_file + '.tmp', 'wb') as fp:
+            np.save(fp, self.keys)
+        for segment in reversed(range(len(self.segments))):#drop the segments from the last one, an interrupted merge leaves a smaller but valid cache
+            os.remove(self.segment_files(segment)[1])
+        for segment in range(1, len(self.segments)):
+            os.remove(self.segment_files(segment)[0])
+        os.replace(keys_file + '.tmp', keys_file)
+        os.replace(embeddings_file + '.tmp', embeddings_file)
+        self.segments = [np.load(embeddings_file, mmap_mode='r')]
+        self.saved_segment_num = 1
+
+class DocEncoder:
+    """
+    Sentence encoder and its persistent EncodingCache, opened once for all the texts of a run.
+
+    The SentenceTransformer model (and its process pool when `num_workers` > 1) is built on the first texts
+    missing in the cache. Each encode call saves its new embeddings as a cache segment, close merges the
+    segments and stops the pool.
+    """
+    def __init__(self, model_name, cache_dir, batch_size=64, num_workers=1):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.cache = EncodingCache(cache_dir)
+        self.model = None
+        self.pool = None
+
+    def encode(self, texts):
+        """Sentence embeddings of texts, only texts missing in the cache are encoded.
+
+        Missing texts are sorted by length before batching so that a batch pads to similar lengths,
+        and are encoded by `num_workers` CPU processes when `num_workers` > 1.
+
+        Args:
+            texts (list): texts to encode.
+
+        Returns:
+            np.ndarray: float32 embeddings, (len(texts), embedding_size).
+        """
+        keys = [text_key(text, self.model_name) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.cache and key not in missing:
+                missing[key] = text
+        print("encoding {} of {} texts, the others are cached".format(len(missing), len(texts)))
+
+        if len(missing) > 0:
+            missing_keys = sorted(missing, key=lambda key: len(missing[key]))
+            missing_texts = [missing[key] for key in missing_keys]
+            if self.model is None:
+                self.model = SentenceTransformer(self.model_name, device='cpu' if self.num_workers > 1 else None)
+                if self.num_workers > 1:
+                    self.pool = self.model.start_multi_process_pool(target_devices=['cpu']*self.num_workers)
+            if self.pool is not None:
+                embeddings = self.model.encode_multi_process(missing_texts, self.pool, batch_size=self.batch_size)
+            else:
+                embeddings = self.model.encode(missing_texts, batch_size=self.batch_size, show_progress_bar=True)
+            self.cache.add(missing_keys, embeddings)
+            self.cache.save()
+        return self.cache.get(keys)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+        self.cache.merge()
+
+def encode_texts(texts, model_name, cache_dir, batch_size=64, num_workers=1):
+    """Sentence embeddings of texts with a DocEncoder, see DocEncoder.encode.
+
+    Args:
+        texts (list): texts to encode.
+        model_name (str): SentenceTransformer model name.
+        cache_dir (str): directory of the persistent cache.
+        batch_size (int): encoding batch size.
+        num_workers (int): number of encoding processes.
+
+    Returns:
+        np.ndarray: float32 embeddings, (len(texts), embedding_size).
+    """
+    encoder = DocEncoder(model_name, cache_dir, batch_size, num_workers)
+    embeddings = encoder.encode(texts)
+    encoder.close()
+    return embeddings
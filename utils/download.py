@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+import hashlib
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from tqdm import tqdm
+
+RANGE_BYTES = 8*1024*1024#bytes per range request, the unit of resumption
+BLOCK_BYTES = 1024*1024
+MAX_RETRIES = 3#attempts per range before the download fails (it can be resumed)
+
+def parse_checksum(checksum):#"sha256:<hex digest>", md5 or any hashlib algorithm
+    algorithm, digest = checksum.split(':', 1)
+    return algorithm.lower(), digest.lower()
+
+def file_checksum(filename, algorithm='sha256'):
+    hasher = hashlib.new(algorithm)
+    with open(filename, 'rb') as fp:
+        for block in iter(lambda: fp.read(BLOCK_BYTES), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def verify_checksum(filename, checksum):
+    """Whether a file has the given checksum, True when no checksum is known."""
+    if checksum is None:
+        return True
+    algorithm, digest = parse_checksum(checksum)
+    return file_checksum(filename, algorithm) == digest
+
+class DownloadState:
+    """
+    Progress of a `<file>.part` download, saved as `<file>.part.json`: the url, size and ETag of the remote
+    file and the ranges already written. A state of another version of the remote file is discarded.
+    """
+    def __init__(self, part_file, url, size, etag):
+        self.state_file = part_file + '.json'
+        self.remote = {'url': url, 'size': size, 'etag': etag}
+        self.done = set()
+        self.lock = threading.Lock()
+        if os.path.exists(self.state_file) and os.path.exists(part_file):
+            with open(self.state_file, 'r', encoding='utf-8') as fp:
+                state = json.load(fp)
+            if state['remote'] == self.remote:
+                self.done = set(state['done'])
+
+    def add(self, start):
+        with self.lock:
+            self.done.add(start)
+            with open(self.state_file + '.tmp', 'w', encoding='utf-8') as fp:
+                json.dump({'remote': self.remote, 'done': sorted(self.done)}, fp)
+            os.replace(self.state_file + '.tmp', self.state_file)
+
+    def remove(self):
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+def fetch_range(url, part_file, start, end, progress, timeout):
+    """Write bytes [start, end) of url at the same offset of part_file."""
+    for attempt in range(MAX_RETRIES):
+        written = 0
+        try:
+            r = requests.get(url, headers={'Range': 'bytes={}-{}'.format(start, end-1)}, stream=True, timeout=timeout)
+            if r.status_code != 206:
+                raise IOError("{}: range request answered with status {}".format(url, r.status_code))
+            with open(part_file, 'r+b') as fp:
+                fp.seek(start)
+                for block in r.iter_content(BLOCK_BYTES):
+                    fp.write(block[:end-start-written])
+                    written += len(block)
+                    progress.update(len(block))
+            if written < end - start:
+                raise IOError("{}: range {}-{} interrupted after {} bytes".format(url, start, end, written))
+            return start
+        except (IOError, requests.RequestException):
+            progress.update(-written)
+            if attempt == MAX_RETRIES - 1:
+                raise
+
+def fetch_stream(url, part_file, progress, timeout):#servers without range requests, restarts from the beginning
+    r = requests.get(url, stream=True, timeout=timeout)
+    r.raise_for_status()
+    with open(part_file, 'wb') as fp:
+        for block in r.iter_content(BLOCK_BYTES):
+            fp.write(block)
+            progress.update(len(block))
+
+def download_file(url, filepath, checksum=None, mirror_dir=None, num_connections=4, range_bytes=RANGE_BYTES, timeout=60):
+    """Download a file with parallel range requests, resuming an interrupted download.
+
+    The file is written to `<filepath>.part` and renamed once its size and checksum are verified, so an
+    existing `filepath` is always complete. Ranges already written by a previous run are not fetched again.
+    A file of `mirror_dir` with the same name and a valid checksum is used instead of the url.
+
+    Args:
+        url (str): URL of the file.
+        filepath (str): destination file.
+        checksum (str): expected "<algorithm>:<hex digest>", e.g. "sha256:...", or None.
+        mirror_dir (str): local directory of already downloaded files, or None.
+        num_connections (int): number of parallel range requests.
+        range_bytes (int): bytes per range request.
+        timeout (float): seconds without data before a request fails.
+
+    Returns:
+        str: path of the verified file, in `mirror_dir` if it was found there.
+    """
+    if os.path.exists(filepath) and verify_checksum(filepath, checksum):
+        return filepath
+    if mirror_dir is not None:
+        mirror_file = os.path.join(mirror_dir, os.path.basename(filepath))
+        if os.path.exists(mirror_file) and verify_checksum(mirror_file, checksum):
+            return mirror_file
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    part_file = filepath + '.part'
+
+    head = requests.head(url, allow_redirects=True, timeout=timeout)
+    head.raise_for_status()
+    size = int(head.headers.get('content-length', -1))
+    with tqdm(total=max(size, 0), unit="B", unit_scale=True, desc=os.path.basename(filepath)) as progress:
+        if size > 0 and head.headers.get('accept-ranges', '').lower() == 'bytes':
+            state = DownloadState(part_file, head.url, size, head.headers.get('etag'))
+            if not state.done:
+                with open(part_file, 'wb') as fp:
+                    fp.truncate(size)
+            pending = [start for start in range(0, size, range_bytes) if start not in state.done]
+            progress.update(size - sum(min(range_bytes, size - start) for start in pending))
+            with ThreadPoolExecutor(num_connections) as pool:
+                futures = [pool.submit(fetch_range, head.url, part_file, start, min(start + range_bytes, size), progress, timeout) for start in pending]
+                for future in as_completed(futures):
+                    state.add(future.result())
+        else:
+            state = None
+            fetch_stream(head.url, part_file, progress, timeout)
+
+    if (size > 0 and os.path.getsize(part_file) != size) or not verify_checksum(part_file, checksum):
+        os.remove(part_file)
+        if state is not None:
+            state.remove()
+        raise IOError("Failed to verify {}".format(filepath))
+    os.replace(part_file, filepath)
+    if state is not None:
+        state.remove()
+    return filepath
+
+def extract_zip(zip_src, dst_dir, block_bytes=BLOCK_BYTES):
+    """Extract a zip archive member by member, streaming each one in blocks of `block_bytes`.
+
+    Members are written to a temporary file and renamed, members of the same size already extracted by an
+    interrupted run are skipped. Members outside of `dst_dir` are rejected.
+    """
+    dst_dir = os.path.realpath(dst_dir)
+    with zipfile.ZipFile(zip_src, "r") as fz:
+        for info in fz.infolist():
+            target = os.path.realpath(os.path.join(dst_dir, info.filename))
+            if os.path.commonpath([dst_dir, target]) != dst_dir:
+                raise ValueError("{}: member {} is outside of the destination".format(zip_src, info.filename))
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            if os.path.exists(target) and os.path.getsize(target) == info.file_size:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with fz.open(info) as src, open(target + '.tmp', 'wb') as dst:#the crc is checked at the end of the member
+                shutil.copyfileobj(src, dst, block_bytes)
+            os.replace(target + '.tmp', target)
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import torch
+from utils.news_columns import NewsVocab
+
+class DocEmbeddingStore:
+    """
+    Document embeddings as one contiguous matrix file plus a news id -> row index.
+
+    The matrix is saved with np.save (float32 or float16) and opened with memory mapping,
+    the news ids are saved one per line in `<name>_ids.txt` in row order. This vocabulary is
+    shared by the news keyed arrays of the cache.
+
+    By default to() copies the whole matrix as float32 on the model device, num_news x embedding_size x 4 bytes
+    (about 0.5GB for the 160k news of MIND-large with 768 dimensions). With `on_device` False, lookup() gathers
+    the rows of each batch from the memory-mapped matrix instead, so only the pages read are held in RAM.
+    """
+    def __init__(self, vocab, matrix, on_device=True):
+        self.vocab = vocab
+        self.matrix = matrix
+        self.on_device = on_device
+        self.device = torch.device('cpu')
+        self.weight = None#float32 tensor of the matrix on the model device, see to()
+
+    @staticmethod
+    def ids_file(filename):
+        return os.path.splitext(filename)[0] + '_ids.txt'
+
+    @classmethod
+    def write(cls, filename, ids, embeddings, dtype='float32'):
+        embeddings = np.ascontiguousarray(embeddings, dtype=dtype)
+        assert len(ids) == embeddings.shape[0]
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        np.save(filename, embeddings)
+        vocab = NewsVocab(list(ids))
+        vocab.save(cls.ids_file(filename))
+        return cls(vocab, embeddings)
+
+    @classmethod
+    def create(cls, filename, ids, embedding_size, dtype='float32'):
+        """An empty store whose matrix is a writable memory map, for writing the embeddings chunk by chunk."""
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        matrix = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(len(ids), embedding_size))
+        vocab = NewsVocab(list(ids))
+        vocab.save(cls.ids_file(filename))
+        return cls(vocab, matrix)
+
+    @classmethod
+    def load(cls, filename, mmap=True, on_device=True):
+        matrix = np.load(filename, mmap_mode='r' if mmap else None)
+        return cls(NewsVocab.load(cls.ids_file(filename)), matrix, on_device)
+
+    @property
+    def embedding_size(self):
+        return self.matrix.shape[1]
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __contains__(self, newsid):
+        return newsid in self.vocab
+
+    def __getitem__(self, newsid):#(embedding_size), float32
+        return torch.from_numpy(np.array(self.matrix[self.vocab.row(newsid)], dtype=np.float32))
+
+    def get_batch(self, newsids):#(len(newsids), embedding_size), float32
+        return torch.from_numpy(np.array(self.matrix[self.vocab.rows(newsids)], dtype=np.float32))
+
+    def rows(self, newsids):#int64 tensor of the rows of news ids, for the dataset and collate functions
+        return torch.from_numpy(self.vocab.rows(newsids))
+
+    def to(self, device):
+        """Use `device` for the lookups. With on_device, copy the matrix once as a float32 tensor on it, shared by the models holding this store."""
+        device = torch.device(device)
+        if device.type == 'cuda' and device.index is None:
+            device = torch.device('cuda', torch.cuda.current_device())
+        self.device = device
+        if self.on_device and (self.weight is None or self.weight.device != device):
+            self.weight = torch.from_numpy(np.array(self.matrix, dtype=np.float32)).to(device)
+        return self
+
+    def lookup(self, rows):#(len(rows), embedding_size), float32 on the device of to(), one gather per batch
+        if not self.on_device:#distinct rows read in file order from the memory map
+            unique_rows, inverse = np.unique(torch.as_tensor(rows, dtype=torch.long).cpu().numpy(), return_inverse=True)
+            embeddings = torch.from_numpy(np.array(self.matrix[unique_rows], dtype=np.float32)).to(self.device)
+            return embeddings[torch.from_numpy(inverse.reshape(-1)).to(self.device)]
+        if self.weight is None:
+            self.to('cpu')
+        return self.weight.index_select(0, torch.as_tensor(rows, dtype=torch.long).to(self.weight.device))
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+
+def save_run(dirname, name, keys, values):
+    """Save a run: int64 keys sorted in ascending order and the values of each key, as two .npy files.
+
+    Returns:
+        tuple: (keys file, values file).
+    """
+    order = np.argsort(keys, kind='stable')
+    files = (os.path.join(dirname, name + '_keys.npy'), os.path.join(dirname, name + '_values.npy'))
+    np.save(files[0], np.asarray(keys, dtype=np.int64)[order])
+    np.save(files[1], np.asarray(values)[order])
+    return files
+
+def load_run(files):#memory-mapped (keys, values)
+    return np.load(files[0], mmap_mode='r'), np.load(files[1], mmap_mode='r')
+
+def merge_runs(runs, block_items=1<<20):
+    """Merge sorted runs, block by block.
+
+    Every block holds all the items of its keys, a key is never split between two blocks. At most
+    about `block_items` items of each run are read at a time (more if a single key has more items).
+
+    Args:
+        runs (list): (keys, values) of each run, keys sorted, e.g. memory-mapped by load_run.
+        block_items (int): items read from each run per block.
+
+    Yields:
+        np.ndarray: sorted int64 keys of a block.
+        np.ndarray: their values.
+    """
+    cursors = [0] * len(runs)
+    while True:
+        active = [i for i, (keys, _) in enumerate(runs) if cursors[i] < len(keys)]
+        if not active:
+            return
+        size = block_items
+        while True:
+            ends = {i: min(cursors[i] + size, len(runs[i][0])) for i in active}
+            partial = [runs[i][0][ends[i]-1] for i in active if ends[i] < len(runs[i][0])]
+            bound = min(partial) if partial else None#keys below the bound are complete in this block
+            stops = {i: ends[i] if bound is None else cursors[i] + int(np.searchsorted(runs[i][0][cursors[i]:ends[i]], bound, side='left')) for i in active}
+            if any(stops[i] > cursors[i] for i in active):
+                break
+            size *= 2#one key fills the blocks
+        keys = np.concatenate([np.asarray(runs[i][0][cursors[i]:stops[i]]) for i in active])
+        values = np.concatenate([np.asarray(runs[i][1][cursors[i]:stops[i]]) for i in active])
+        for i in active:
+            cursors[i] = stops[i]
+        order = np.argsort(keys, kind='stable')
+        yield keys[order], values[order]
+
+def sum_runs(runs, block_items=1<<20):
+    """Merge sorted runs of (key, count) and sum the counts of equal keys.
+
+    Yields:
+        np.ndarray: sorted unique int64 keys of a block.
+        np.ndarray: the total count of each key.
+    """
+    for keys, values in merge_runs(runs, block_items):
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        yield keys[starts], np.add.reduceat(values, starts)
@@ -0,0 +1,182 @@
+import os
+import numpy as np
+import torch
+
+def read_id_file(filename):
+    """entity2id.txt / relation2id.txt to a label -> id dict, ids start from 1 (0 for padding)."""
+    with open(filename, 'r', encoding='utf-8') as fp:
+        _ = fp.readline()
+        tokens = fp.read().split()
+    ids = np.array(tokens[1::2], dtype=np.int64) + 1
+    return dict(zip(tokens[0::2], ids.tolist()))
+
+def read_triples(filename, entity_id_dict, relation_id_dict, chunk_bytes=256*1024*1024):
+    """Integer-encode the (head, relation, tail) columns of a triple file.
+
+    The file is read in chunks of lines, each chunk is split in one call and its columns are
+    mapped to ids in bulk.
+
+    Returns:
+        np.ndarray: int32 heads, relations and tails.
+    """
+    heads = []
+    relations = []
+    tails = []
+    with open(filename, 'r', encoding='utf-8') as fp:
+        while True:
+            lines = fp.readlines(chunk_bytes)
+            if not lines:
+                break
+            tokens = ''.join(lines).split()
+            heads.append(np.fromiter(map(entity_id_dict.__getitem__, tokens[0::3]), dtype=np.int32, count=len(tokens)//3))
+            relations.append(np.fromiter(map(relation_id_dict.__getitem__, tokens[1::3]), dtype=np.int32, count=len(tokens)//3))
+            tails.append(np.fromiter(map(entity_id_dict.__getitem__, tokens[2::3]), dtype=np.int32, count=len(tokens)//3))
+    if not heads:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    return np.concatenate(heads), np.concatenate(relations), np.concatenate(tails)
+
+class KnowledgeGraph:
+    """
+    Knowledge graph in CSR form: the out edges of entity e are
+    indices[indptr[e]:indptr[e+1]] (tail entities) with relations[indptr[e]:indptr[e+1]].
+    Entity and relation id 0 is padding.
+
+    The arrays are int32 numpy arrays, shared with the torch tensors used by sample_neighbors,
+    so the memory scales with the number of edges.
+    """
+    MAX_WINDOW = 1024#entities with more edges are sampled with replacement
+
+    def __init__(self, indptr, indices, relations):
+        self.indptr = indptr
+        self.indices = indices
+        self.relations = relations
+        self.device = torch.device('cpu')
+        self.indptr_tensor = torch.from_numpy(indptr)
+        self.indices_tensor = torch.from_numpy(indices)
+        self.relations_tensor = torch.from_numpy(relations)
+        self.cum_weight = None#cumulated edge weights for degree weighted sampling, built on first use
+
+    @classmethod
+    def from_triples(cls, heads, relations, tails, num_entities):
+        assert len(heads) < np.iinfo(np.int32).max
+        order = np.argsort(heads, kind='stable')#keep the file order of the edges of an entity
+        indptr = np.zeros(num_entities+1, dtype=np.int32)
+        np.cumsum(np.bincount(heads, minlength=num_entities), out=indptr[1:])
+        return cls(indptr, tails[order].astype(np.int32), relations[order].astype(np.int32))
+
+    def save(self, dirname):
+        os.makedirs(dirname, exist_ok=True)
+        np.save(os.path.join(dirname, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(dirname, 'indices.npy'), self.indices)
+        np.save(os.path.join(dirname, 'relations.npy'), self.relations)
+
+    @classmethod
+    def load(cls, dirname):
+        return cls(*[np.load(os.path.join(dirname, name + '.npy'), mmap_mode='c') for name in ['indptr', 'indices', 'relations']])
+
+    def to(self, device):
+        self.device = torch.device(device)
+        self.indptr_tensor = self.indptr_tensor.to(device)
+        self.indices_tensor = self.indices_tensor.to(device)
+        self.relations_tensor = self.relations_tensor.to(device)
+        if self.cum_weight is not None:
+            self.cum_weight = self.cum_weight.to(device)
+        return self
+
+    @property
+    def num_entities(self):
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def sample_neighbors(self, entities, neighbor_num, weighted=False, generator=None, fixed=False):
+        """Draw `neighbor_num` (entity, relation) neighbors for every entity of a batch.
+
+        Entities with at most `neighbor_num` edges return all of them in order, padded with 0.
+        Other entities get a new sample at each call, without replacement up to MAX_WINDOW edges
+        and with replacement above. With `weighted`, a neighbor is drawn proportionally to its
+        degree + 1, otherwise uniformly. With `fixed`, the sample of an entity is the same at
+        every call, whatever the rest of the batch (see fixed_offsets).
+
+        Args:
+            entities (torch.Tensor): entity ids of any shape.
+            neighbor_num (int): number of neighbors per entity.
+            weighted (bool): degree weighted sampling.
+            generator (torch.Generator): random generator on the graph device, the global one if None.
+            fixed (bool): deterministic sample, for inference.
+
+        Returns:
+            torch.Tensor: int64 neighbor entities and relations, entities.shape + (neighbor_num,).
+        """
+        shape = entities.shape
+        entities = entities.reshape(-1).to(self.device, torch.long)
+        start = self.indptr_tensor[entities].long()
+        degree = self.indptr_tensor[entities+1].long() - start
+        offset = torch.arange(neighbor_num, device=self.device).expand(len(entities), neighbor_num).clone()
+        valid = offset < degree[:, None]
+        sampled = torch.nonzero(degree > neighbor_num).squeeze(1)
+        if len(sampled) > 0:
+            if fixed:
+                offset[sampled] = self.fixed_offsets(start[sampled], degree[sampled], neighbor_num, weighted)
+            else:
+                offset[sampled] = self.sample_offsets(start[sampled], degree[sampled], neighbor_num, weighted, generator)
+            valid[sampled] = True
+        edge = torch.where(valid, start[:, None] + offset, torch.zeros_like(offset))
+        neighbor_entities = torch.where(valid, self.indices_tensor[edge].long(), torch.zeros_like(offset))
+        neighbor_relations = torch.where(valid, self.relations_tensor[edge].long(), torch.zeros_like(offset))
+        return neighbor_entities.reshape(shape + (neighbor_num,)), neighbor_relations.reshape(shape + (neighbor_num,))
+
+    def sample_offsets(self, start, degree, neighbor_num, weighted, generator):#edge offsets for entities with more than neighbor_num edges
+        offset = torch.zeros([len(start), neighbor_num], dtype=torch.long, device=self.device)
+        window = torch.nonzero(degree <= self.MAX_WINDOW).squeeze(1)
+        if len(window) > 0:#without replacement, the largest random keys (Efraimidis-Spirakis keys log(u)/w if weighted)
+            width = int(degree[window].max())
+            position = torch.arange(width, device=self.device)
+            in_row = position[None, :] < degree[window, None]
+            keys = torch.rand([len(window), width], generator=generator, device=self.device)
+            if weighted:
+                tails = self.indices_tensor[torch.where(in_row, start[window, None] + position, torch.zeros_like(position))].long()
+                keys = torch.log(keys) / self.neighbor_weight(tails)
+            keys = keys.masked_fill(~in_row, -float('inf'))
+            offset[window] = keys.topk(neighbor_num, dim=-1).indices
+        hub = torch.nonzero(degree > self.MAX_WINDOW).squeeze(1)
+        if len(hub) > 0:#with replacement
+            u = torch.rand([len(hub), neighbor_num], generator=generator, device=self.device, dtype=torch.float64)
+            if weighted:
+                cum_weight = self.get_cum_weight()
+                end = start[hub] + degree[hub]
+                low = torch.where(start[hub] > 0, cum_weight[(start[hub]-1).clamp(min=0)], torch.zeros_like(u[:, 0]))
+                high = cum_weight[end-1]
+                edge = torch.searchsorted(cum_weight, low[:, None] + u * (high - low)[:, None], right=True)
+                offset[hub] = torch.minimum(edge, end[:, None]-1) - start[hub, None]
+            else:
+                offset[hub] = torch.minimum((u * degree[hub, None]).long(), degree[hub, None]-1)
+        return offset
+
+    def fixed_offsets(self, start, degree, neighbor_num, weighted):
+        """Systematic sample of the edges of entities with more than neighbor_num edges: neighbor j is at the
+        quantile (j + phase) / neighbor_num of the (weighted) edges, with a phase hashed from the entity,
+        so the sample is spread over all the edges and does not depend on a random state."""
+        phase = ((start * 2654435761) % 2**32).to(torch.float64) / 2**32#multiplicative hash of the first edge position of the entity
+        quantile = (phase[:, None] + torch.arange(neighbor_num, device=self.device)) / neighbor_num
+        if weighted:
+            cum_weight = self.get_cum_weight()
+            end = start + degree
+            low = torch.where(start > 0, cum_weight[(start-1).clamp(min=0)], torch.zeros_like(phase))
+            high = cum_weight[end-1]
+            edge = torch.searchsorted(cum_weight, low[:, None] + quantile * (high - low)[:, None], right=True)
+            return torch.minimum(edge, end[:, None]-1) - start[:, None]
+        return torch.minimum((quantile * degree[:, None]).long(), degree[:, None]-1)#distinct edges, degree > neighbor_num
+
+    def neighbor_weight(self, tails):
+        return (self.indptr_tensor[tails+1] - self.indptr_tensor[tails]).to(torch.float32) + 1
+
+    def get_cum_weight(self):
+        if self.cum_weight is None:
+            self.cum_weight = torch.cumsum(self.neighbor_weight(self.indices_tensor.long()).double(), dim=0)
+        return self.cum_weight
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+
+def vec_sidecar(filename):
+    return filename + '.npy'
+
+def parse_vec(filename, chunk_bytes=256*1024*1024):
+    """Parse a tab separated TransE .vec file into float32, one row per line.
+
+    The file is read in chunks of lines and each chunk is parsed by numpy in one call,
+    no float64 copy of the table is made.
+
+    Returns:
+        np.ndarray: float32 vectors, (line_num, embedding_size).
+    """
+    chunks = []
+    embedding_size = None
+    with open(filename, 'r', encoding='utf-8') as fp:
+        while True:
+            lines = fp.readlines(chunk_bytes)
+            if not lines:
+                break
+            if embedding_size is None:
+                embedding_size = len(lines[0].split())
+            values = np.fromstring(''.join(lines), dtype=np.float32, sep=' ')#any whitespace separates values
+            if len(values) != len(lines) * embedding_size:
+                raise ValueError("{}: expected {} values per line".format(filename, embedding_size))
+            chunks.append(values.reshape(len(lines), embedding_size))
+    if not chunks:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.concatenate(chunks)
+
+def load_vec(filename, mmap=True):
+    """Vectors of a .vec file with a zero padding row 0, the row of id i is i+1 as in read_id_file.
+
+    The padded table is saved as a `<filename>.npy` sidecar on the first call, later calls memory-map
+    the sidecar instead of parsing the text file again. The sidecar is rebuilt when it is older than the .vec file.
+
+    Args:
+        filename (str): .vec file.
+        mmap (bool): memory-map the sidecar (copy on write), otherwise read it in memory.
+
+    Returns:
+        np.ndarray: float32 vectors, (line_num+1, embedding_size).
+    """
+    sidecar = vec_sidecar(filename)
+    if not os.path.exists(sidecar) or os.path.getmtime(sidecar) < os.path.getmtime(filename):
+        vectors = parse_vec(filename)
+        padded = np.zeros((len(vectors)+1, vectors.shape[1]), dtype=np.float32)
+        padded[1:] = vectors
+        del vectors
+        with open(sidecar + '.tmp', 'wb') as fp:#write then rename, an interrupted run leaves no partial sidecar
+            np.save(fp, padded)
+        os.replace(sidecar + '.tmp', sidecar)
+        if not mmap:
+            return padded
+    return np.load(sidecar, mmap_mode='c' if mmap else None)
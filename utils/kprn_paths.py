@@ -0,0 +1,175 @@
+import json
+from multiprocessing import Pool
+import numpy as np
+import torch
+from utils.kg_graph import KnowledgeGraph
+from utils.news_columns import NewsVocab, CSRMap, HitGraph
+
+NEWS_CHUNK_SIZE = 64#news per task, the output only depends on the seed and this size
+NEG_KEEP_RATE = 0.001#negative (news1, news2) pairs are subsampled
+MAX_PAIR_PATHS = 20#(news1, news2) pair can not have more than 20 paths
+DEV_RATE = 0.2
+
+def expand_paths(news_entities, kg_graph, neighbor_num, weighted, generator):
+    """0, 1 and 2-hop entity paths starting from the entities of a batch of news.
+
+    Paths of a news are listed in the order of a depth first walk: all news entities, then for each news entity
+    its 1-hop paths followed by the 2-hop paths through each of them. Ring paths, which visit an
+    entity twice, and paths through padding entities are masked.
+
+    Args:
+        news_entities (torch.Tensor): (news_num, news_entity_num) entities of each news, 0 for padding.
+        kg_graph (KnowledgeGraph): graph the neighbors are sampled from.
+        neighbor_num (int): neighbors sampled per entity.
+        weighted (bool): degree weighted neighbor sampling.
+        generator (torch.Generator): random generator of the sampling.
+
+    Returns:
+        torch.Tensor: (news_num, path_num, 3) entities and relations of the paths, padded with 0.
+        torch.Tensor: (news_num, path_num) path lengths.
+        torch.Tensor: (news_num, path_num) bool, valid paths.
+    """
+    news_num, entity_num = news_entities.shape
+    hop1_entities, hop1_relations = kg_graph.sample_neighbors(news_entities, neighbor_num, weighted, generator)#(news_num, entity_num, k)
+    hop2_entities, hop2_relations = kg_graph.sample_neighbors(hop1_entities, neighbor_num, weighted, generator)#(news_num, entity_num, k, k)
+    zeros1 = torch.zeros_like(hop1_entities)
+    zeros2 = torch.zeros_like(hop2_entities)
+    hop0 = torch.stack([news_entities, torch.zeros_like(news_entities), torch.zeros_like(news_entities)], dim=-1)
+    hop0_edges = torch.zeros_like(hop0)
+    hop1 = torch.stack([news_entities[:, :, None].expand_as(hop1_entities), hop1_entities, zeros1], dim=-1)
+    hop1_edges = torch.stack([zeros1, hop1_relations, zeros1], dim=-1)
+    hop2 = torch.stack([news_entities[:, :, None, None].expand_as(hop2_entities), hop1_entities[:, :, :, None].expand_as(hop2_entities), hop2_entities], dim=-1)
+    hop2_edges = torch.stack([zeros2, hop1_relations[:, :, :, None].expand_as(hop2_entities), hop2_relations], dim=-1)
+
+    paths = torch.cat([hop0, torch.cat([hop1, hop2.flatten(2, 3)], dim=2).flatten(1, 2)], dim=1)#(news_num, path_num, 3)
+    edges = torch.cat([hop0_edges, torch.cat([hop1_edges, hop2_edges.flatten(2, 3)], dim=2).flatten(1, 2)], dim=1)
+    hop_length = torch.tensor([2]*neighbor_num + [3]*neighbor_num*neighbor_num)
+    lengths = torch.cat([torch.ones(news_num, entity_num, dtype=torch.long), hop_length.repeat(news_num, entity_num)], dim=1)
+    end = paths.gather(2, (lengths-1)[:, :, None]).squeeze(2)
+    ring = ((lengths >= 2) & (paths[:, :, 1] == paths[:, :, 0])) | ((lengths == 3) & ((paths[:, :, 2] == paths[:, :, 0]) | (paths[:, :, 2] == paths[:, :, 1])))
+    return torch.cat([paths, edges], dim=-1), lengths, (end != 0) & ~ring
+
+def news_path_lines(news_row, paths, lengths, valid, news_ids, entity_news, hit_graph, rng):
+    """KPRN samples of one news as JSON lines: the news reached by its paths, with their label and paths.
+
+    Returns:
+        list: train lines.
+        list: valid lines.
+        int: number of positive samples.
+        int: number of negative samples.
+    """
+    path_index = torch.nonzero(valid).squeeze(1).numpy()
+    lengths = lengths.numpy()
+    end = paths[torch.from_numpy(path_index), torch.from_numpy(lengths[path_index]-1)].numpy()
+    pair_path, other = entity_news.gather(end)
+    pair_path = path_index[pair_path]
+    keep = other != news_row
+    pair_path, other = pair_path[keep], other[keep]
+    if len(other) == 0:
+        return [], [], 0, 0
+
+    others, first, inverse = np.unique(other, return_index=True, return_inverse=True)
+    item_order = np.argsort(first, kind='stable')#news in the order they are first reached
+    item_rank = np.empty(len(others), dtype=np.int64)
+    item_rank[item_order] = np.arange(len(others))
+    pair_item = item_rank[inverse.reshape(-1)]
+    pair_order = np.argsort(pair_item, kind='stable')
+    pair_path = pair_path[pair_order]
+    items = others[item_order]
+    item_start = np.searchsorted(pair_item[pair_order], np.arange(len(items)))
+    item_count = np.bincount(pair_item, minlength=len(items))
+
+    labels = hit_graph.contains(torch.full([len(items)], news_row, dtype=torch.long), torch.from_numpy(items)).numpy()
+    keep = labels | (rng.random(len(items)) < NEG_KEEP_RATE)#filter negative samples
+    dev = rng.random(len(items)) < DEV_RATE
+    train_lines = []
+    dev_lines = []
+    for item in np.flatnonzero(keep).tolist():
+        item_paths = pair_path[item_start[item]:item_start[item]+item_count[item]]
+        if len(item_paths) > MAX_PAIR_PATHS:
+            item_paths = item_paths[rng.choice(len(item_paths), MAX_PAIR_PATHS, replace=False)]
+        item_lengths = lengths[item_paths].tolist()
+        item_paths = paths[torch.from_numpy(item_paths)].tolist()
+        sample = {"label": int(labels[item]), "item1": news_ids[news_row], "item2": news_ids[items[item]],
+                  "paths": [path[:length] for path, length in zip(item_paths, item_lengths)],
+                  "edges": [path[3:3+length] for path, length in zip(item_paths, item_lengths)]}
+        (dev_lines if dev[item] else train_lines).append(json.dumps(sample)+"\n")
+    return train_lines, dev_lines, int(labels[keep].sum()), int((~labels[keep]).sum())
+
+worker_state = {}#mining state of a pool worker, see init_worker
+
+def load_state(cache_path, doc_feature_embedding_file, neighbor_num, weighted):
+    return dict(
+        news_ids=NewsVocab.load(doc_feature_embedding_file).ids,
+        kg_graph=KnowledgeGraph.load(cache_path+"/kg_graph"),
+        doc_entity=np.load(cache_path+"/doc_entity.npy", mmap_mode='r'),
+        entity_news=CSRMap.load(cache_path+"/entity_news"),
+        hit_graph=HitGraph.load(cache_path+"/hit_graph").view('train'),
+        neighbor_num=neighbor_num, weighted=weighted)
+
+def init_worker(*args):#Pool initializer
+    torch.set_num_threads(1)#one process per core
+    worker_state.update(load_state(*args))
+
+def mine_chunk(task, state=None):
+    """KPRN samples of a chunk of news, see mine_kprn_paths. The state is the pool worker one if None."""
+    seed, news_rows = task
+    state = worker_state if state is None else state
+    rng = np.random.default_rng(seed)
+    generator = torch.Generator().manual_seed(int(rng.integers(2**63)))
+    news_entities = torch.from_numpy(np.asarray(state['doc_entity'][news_rows], dtype=np.int64))
+    paths, lengths, valid = expand_paths(news_entities, state['kg_graph'], state['neighbor_num'], state['weighted'], generator)
+    result = [[], [], 0, 0]
+    for i, news_row in enumerate(news_rows.tolist()):#joined news by news to bound the memory
+        train_lines, dev_lines, count_1, count_0 = news_path_lines(news_row, paths[i], lengths[i], valid[i], state['news_ids'], state['entity_news'], state['hit_graph'], rng)
+        result[0].extend(train_lines)
+        result[1].extend(dev_lines)
+        result[2] += count_1
+        result[3] += count_0
+    return result
+
+def mine_kprn_paths(train_file, dev_file, news_rows, seed, cache_path, doc_feature_embedding_ids_file, neighbor_num, weighted=False, num_workers=1):
+    """Write the KPRN train and valid JSON lines of the paths between news.
+
+    For every news, the paths from its entities to the news mentioning their 0, 1 and 2-hop neighbors are
+    joined through the entity -> news index. A reached news is a positive sample if it is a train hit.
+    Negative samples are kept with probability NEG_KEEP_RATE, and a sample keeps at most MAX_PAIR_PATHS paths.
+    News are processed in chunks of NEWS_CHUNK_SIZE, each chunk with its own random generator seeded by
+    seed + [chunk index], so the files only depend on the seed, not on `num_workers`.
+
+    Args:
+        train_file, dev_file (str): output JSON lines files.
+        news_rows (np.ndarray): news rows in output order.
+        seed (list): random seed.
+        cache_path (str): cache directory with kg_graph, doc_entity, entity_news and hit_graph.
+        doc_feature_embedding_ids_file (str): news vocabulary.
+        neighbor_num (int): neighbors sampled per entity.
+        weighted (bool): degree weighted neighbor sampling.
+        num_workers (int): number of mining processes, mine in the current process if <= 1.
+
+    Returns:
+        int: number of positive samples.
+        int: number of negative samples.
+    """
+    tasks = [(np.random.SeedSequence(list(seed) + [index]), news_rows[start:start+NEWS_CHUNK_SIZE]) for index, start in enumerate(range(0, len(news_rows), NEWS_CHUNK_SIZE))]
+    state = (cache_path, doc_feature_embedding_ids_file, neighbor_num, weighted)
+    count_1 = 0
+    count_0 = 0
+    with open(train_file, 'w', encoding='utf-8') as f_train, open(dev_file, 'w', encoding='utf-8') as f_dev:
+        def write(result):
+            f_train.write(''.join(result[0]))
+            f_dev.write(''.join(result[1]))
+            return result[2], result[3]
+        if num_workers <= 1:
+            local_state = load_state(*state)
+            for task in tasks:
+                positive, negative = write(mine_chunk(task, local_state))
+                count_1 += positive
+                count_0 += negative
+        else:
+            with Pool(num_workers, initializer=init_worker, initargs=state) as pool:
+                for result in pool.imap(mine_chunk, tasks):
+                    positive, negative = write(result)
+                    count_1 += positive
+                    count_0 += negative
+    return count_1, count_0
@@ -0,0 +1,132 @@
+from multiprocessing import Pool
+import numpy as np
+import torch
+from utils.news_columns import CSRMap
+
+NEG_CHUNK_SIZE = 65536#positive pairs per task, the samples only depend on the seed and this size
+MAX_ROUNDS = 100#rejection rounds before drawing the remaining rows from their explicit candidate list
+
+def has_duplicates(candidates):#(n, k) -> (n,), True if a row draws the same news twice
+    ordered = np.sort(candidates, axis=1)
+    return (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+
+def draw_negatives(rng, item1, pool_start, pool_size, pool_values, neg_num, hit_graph, chosen=None, exclude=None):
+    """Draw `neg_num` distinct negatives for every item1 from its candidate pool.
+
+    A row is drawn uniformly with replacement from pool_values[pool_start:pool_start+pool_size] and redrawn
+    as a whole when it repeats a news (also a news of `chosen`), contains a hit of item1 or a news of `exclude`.
+    This gives uniform samples without replacement among the valid negatives, as random.sample with retries.
+
+    Args:
+        rng (np.random.Generator): random generator.
+        item1 (np.ndarray): news rows, (n,).
+        pool_start, pool_size (np.ndarray): candidate pool of each row in pool_values, (n,).
+        pool_values (np.ndarray): candidate news rows.
+        neg_num (int): number of negatives per row.
+        hit_graph (HitGraph): positive pairs, a candidate (item1, news) in it is rejected.
+        chosen (np.ndarray): (n, c) negatives already drawn for each row, or None.
+        exclude (np.ndarray): (n, e) news that can not be negatives of each row, or None.
+
+    Returns:
+        np.ndarray: int64 (n, neg_num) negatives, -1 for rows without enough valid candidates.
+    """
+    negatives = np.full([len(item1), neg_num], -1, dtype=np.int64)
+    if neg_num == 0:
+        return negatives
+    pending = np.flatnonzero(pool_size > 0)
+    for _ in range(MAX_ROUNDS):
+        if len(pending) == 0:
+            return negatives
+        candidates = pool_values[pool_start[pending, None] + (rng.random([len(pending), neg_num]) * pool_size[pending, None]).astype(np.int64)]
+        row_news = candidates if chosen is None else np.concatenate([chosen[pending], candidates], axis=1)
+        rejected = has_duplicates(row_news)
+        rejected |= hit_graph.contains(torch.from_numpy(np.repeat(item1[pending, None], neg_num, axis=1)), torch.from_numpy(candidates)).numpy().any(axis=1)
+        if exclude is not None:
+            rejected |= (candidates[:, :, None] == exclude[pending, None, :]).any(axis=(1, 2))
+        negatives[pending[~rejected]] = candidates[~rejected]
+        pending = pending[rejected]
+    for row in pending.tolist():#items with few valid negatives
+        pool = pool_values[pool_start[row]:pool_start[row]+pool_size[row]]
+        invalid = hit_graph.contains(torch.full([len(pool)], item1[row], dtype=torch.long), torch.from_numpy(pool)).numpy()
+        invalid |= np.isin(pool, chosen[row] if chosen is not None else [])
+        invalid |= np.isin(pool, exclude[row] if exclude is not None else [])
+        valid = np.unique(pool[~invalid])
+        if len(valid) >= neg_num:
+            negatives[row] = rng.choice(valid, neg_num, replace=False)
+    return negatives
+
+def knowledge_pools(item1, doc_entity, entity_news):
+    """Candidate pools of knowledge-aware negatives: the news sharing an entity with item1, item1 excluded.
+
+    Returns:
+        np.ndarray: pool_start, pool_size and pool_values as taken by draw_negatives.
+    """
+    entities = np.asarray(doc_entity[item1], dtype=np.int64)#(n, news_entity_num), 0 for padding
+    segment, news = entity_news.gather(entities.reshape(-1))
+    segment = segment // entities.shape[1]
+    keep = news != item1[segment]
+    pools = CSRMap.from_pairs(segment[keep], news[keep], len(item1))#the union of the entity news of each row
+    return pools.indptr[:-1], pools.degree(), pools.indices.astype(np.int64)
+
+worker_state = {}
+
+def init_worker(news_ids, all_news, doc_entity, entity_news, hit_graph, neg_num, knowledge_neg_num):
+    worker_state.update(news_ids=news_ids, all_news=all_news, doc_entity=doc_entity, entity_news=entity_news, hit_graph=hit_graph, neg_num=neg_num, knowledge_neg_num=knowledge_neg_num)
+
+def sample_chunk(task):
+    """Negatives of a chunk of positive pairs, as the lines of a random_neg_sample_*.tsv file."""
+    seed, item1, item2 = task
+    state = worker_state
+    rng = np.random.default_rng(seed)
+    hit_graph = state['hit_graph']
+    knowledge_neg_num = state['knowledge_neg_num']
+    all_news = state['all_news']
+    negatives = np.full([len(item1), state['neg_num']], -1, dtype=np.int64)
+    hard = np.zeros(len(item1), dtype=bool)
+    if knowledge_neg_num > 0:#hard negatives: news sharing an entity with item1, item2 excluded
+        pool_start, pool_size, pool_values = knowledge_pools(item1, state['doc_entity'], state['entity_news'])
+        negatives[:, :knowledge_neg_num] = draw_negatives(rng, item1, pool_start, pool_size, pool_values, knowledge_neg_num, hit_graph, exclude=item2[:, None])
+        hard = negatives[:, 0] >= 0
+    for rows, start in [(np.flatnonzero(hard), knowledge_neg_num), (np.flatnonzero(~hard), 0)]:#random negatives for the other slots
+        negatives[rows, start:] = draw_negatives(rng, item1[rows], np.zeros(len(rows), dtype=np.int64), np.full(len(rows), len(all_news)), all_news,
+                                                 state['neg_num'] - start, hit_graph, chosen=negatives[rows, :start] if start > 0 else None)
+    news_ids = state['news_ids']
+    lines = []
+    for a, b, negative_row in zip(item1.tolist(), item2.tolist(), negatives.tolist()):
+        lines.append('1\t'+news_ids[a]+'\t'+news_ids[b]+'\n')
+        for item in negative_row:
+            if item >= 0:
+                lines.append('0\t'+news_ids[a]+'\t'+news_ids[item]+'\n')
+    return ''.join(lines)
+
+def sample_negatives(filename, item1, item2, seed, news_ids, all_news, doc_entity, entity_news, hit_graph, neg_num, knowledge_neg_num=0, num_workers=1):
+    """Write every positive pair followed by its negatives to `filename`, in the order of the pairs.
+
+    Pairs are split in chunks of NEG_CHUNK_SIZE, each with its own random generator seeded by
+    seed + [chunk index], so the file does not depend on `num_workers`.
+
+    Args:
+        filename (str): output random_neg_sample_*.tsv file.
+        item1, item2 (np.ndarray): news rows of the positive pairs.
+        seed (list): random seed, e.g. [config seed, split index].
+        news_ids (list): news id of each row.
+        all_news (np.ndarray): rows of the news random negatives are drawn from.
+        doc_entity (np.ndarray): entities of each news row.
+        entity_news (CSRMap): entity -> news rows.
+        hit_graph (HitGraph): positive pairs that can not be negatives.
+        neg_num (int): negatives per positive pair.
+        knowledge_neg_num (int): how many of them share an entity with item1.
+        num_workers (int): number of sampling processes, sample in the current process if <= 1.
+    """
+    tasks = [(np.random.SeedSequence(list(seed) + [index]), item1[start:start+NEG_CHUNK_SIZE], item2[start:start+NEG_CHUNK_SIZE])
+             for index, start in enumerate(range(0, len(item1), NEG_CHUNK_SIZE))]
+    state = (news_ids, all_news, doc_entity, entity_news, hit_graph, neg_num, min(knowledge_neg_num, neg_num))
+    with open(filename, 'w', encoding='utf-8') as fp:
+        if num_workers <= 1:
+            init_worker(*state)
+            for task in tasks:
+                fp.write(sample_chunk(task))
+        else:
+            with Pool(num_workers, initializer=init_worker, initargs=state) as pool:
+                for lines in pool.imap(sample_chunk, tasks):
+                    fp.write(lines)
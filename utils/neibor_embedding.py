@@ -0,0 +1,27 @@
+import numpy as np
+import torch
+
+def neibor_num_from_degree(degree):
+    """Number of other news of an entity, 1 for entities mentioned by less than 2 news (avoids a division by 0)."""
+    degree = torch.as_tensor(degree, dtype=torch.long)
+    return torch.where(degree >= 2, degree - 1, torch.ones_like(degree))
+
+def scatter_doc_embedding(neibor_embedding, entities, rows, doc_matrix, chunk_size=65536):
+    """neibor_embedding[entities[i]] += doc_matrix[rows[i]] for all pairs, in place.
+
+    Pairs are processed in document row order, so a memory-mapped `doc_matrix` is read sequentially,
+    `chunk_size` pairs at a time to bound the size of the gathered embeddings.
+
+    Args:
+        neibor_embedding (torch.Tensor): float32 (entity_num+1, doc_embedding_size) table.
+        entities (np.ndarray): entity id of each pair.
+        rows (np.ndarray): document row of each pair.
+        doc_matrix (np.ndarray): (num_news, doc_embedding_size) document embeddings, float32 or float16.
+        chunk_size (int): number of pairs added at a time.
+    """
+    order = np.argsort(rows, kind='stable')
+    entities = np.asarray(entities, dtype=np.int64)[order]
+    rows = np.asarray(rows, dtype=np.int64)[order]
+    for start in range(0, len(rows), chunk_size):
+        doc_embedding = torch.from_numpy(np.array(doc_matrix[rows[start:start+chunk_size]], dtype=np.float32))
+        neibor_embedding.index_add_(0, torch.from_numpy(entities[start:start+chunk_size]), doc_embedding)
@@ -0,0 +1,215 @@
+import os
+import numpy as np
+import torch
+
+class NewsVocab:
+    """
+    News id <-> row index, shared by the doc embedding matrix and all news keyed arrays of the cache.
+
+    Saved as a text file with one news id per line in row order.
+    """
+    def __init__(self, ids):
+        self.ids = ids
+        self.index = {newsid: i for i, newsid in enumerate(ids)}
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8') as fp:
+            return cls(fp.read().split('\n')[:-1])
+
+    def save(self, filename):
+        with open(filename, 'w', encoding='utf-8') as fp:
+            for newsid in self.ids:
+                fp.write(newsid + '\n')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, newsid):
+        return newsid in self.index
+
+    def row(self, newsid):
+        return self.index[newsid]
+
+    def rows(self, newsids):#int64 rows of a list of news ids
+        return np.fromiter((self.index[newsid] for newsid in newsids), dtype=np.int64, count=len(newsids))
+
+class CSRMap:
+    """
+    Integer one-to-many map in CSR form: the values of row r are indices[indptr[r]:indptr[r+1]], sorted and unique.
+
+    Used for entity -> news rows and news row -> hit news rows, saved as two .npy files and memory-mapped on load.
+    """
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.device = torch.device('cpu')
+        self.keys = None#sorted row*num_cols+col int64 tensor on the device, built on the first contains()
+        self.num_cols = None
+
+    @classmethod
+    def from_pairs(cls, rows, cols, num_rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        order = np.lexsort((cols, rows))#sorted by row then col
+        rows, cols = rows[order], cols[order]
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])#remove duplicates
+        indptr = np.zeros(num_rows+1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[keep], minlength=num_rows), out=indptr[1:])
+        return cls(indptr, cols[keep].astype(np.int32))
+
+    def save(self, dirname):
+        os.makedirs(dirname, exist_ok=True)
+        np.save(os.path.join(dirname, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(dirname, 'indices.npy'), self.indices)
+
+    @classmethod
+    def load(cls, dirname):
+        return cls(*[np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r') for name in ['indptr', 'indices']])
+
+    @property
+    def num_rows(self):
+        return len(self.indptr) - 1
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def __getitem__(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row+1]]
+
+    def gather(self, rows):
+        """Values of a batch of rows, flattened.
+
+        Returns:
+            np.ndarray: int64 position in `rows` of each value.
+            np.ndarray: int64 values.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        start = self.indptr[rows]
+        degree = self.indptr[rows+1] - start
+        segment = np.repeat(np.arange(len(rows)), degree)
+        offset = np.arange(len(segment)) - np.repeat(np.cumsum(degree) - degree, degree)
+        return segment, self.indices[start[segment] + offset].astype(np.int64)
+
+    def to(self, device):
+        self.device = torch.device(device)
+        if self.keys is not None:
+            self.keys = self.keys.to(device)
+        return self
+
+    def get_keys(self):
+        if self.keys is None:
+            indices = torch.from_numpy(np.array(self.indices, dtype=np.int64))
+            self.num_cols = int(indices.max()) + 1 if len(indices) else 1
+            keys = torch.repeat_interleave(torch.arange(self.num_rows), torch.from_numpy(self.degree().astype(np.int64))) * self.num_cols + indices
+            self.keys = keys.to(self.device)
+        return self.keys
+
+    def contains(self, rows, cols):
+        """Whether cols[i] is a value of row rows[i], for tensors of the same shape, computed on the map device."""
+        keys = self.get_keys()
+        rows = torch.as_tensor(rows, device=self.device).long()
+        cols = torch.as_tensor(cols, device=self.device).long()
+        query = rows * self.num_cols + cols
+        if len(keys) == 0:
+            return torch.zeros(query.shape, dtype=torch.bool, device=self.device)
+        position = torch.searchsorted(keys, query.reshape(-1)).clamp(max=len(keys)-1).reshape(query.shape)
+        return (keys[position] == query) & (cols < self.num_cols)
+
+class HitGraph:
+    """
+    Symmetric graph of hit (positive pair) news rows, in layers: the train pairs, then the valid pairs
+    missing in the train pairs. The "train" view reads the first layer and the "train_val" view both,
+    so the train edges are stored once.
+
+    Queries take and return int64 tensors on the graph device.
+    """
+    VIEWS = {'train': 1, 'train_val': 2}
+
+    def __init__(self, layers):
+        self.layers = layers#CSRMap of each layer
+        self.device = torch.device('cpu')
+        self.tensors = None#(indptr, indices, sorted row*num_rows+col keys) of each layer, built on first query
+
+    @classmethod
+    def from_pairs(cls, train_pairs, val_pairs, num_news):
+        """Build the layers from (item1 rows, item2 rows) of the train and valid positive pairs."""
+        train = CSRMap.from_pairs(np.concatenate(train_pairs), np.concatenate(train_pairs[::-1]), num_news)
+        val = CSRMap.from_pairs(np.concatenate(val_pairs), np.concatenate(val_pairs[::-1]), num_news)
+        val_rows = np.repeat(np.arange(num_news), val.degree())
+        train_graph = cls([train])
+        new = ~train_graph.contains(torch.from_numpy(val_rows), torch.from_numpy(val.indices.astype(np.int64))).numpy()
+        return cls([train, CSRMap.from_pairs(val_rows[new], val.indices[new], num_news)])
+
+    def save(self, dirname):
+        for layer, name in zip(self.layers, ['train', 'val']):
+            layer.save(os.path.join(dirname, name))
+
+    @classmethod
+    def load(cls, dirname):
+        return cls([CSRMap.load(os.path.join(dirname, name)) for name in ['train', 'val']])
+
+    def view(self, name):#shares the layers and their tensors
+        num_layers = self.VIEWS[name]
+        if num_layers > len(self.layers):
+            raise ValueError("view {} reads {} layers, the graph has {}".format(name, num_layers, len(self.layers)))
+        graph = HitGraph(self.layers[:num_layers])
+        graph.device = self.device
+        graph.tensors = self.get_tensors()[:num_layers]
+        return graph
+
+    def to(self, device):
+        self.device = torch.device(device)
+        if self.tensors is not None:
+            self.tensors = [tuple(tensor.to(device) for tensor in layer) for layer in self.tensors]
+        return self
+
+    @property
+    def num_rows(self):
+        return self.layers[0].num_rows
+
+    def get_tensors(self):
+        if self.tensors is None:
+            self.tensors = []
+            for layer in self.layers:
+                indptr = torch.from_numpy(np.array(layer.indptr, dtype=np.int64))
+                indices = torch.from_numpy(np.array(layer.indices, dtype=np.int64))
+                keys = torch.repeat_interleave(torch.arange(layer.num_rows), indptr[1:] - indptr[:-1]) * layer.num_rows + indices#sorted, rows then sorted cols
+                self.tensors.append((indptr.to(self.device), indices.to(self.device), keys.to(self.device)))
+        return self.tensors
+
+    def degree(self, rows):
+        rows = torch.as_tensor(rows, device=self.device).long()
+        return sum(indptr[rows+1] - indptr[rows] for indptr, _, _ in self.get_tensors())
+
+    def contains(self, rows, cols):
+        """Whether (rows[i], cols[i]) is a hit pair, for tensors of the same shape."""
+        rows = torch.as_tensor(rows, device=self.device).long()
+        query = rows * self.num_rows + torch.as_tensor(cols, device=self.device).long()
+        found = torch.zeros(query.shape, dtype=torch.bool, device=self.device)
+        for _, _, keys in self.get_tensors():
+            if len(keys) == 0:
+                continue
+            position = torch.searchsorted(keys, query.reshape(-1)).clamp(max=len(keys)-1).reshape(query.shape)
+            found |= keys[position] == query
+        return found
+
+    def neighbors(self, rows):
+        """Hit news of a batch of rows, flattened.
+
+        Returns:
+            torch.Tensor: int64 position in `rows` of each hit news.
+            torch.Tensor: int64 hit news rows.
+        """
+        rows = torch.as_tensor(rows, device=self.device).long().reshape(-1)
+        segments = []
+        cols = []
+        for indptr, indices, _ in self.get_tensors():
+            start = indptr[rows]
+            degree = indptr[rows+1] - start
+            segment = torch.repeat_interleave(torch.arange(len(rows), device=self.device), degree)
+            offset = torch.arange(len(segment), device=self.device) - torch.repeat_interleave(torch.cumsum(degree, 0) - degree, degree)
+            segments.append(segment)
+            cols.append(indices[start[segment] + offset])
+        return torch.cat(segments), torch.cat(cols)
@@ -0,0 +1,171 @@
+import os
+import json
+import shutil
+import numpy as np
+import torch
+from utils.news_columns import NewsVocab
+
+PATH_WIDTH = 3#paths have at most 3 entities (2 hops)
+SHARD_SIZE = 65536#samples per shard
+META_FILE = 'meta.json'
+COLUMNS = ['offsets', 'paths', 'edges', 'lengths', 'label', 'item1', 'item2']
+
+def shards_sidecar(filename):
+    return filename + '.shards'
+
+class PathShardWriter:
+    """
+    Writes KPRN path samples ({"label", "item1", "item2", "paths", "edges"}) in packed shards.
+
+    A shard is a directory of .npy columns:
+        - `paths`, `edges`: int32 (path_num, PATH_WIDTH) entity and relation ids, padded with 0
+        - `lengths`: int8 (path_num,) number of entities of each path
+        - `offsets`: int64 (sample_num+1,) the paths of sample i are paths[offsets[i]:offsets[i+1]]
+        - `label`: float32 (sample_num,)
+        - `item1`, `item2`: int32 (sample_num,) rows in the `news_ids.txt` vocabulary of the directory
+    Samples of the warm up files have a single path, a flat list of entities; they are stored with one path
+    and `single_path` is set in `meta.json`. The directory is written next to it and renamed on close.
+    """
+    def __init__(self, dirname, shard_size=SHARD_SIZE):
+        self.dirname = dirname
+        self.tmp_dirname = dirname + '.tmp'
+        self.shard_size = shard_size
+        shutil.rmtree(self.tmp_dirname, ignore_errors=True)
+        os.makedirs(self.tmp_dirname)
+        self.news_index = {}
+        self.news_ids = []
+        self.shard_sizes = []
+        self.single_path = None
+        self.reset()
+
+    def reset(self):
+        self.columns = {name: [] for name in COLUMNS}
+        self.columns['offsets'].append(0)
+
+    def news_row(self, newsid):
+        if newsid not in self.news_index:
+            self.news_index[newsid] = len(self.news_ids)
+            self.news_ids.append(newsid)
+        return self.news_index[newsid]
+
+    def add(self, sample):
+        paths, edges = sample['paths'], sample['edges']
+        single_path = len(paths) == 0 or not isinstance(paths[0], list)
+        if self.single_path is None:
+            self.single_path = single_path
+        elif self.single_path != single_path:
+            raise ValueError("samples with one path and with a list of paths can not be mixed")
+        if single_path:
+            paths, edges = [paths], [edges]
+        columns = self.columns
+        for path, edge in zip(paths, edges):
+            if len(path) > PATH_WIDTH or len(edge) > PATH_WIDTH:
+                raise ValueError("paths can not have more than {} entities".format(PATH_WIDTH))
+            columns['paths'].append(path + [0]*(PATH_WIDTH-len(path)))
+            columns['edges'].append(edge + [0]*(PATH_WIDTH-len(edge)))
+            columns['lengths'].append(len(path))
+        columns['offsets'].append(columns['offsets'][-1] + len(paths))
+        columns['label'].append(sample['label'])
+        columns['item1'].append(self.news_row(sample['item1']))
+        columns['item2'].append(self.news_row(sample['item2']))
+        if len(columns['label']) == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        columns = self.columns
+        if not columns['label']:
+            return
+        arrays = {
+            'offsets': np.array(columns['offsets'], dtype=np.int64),
+            'paths': np.array(columns['paths'], dtype=np.int32).reshape(-1, PATH_WIDTH),
+            'edges': np.array(columns['edges'], dtype=np.int32).reshape(-1, PATH_WIDTH),
+            'lengths': np.array(columns['lengths'], dtype=np.int8),
+            'label': np.array(columns['label'], dtype=np.float32),
+            'item1': np.array(columns['item1'], dtype=np.int32),
+            'item2': np.array(columns['item2'], dtype=np.int32),
+        }
+        shard_dirname = os.path.join(self.tmp_dirname, 'shard_{:05d}'.format(len(self.shard_sizes)))
+        os.makedirs(shard_dirname)
+        for name, array in arrays.items():
+            np.save(os.path.join(shard_dirname, name + '.npy'), array)
+        self.shard_sizes.append(len(arrays['label']))
+        self.reset()
+
+    def close(self):
+        self.flush()
+        NewsVocab(self.news_ids).save(os.path.join(self.tmp_dirname, 'news_ids.txt'))
+        with open(os.path.join(self.tmp_dirname, META_FILE), 'w', encoding='utf-8') as fp:
+            json.dump({'path_width': PATH_WIDTH, 'single_path': bool(self.single_path), 'shard_sizes': self.shard_sizes}, fp, indent=4)
+        shutil.rmtree(self.dirname, ignore_errors=True)
+        os.replace(self.tmp_dirname, self.dirname)
+
+def convert_jsonl(filename, dirname, shard_size=SHARD_SIZE):
+    """Convert a KPRN JSON lines file (train_data.json, predict_train.json, ...) to packed shards, line by line.
+
+    Returns:
+        int: number of samples.
+    """
+    writer = PathShardWriter(dirname, shard_size)
+    with open(filename, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            if line.strip():
+                writer.add(json.loads(line))
+    writer.close()
+    return sum(writer.shard_sizes)
+
+class PathShards:
+    """
+    Memory-mapped packed shards, see PathShardWriter. sample(idx) returns ready-made tensors:
+    `paths`/`edges` int64 (path_num, PATH_WIDTH) and `lengths` (path_num,), or (PATH_WIDTH,) and a
+    scalar for single path samples.
+    """
+    def __init__(self, dirname):
+        with open(os.path.join(dirname, META_FILE), 'r', encoding='utf-8') as fp:
+            meta = json.load(fp)
+        self.single_path = meta['single_path']
+        self.news_ids = NewsVocab.load(os.path.join(dirname, 'news_ids.txt')).ids
+        self.news_rows = None#rows of news_ids in the doc embedding vocabulary, see set_vocab
+        self.shards = [{name: np.load(os.path.join(dirname, 'shard_{:05d}'.format(i), name + '.npy'), mmap_mode='r') for name in COLUMNS}
+                       for i in range(len(meta['shard_sizes']))]
+        for shard in self.shards:#per path columns stay memory-mapped, the small per sample columns are read in memory
+            shard['offsets'] = shard['offsets'].tolist()
+            shard['label'] = shard['label'].tolist()
+            shard['item1'] = shard['item1'].tolist()
+            shard['item2'] = shard['item2'].tolist()
+        self.shard_start = np.cumsum([0] + meta['shard_sizes'])
+
+    @classmethod
+    def load(cls, filename):
+        """Shards of a JSON lines file, converted on the first call and again when older than the file."""
+        dirname = shards_sidecar(filename)
+        meta_file = os.path.join(dirname, META_FILE)
+        if not os.path.exists(meta_file) or os.path.getmtime(meta_file) < os.path.getmtime(filename):
+            convert_jsonl(filename, dirname)
+        return cls(dirname)
+
+    def set_vocab(self, news_vocab):#samples also give the rows of their news in news_vocab, mapped once here
+        self.news_rows = news_vocab.rows(self.news_ids).tolist()
+
+    def __len__(self):
+        return int(self.shard_start[-1])
+
+    def sample(self, idx):
+        shard_index = int(np.searchsorted(self.shard_start, idx, side='right')) - 1
+        shard = self.shards[shard_index]
+        row = int(idx - self.shard_start[shard_index])
+        start, end = shard['offsets'][row], shard['offsets'][row+1]
+        sample = {
+            'label': shard['label'][row],
+            'item1': self.news_ids[shard['item1'][row]],
+            'item2': self.news_ids[shard['item2'][row]],
+            'paths': torch.from_numpy(shard['paths'][start:end].astype(np.int64)),
+            'edges': torch.from_numpy(shard['edges'][start:end].astype(np.int64)),
+            'lengths': torch.from_numpy(shard['lengths'][start:end].astype(np.int64)),
+        }
+        if self.news_rows is not None:
+            sample['item1_row'] = self.news_rows[shard['item1'][row]]
+            sample['item2_row'] = self.news_rows[shard['item2'][row]]
+        if self.single_path:
+            for name in ['paths', 'edges', 'lengths']:
+                sample[name] = sample[name][0]
+        return sample
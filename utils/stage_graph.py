@@ -0,0 +1,126 @@
+import time
+import resource
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+from utils.cache_manifest import CacheManifest
+
+STAGE_MANIFEST_FILE = 'stages.json'
+
+class Stage:
+    """
+    A step of a pipeline: `run(config)` reads the `inputs` files and writes the `outputs` files.
+
+    `run` must be a module level function. The stage is up to date, and skipped, when its outputs exist and
+    its version, the content of its inputs, the values of its `config_keys` and the keys of its `deps`
+    stages are unchanged since it last ran (see CacheManifest).
+    """
+    def __init__(self, name, run, inputs=(), outputs=(), config_keys=(), deps=(), version=1):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.config_keys = list(config_keys)
+        self.deps = list(deps)
+        self.version = version
+
+def reset_peak_rss():#a forked process starts with the peak of its parent, Linux can reset it
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+def peak_rss():#bytes, of the process (pages shared with the parent included) and of its largest finished child, e.g. workers of its own pools
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            peak = next(int(line.split()[1]) for line in fp if line.startswith('VmHWM:'))#kB, since the last reset
+    except (OSError, StopIteration):
+        pass
+    return max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+def run_stage(stage, config, conn):#in a process of its own, so peak_rss only measures this stage
+    reset_peak_rss()
+    start = time.time()
+    try:
+        stage.run(config)
+        error = None
+    except BaseException:
+        error = traceback.format_exc()
+    conn.send({'wall_time': time.time() - start, 'peak_rss': peak_rss(), 'error': error})
+    conn.close()
+
+def run_stages(stages, config, cache_path, num_workers=1):
+    """Run the stages of a graph that are not up to date, independent stages concurrently.
+
+    A stage starts as soon as all its deps are done, in a new process, with at most `num_workers` stages
+    running at the same time. Stages run in processes that are not daemonic, so they can use their own
+    process pools. The first failing stage stops the pipeline once the running stages are finished.
+
+    Args:
+        stages (list): Stage of each step, deps must be names of other stages.
+        config (dict): configuration passed to the stages.
+        cache_path (str): directory of the stages.json manifest.
+        num_workers (int): maximum number of stages running at the same time.
+
+    Returns:
+        dict: for each stage, {'status': 'ran' or 'skipped', 'wall_time': seconds, 'peak_rss': bytes}.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError("stage {} depends on unknown stage {}".format(stage.name, dep))
+    manifest = CacheManifest(cache_path, STAGE_MANIFEST_FILE)
+    pending = list(stages)
+    running = {}#connection -> (stage, process, key)
+    report = {}
+    error = None
+    while pending or running:
+        progress = True
+        while progress and error is None:#start the ready stages, skipping a stage can make others ready
+            progress = False
+            for stage in [stage for stage in pending if all(dep in report for dep in stage.deps)]:
+                if len(running) >= max(num_workers, 1):
+                    break
+                pending.remove(stage)
+                key = manifest.artifact_key(stage.name, stage.version, stage.inputs, {name: config[name] for name in stage.config_keys}, stage.deps)
+                if manifest.is_fresh(stage.name, key, stage.outputs):
+                    print("stage {} is up to date".format(stage.name))
+                    report[stage.name] = {'status': 'skipped', 'wall_time': 0.0, 'peak_rss': 0}
+                    progress = True
+                    continue
+                print("stage {} started".format(stage.name))
+                parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=run_stage, args=(stage, config, child_conn), name=stage.name)
+                process.start()
+                child_conn.close()
+                running[parent_conn] = (stage, process, key)
+        if not running:
+            if pending and error is None:
+                raise ValueError("stages {} have a dependency cycle".format([stage.name for stage in pending]))
+            break
+        for conn in wait(list(running)):
+            stage, process, key = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:#killed, e.g. out of memory
+                result = {'wall_time': 0.0, 'peak_rss': 0, 'error': "process exited with code {}".format(process.exitcode)}
+            process.join()
+            stage_error = result.pop('error')
+            report[stage.name] = dict(status='ran' if stage_error is None else 'failed', **result)
+            if stage_error is None:
+                manifest.record(stage.name, key, stage.outputs)
+            elif error is None:
+                error = "stage {} failed:\n{}".format(stage.name, stage_error)
+            print("stage {} {} in {:.1f}s, peak rss {:.0f}MB".format(stage.name, 'done' if stage_error is None else 'failed', result['wall_time'], result['peak_rss'] / 2**20))
+    if error is not None:
+        raise RuntimeError(error)
+    return report
+
+def format_report(report):
+    lines = ["{:<20}{:>10}{:>12}{:>14}".format('stage', 'status', 'wall time', 'peak rss')]
+    for name, result in report.items():
+        lines.append("{:<20}{:>10}{:>11.1f}s{:>12.0f}MB".format(name, result['status'], result['wall_time'], result['peak_rss'] / 2**20))
+    return '\n'.join(lines)
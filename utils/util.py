@@ -4,14 +4,23 @@ import numpy as np
 from pathlib import Path
 from itertools import repeat
 from collections import OrderedDict
-from sentence_transformers import SentenceTransformer
-import requests
-import math
 import random
-import zipfile
 import os
+import tempfile
 from tqdm import tqdm
-import copy
+from utils.coclick import coclick_positive_pairs, coclick_positive_pairs_external
+from utils.behaviors import parse_behaviors
+from utils.download import download_file, extract_zip
+from utils.doc_encoder import DocEncoder, encode_texts
+from utils.embedding_store import DocEmbeddingStore
+from utils.kg_graph import read_id_file, read_triples, KnowledgeGraph
+from utils.kg_vectors import load_vec
+from utils.news_columns import NewsVocab, CSRMap, HitGraph
+from utils.neibor_embedding import scatter_doc_embedding, neibor_num_from_degree
+from utils.negative_sampling import sample_negatives
+from utils.kprn_paths import mine_kprn_paths
+
+NEWS_LINE_BYTES = 4096#memory per news line read by build_doc_feature_external
 
 def ensure_dir(dirname):
     dirname = Path(dirname)
@@ -62,7 +71,7 @@ def prepare_device(n_gpu_use):
     list_ids = list(range(n_gpu_use))
     return device, list_ids
 
-def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
+def maybe_download(url, filename=None, work_directory=".", expected_bytes=None, checksum=None, mirror_dir=None, num_connections=4):
     """Download a file if it is not already downloaded.
 
     Args:
@@ -70,6 +79,9 @@ def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
         work_directory (str): Working directory.
         url (str): URL of the file to download.
         expected_bytes (int): Expected file size in bytes.
+        checksum (str): Expected "<algorithm>:<hex digest>" of the file.
+        mirror_dir (str): Local directory searched for the file before downloading it.
+        num_connections (int): Number of parallel range requests.
 
     Returns:
         str: File path of the file downloaded.
@@ -77,22 +89,7 @@ def maybe_download(url, filename=None, work_directory=".", expected_bytes=None):
     if filename is None:
         filename = url.split("/")[-1]
     os.makedirs(work_directory, exist_ok=True)
-    filepath = os.path.join(work_directory, filename)
-    if not os.path.exists(filepath):
-
-        r = requests.get(url, stream=True)
-        total_size = int(r.headers.get("content-length", 0))
-        block_size = 1024
-        num_iterables = math.ceil(total_size / block_size)
-
-        with open(filepath, "wb") as file:
-            for data in tqdm(
-                    r.iter_content(block_size),
-                    total=num_iterables,
-                    unit="KB",
-                    unit_scale=True,
-            ):
-                file.write(data)
+    filepath = download_file(url, os.path.join(work_directory, filename), checksum, mirror_dir, num_connections)
     if expected_bytes is not None:
         statinfo = os.stat(filepath)
         if statinfo.st_size != expected_bytes:
@@ -109,9 +106,7 @@ def unzip_file(zip_src, dst_dir, clean_zip_file=True):
         dst_dir (str): Destination folder.
         clean_zip_file (bool): Whether or not to clean the zip file.
     """
-    fz = zipfile.ZipFile(zip_src, "r")
-    for file in fz.namelist():
-        fz.extract(file, dst_dir)
+    extract_zip(zip_src, dst_dir)
     if clean_zip_file:
         os.remove(zip_src)
 
@@ -150,91 +145,45 @@ def get_mind_data_set(type):
             "MINDdemo_utils.zip",
         )
 
-def download_deeprec_resources(azure_container_url, data_path, remote_resource_name):
+def download_deeprec_resources(azure_container_url, data_path, remote_resource_name, checksum=None, mirror_dir=None, num_connections=4):
     """Download resources.
 
     Args:
         azure_container_url (str): URL of Azure container.
         data_path (str): Path to download the resources.
         remote_resource_name (str): Name of the resource.
+        checksum (str): Expected "<algorithm>:<hex digest>" of the resource.
+        mirror_dir (str): Local directory searched for the resource before downloading it, it is extracted from there.
+        num_connections (int): Number of parallel range requests.
     """
     os.makedirs(data_path, exist_ok=True)
     remote_path = azure_container_url + remote_resource_name
-    maybe_download(remote_path, remote_resource_name, data_path)
-    zip_ref = zipfile.ZipFile(os.path.join(data_path, remote_resource_name), "r")
-    zip_ref.extractall(data_path)
-    zip_ref.close()
-    os.remove(os.path.join(data_path, remote_resource_name))
+    zip_file = maybe_download(remote_path, remote_resource_name, data_path, checksum=checksum, mirror_dir=mirror_dir, num_connections=num_connections)
+    unzip_file(zip_file, data_path, clean_zip_file=zip_file == os.path.join(data_path, remote_resource_name))#keep the mirror
 
 def build_item2item_dataset(config):
     print("constructing item2item dataset ...")
-    fp_train = open(config['datapath']+config['train_behavior'], 'r', encoding='utf-8')
-    fp_valid = open(config['datapath']+config['valid_behavior'], 'r', encoding='utf-8')
-    lines = fp_train.readlines()
-    lines.extend(fp_valid.readlines())
-    fp_train.close()
-    fp_valid.close()
-    user_history_dict = {}#history clicked news id for each user, including history and behavior
-    news_click_dict = {}#The total number of clicks each news was clicked by all users
-    doc_doc_dict = {}#The number of co-clicks for a pair of documents, (doc1,doc2)和(doc2,doc1) are the same
-    for line in lines:
-        index, userid, imp_time, history, behavior = line.strip().split('\t')
-        behavior = behavior.split(' ')
-        if userid not in user_history_dict:
-            user_history_dict[userid] = set()
-        for news in behavior:
-            newsid, news_label = news.split('-')
-            if newsid=='':
-                continue
-            if news_label == "1":
-                user_history_dict[userid].add(newsid)
-                if newsid not in news_click_dict:
-                    news_click_dict[newsid] = 1
-                else:
-                    news_click_dict[newsid] = news_click_dict[newsid] + 1
-        news = history.split(' ')#history may be empty
-        for newsid in news:
-            if newsid=='':
-                continue
-            user_history_dict[userid].add(newsid)
-            if newsid not in news_click_dict:
-                news_click_dict[newsid] = 1
-            else:
-                news_click_dict[newsid] = news_click_dict[newsid] + 1
-    for user in user_history_dict:
-        list_user_his = list(user_history_dict[user])
-        for i in range(len(list_user_his) - 1):
-            for j in range(i + 1, len(list_user_his)):
-                doc1 = list_user_his[i]
-                doc2 = list_user_his[j]
-                if doc1 != doc2:
-                    if (doc1, doc2) not in doc_doc_dict and (doc2, doc1) not in doc_doc_dict:
-                        doc_doc_dict[(doc1, doc2)] = 1
-                    elif (doc1, doc2) in doc_doc_dict and (doc2, doc1) not in doc_doc_dict:
-                        doc_doc_dict[(doc1, doc2)] = doc_doc_dict[(doc1, doc2)] + 1
-                    elif (doc2, doc1) in doc_doc_dict and (doc1, doc2) not in doc_doc_dict:
-                        doc_doc_dict[(doc2, doc1)] = doc_doc_dict[(doc2, doc1)] + 1
-    weight_doc_doc_dict = {}#postive instance principle
-    for item in doc_doc_dict:
-        if item[0] in news_click_dict and item[1] in news_click_dict:
-            weight_doc_doc_dict[item] = doc_doc_dict[item] / math.sqrt(news_click_dict[item[0]] * news_click_dict[item[1]])
-
-    THRED_CLICK_TIME = 10
-    freq_news_set = set()
-    for news in news_click_dict:
-        if news_click_dict[news] > THRED_CLICK_TIME:
-            freq_news_set.add(news)
-    news_positive_pairs = []#[(new1, news2), ...]
-    for item in weight_doc_doc_dict:
-        if item[0] in freq_news_set and item[1] in freq_news_set and weight_doc_doc_dict[item]>0.05:
-            news_positive_pairs.append(item)
+    behavior_files = [config['datapath']+config['train_behavior'], config['datapath']+config['valid_behavior']]
+    #history clicked news id for each user, including history and behavior; the total number of clicks each news was clicked by all users
+    if config['memory_budget_mb']:#spill the clicks and co-click counts to disk
+        os.makedirs(config['cache_path'], exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=config['cache_path']) as work_dir:
+            news_ids, pair_rows, pair_cols, freq_news = coclick_positive_pairs_external(behavior_files, work_dir, config['memory_budget_mb']*1024*1024, config['num_workers'], config['behavior_shard_bytes'])
+        news_positive_pairs = ((news_ids[doc1], news_ids[doc2]) for doc1, doc2 in zip(pair_rows.tolist(), pair_cols.tolist()))
+        freq_news_list = [news_ids[news] for news in freq_news.tolist()]
+        pair_num = len(pair_rows)
+    else:
+        user_history_dict, news_click_dict = parse_behaviors(behavior_files, config['num_workers'], config['behavior_shard_bytes'])
+        #postive instance principle: co-click weight > 0.05 and both news clicked > THRED_CLICK_TIME times
+        news_positive_pairs, freq_news_list = coclick_positive_pairs(user_history_dict, news_click_dict)#[(new1, news2), ...]
+        pair_num = len(news_positive_pairs)
 
     os.makedirs(config['datapath'] + config['pos_train_file'].rsplit("/", 1)[0], exist_ok=True)
     fp_train_data = open(config['datapath'] + config['pos_train_file'], 'w', encoding='utf-8')
     fp_valid_data = open(config['datapath'] + config['pos_val_file'], 'w', encoding='utf-8')
     fp_test_data = open(config['datapath'] + config['pos_test_file'], 'w', encoding='utf-8')
-    for item in news_positive_pairs:#把负例采样放到后面，进行Knowledge-aware的负例采样
-        random_num = random.random()
+    split_random = np.random.default_rng(config['seed']).random(pair_num)#independent of the parsing workers
+    for item, random_num in zip(news_positive_pairs, split_random):#把负例采样放到后面，进行Knowledge-aware的负例采样
         if random_num < 0.8:
             fp_train_data.write("1" + '\t' + item[0] + '\t' + item[1] + '\n')
         elif random_num < 0.9:
@@ -245,11 +194,68 @@ def build_item2item_dataset(config):
     fp_valid_data.close()
     fp_test_data.close()
     fp_all_news = open(config['datapath'] + config['all_news_file'], 'w', encoding='utf-8')
-    for news in freq_news_set:
+    for news in freq_news_list:
         fp_all_news.write(news + '\n')
     fp_all_news.close()
 
+def news_entity_ids(entity_info_title, entity_info_abstract):#wikidata ids of the entities of a news, in order of appearance
+    news_entity_feature = {}
+    for item in json.loads(entity_info_title) + json.loads(entity_info_abstract):
+        news_entity_feature[item['WikidataId']] = None
+    return list(news_entity_feature)
+
+def build_doc_feature_external(config):
+    """build_doc_feature reading and encoding the news chunk by chunk, for a memory budget.
+
+    A first pass numbers the news in order of first appearance and records the offset of the last line of
+    each news, as news_feature_dict keeps it. Chunks of news are then read back, encoded and written to a
+    memory-mapped embedding matrix, so neither the texts nor the embeddings of all news are held in memory.
+    """
+    print("constructing news features out of core ... ")
+    news_files = [config['datapath'] + config['train_news'], config['datapath'] + config['valid_news']]
+    news_row = {}
+    locations = []#(file index, byte offset) of the line of each news
+    for file_index, filename in enumerate(news_files):
+        with open(filename, 'rb') as fp:
+            offset = 0
+            for line in fp:
+                row = news_row.setdefault(line.split(b'\t', 1)[0].decode('utf-8').strip(), len(news_row))
+                if row == len(locations):
+                    locations.append((file_index, offset))
+                else:
+                    locations[row] = (file_index, offset)
+                offset += len(line)
+    news_ids = list(news_row)
+    del news_row
+
+    chunk_news = max(1024, config['memory_budget_mb']*1024*1024 // (8 * (4 * config['doc_embedding_size'] + NEWS_LINE_BYTES)))
+    store = None
+    fps = [open(filename, 'rb') for filename in news_files]
+    fp_doc_feature_entity = open(config['datapath'] + config['doc_feature_entity_file'], 'w', encoding='utf-8')
+    encoder = DocEncoder(config['doc_encoder_model'], config['datapath'] + config['doc_encode_cache'], config['encode_batch_size'], config['encode_num_workers'])
+    for start in tqdm(range(0, len(news_ids), chunk_news)):
+        texts = []
+        for row in range(start, min(start + chunk_news, len(news_ids))):
+            file_index, offset = locations[row]
+            fps[file_index].seek(offset)
+            newsid, vert, subvert, title, abstract, url, entity_info_title, entity_info_abstract = fps[file_index].readline().decode('utf-8').strip().split('\t')
+            texts.append(title + " " + abstract)
+            fp_doc_feature_entity.write(newsid+'\t')
+            fp_doc_feature_entity.write(' '.join(news_entity_ids(entity_info_title, entity_info_abstract))+'\n')
+        sentence_embeddings = encoder.encode(texts)
+        if store is None:
+            store = DocEmbeddingStore.create(config['datapath'] + config['doc_feature_embedding_file'], news_ids, sentence_embeddings.shape[1], config['doc_embedding_dtype'])
+        store.matrix[start:start+len(texts)] = sentence_embeddings
+    encoder.close()
+    for fp in fps:
+        fp.close()
+    fp_doc_feature_entity.close()
+    if store is not None:
+        store.matrix.flush()
+
 def build_doc_feature(config):#doc embedding for each news, and entity ids for each news
+    if config['memory_budget_mb']:
+        return build_doc_feature_external(config)
     print("constructing news features ... ")
 
     news_features = {}
@@ -265,297 +271,111 @@ def build_doc_feature(config):#doc embedding for each news, and entity ids for e
         newsid, vert, subvert, title, abstract, url, entity_info_title, entity_info_abstract = line.strip().split('\t')
         news_feature_dict[newsid] = (title + " " + abstract, entity_info_title, entity_info_abstract)
 
-    model = SentenceTransformer('distilbert-base-nli-stsb-mean-tokens')
+    sentence_embeddings = encode_texts([news_feature_dict[news][0] for news in news_feature_dict], config['doc_encoder_model'], config['datapath'] + config['doc_encode_cache'], config['encode_batch_size'], config['encode_num_workers'])
     for news in tqdm(news_feature_dict, total=len(news_feature_dict)):
-        sentence_embedding = model.encode(news_feature_dict[news][0])
-        title_entity_json = json.loads(news_feature_dict[news][1])
-        abstract_entity_json = json.loads(news_feature_dict[news][2])
-        news_entity_feature = set()
-        for item in title_entity_json:
-            news_entity_feature.add(item['WikidataId'])
-        for item in abstract_entity_json:
-            news_entity_feature.add(item['WikidataId'])
-        news_features[news] = (sentence_embedding, list(news_entity_feature))
+        news_features[news] = news_entity_ids(news_feature_dict[news][1], news_feature_dict[news][2])
 
     fp_doc_feature_entity = open(config['datapath'] + config['doc_feature_entity_file'], 'w', encoding='utf-8')
-    fp_doc_feature_embedding = open(config['datapath'] + config['doc_feature_embedding_file'], 'w', encoding='utf-8')
     for news in news_features:
         fp_doc_feature_entity.write(news+'\t')
-        fp_doc_feature_entity.write(' '.join(news_features[news][1])+'\n')
-        fp_doc_feature_embedding.write(news + '\t')
-        fp_doc_feature_embedding.write(' '.join(list(map(lambda x:str(x),news_features[news][0]))) + '\n')
-
+        fp_doc_feature_entity.write(' '.join(news_features[news])+'\n')
     fp_doc_feature_entity.close()
-    fp_doc_feature_embedding.close()
-
-def process_mind_data(config):
-    build_item2item_dataset(config)
-    build_doc_feature(config)
+    DocEmbeddingStore.write(config['datapath'] + config['doc_feature_embedding_file'], list(news_features), sentence_embeddings, config['doc_embedding_dtype'])
 
-def process_KPRN_data(config):#todo : remove the ring paths
+def process_KPRN_data(config):
     Train_data = build_train(config)
-    entity_adj = torch.load(config['cache_path']+"/entity_adj.pt")
-    relation_adj = torch.load(config['cache_path']+"/relation_adj.pt")
-    doc_entity_dict = np.load(config['cache_path']+"/doc_entity_dict.npy", allow_pickle=True).item()
-    entity_doc_dict = np.load(config['cache_path']+"/entity_doc_dict.npy", allow_pickle=True).item()
-    hit_dict = np.load(config['cache_path']+"/hit_dict.npy", allow_pickle=True).item()
-    
-    news_set=set()
-    for item1, item2, label in zip(Train_data['item1'], Train_data['item2'], Train_data['label']):
-        news_set.add(item1)
-
-    def find_path(data, news, entities, relations, pre_ents, pre_edges):
-        for ent, rel in zip(entities, relations):
-            if ent==0:
-                break
-            other_news = set(entity_doc_dict[ent]) - set([news]) if ent in entity_doc_dict else set()
-            for other in other_news:
-                if (news, other) in data:
-                    data[(news, other)]["paths"].append(pre_ents+[ent])
-                    data[(news, other)]["edges"].append(pre_edges+[rel])
-                elif other in hit_dict[news]:
-                    data[(news, other)] = { "label": 1, "item1": news, "item2": other, "paths": [pre_ents+[ent]], "edges": [pre_edges+[rel]]}
-                else:
-                    data[(news, other)] = { "label": 0, "item1": news, "item2": other, "paths": [pre_ents+[ent]], "edges": [pre_edges+[rel]]}
-    
-    count_1=0
-    count_0=0
+    news_vocab = NewsVocab.load(DocEmbeddingStore.ids_file(config['datapath']+config['doc_feature_embedding_file']))
+    news_rows = news_vocab.rows(list(dict.fromkeys(Train_data['item1'])))#train news in order of first appearance
     os.makedirs(config['datapath'] + config['KPRN_train_file'].rsplit("/", 1)[0], exist_ok=True)
-    with open(config['datapath']+config['KPRN_train_file'], "w") as f_train:
-        with open(config['datapath']+config['KPRN_val_file'], "w") as f_dev:
-            for item1 in tqdm(news_set, total=len(news_set)):
-                data = {}
-                news_entity = doc_entity_dict[item1].tolist()
-                find_path(data, item1, news_entity, [0]*20, [], [])
-                for ent in news_entity:
-                    hop1_entity = entity_adj[ent].tolist()
-                    hop1_relation = relation_adj[ent].tolist()
-                    find_path(data, item1, hop1_entity, hop1_relation, [ent], [0])
-                    for ent_hop1, rel_hop1 in zip(hop1_entity, hop1_relation):
-                        hop2_entity = entity_adj[ent_hop1].tolist()
-                        hop2_relation = relation_adj[ent_hop1].tolist()
-                        find_path(data, item1, hop2_entity, hop2_relation, [ent, ent_hop1], [0, rel_hop1])
-
-                for item in data:
-                    if data[item]["label"]!=1 and random.random()>=0.001:#filter negative samples
-                        continue
-                    if len(data[item]['paths']) > 20:#(news1, news2) pair can not have more than 20 paths
-                        indices = random.sample(range(len(data[item]['paths'])), 20)
-                        data[item]['paths'] = [data[item]['paths'][idx] for idx in indices]
-                        data[item]['edges'] = [data[item]['edges'][idx] for idx in indices]
-                    line = json.dumps(data[item])+"\n"
-                    if data[item]["label"]==1:
-                        count_1+=1
-                    else:
-                        count_0+=1
-                    if random.random()<0.2:
-                        f_dev.write(line)
-                    else:
-                        f_train.write(line)
+    count_1, count_0 = mine_kprn_paths(config['datapath']+config['KPRN_train_file'], config['datapath']+config['KPRN_val_file'], news_rows, [config['seed']],
+                                       config['cache_path'], DocEmbeddingStore.ids_file(config['datapath']+config['doc_feature_embedding_file']),
+                                       config['news_entity_num'], config['neighbor_sampling'] == 'degree', config['num_workers'])
     print(count_1, count_0)#21013 39647
 
 def build_ent_rel_2id(config):
-    entity_id_dict = {}
-    fp_entity2id = open(config['datapath']+config['entity2id_file'], 'r', encoding='utf-8')
-    _ = fp_entity2id.readline()
-    for line in fp_entity2id:
-        linesplit = line.split('\n')[0].split('\t')
-        entity_id_dict[linesplit[0]] = int(linesplit[1])+1# 0 for padding
-
-    relation_id_dict = {}
-    fp_relation2id = open(config['datapath']+config['relation2id_file'], 'r', encoding='utf-8')
-    _ = fp_relation2id.readline()
-    for line in fp_relation2id:
-        linesplit = line.split('\n')[0].split('\t')
-        relation_id_dict[linesplit[0]] = int(linesplit[1])+1# 0 for padding
-    
+    entity_id_dict = read_id_file(config['datapath']+config['entity2id_file'])
+    relation_id_dict = read_id_file(config['datapath']+config['relation2id_file'])
     return entity_id_dict, relation_id_dict#note that the id starts from 1
 
-def build_adj_matrix(config, entity_id_dict, relation_id_dict):
-    print('constructing adjacency matrix ...')
-
-    adj_file_fp = open(config['datapath']+config['kg_file'], 'r', encoding='utf-8')
-    adj = {}
-    for line in adj_file_fp:
-        head, relation, tail = line.split('\n')[0].split('\t')#(head, relation, tail)
-        if entity_id_dict[head] not in adj:
-            adj[entity_id_dict[head]] = [(entity_id_dict[tail],relation_id_dict[relation])]
-        else:
-            adj[entity_id_dict[head]].append((entity_id_dict[tail],relation_id_dict[relation]))
-
-    entity_adj = torch.zeros([len(entity_id_dict)+1, config['news_entity_num']], dtype=torch.long)
-    relation_adj = torch.zeros([len(entity_id_dict)+1, config['news_entity_num']], dtype=torch.long)
-    for key in adj:
-        tail_rel = adj[key] + [(0,0)]*(config['news_entity_num']-len(adj[key])) if len(adj[key])<config['news_entity_num'] else random.sample(adj[key], config['news_entity_num'])
-        entities = [x[0] for x in tail_rel]
-        relations = [x[1] for x in tail_rel]
-        entity_adj[key] = torch.tensor(entities, dtype=torch.long)
-        relation_adj[key] = torch.tensor(relations, dtype=torch.long)
-
-    return entity_adj, relation_adj
+def build_knowledge_graph(config, entity_id_dict, relation_id_dict):
+    print('constructing knowledge graph ...')
+    heads, relations, tails = read_triples(config['datapath']+config['kg_file'], entity_id_dict, relation_id_dict)
+    return KnowledgeGraph.from_triples(heads, relations, tails, len(entity_id_dict)+1)
 
 def build_entity_relation_embedding(config, entity_num, relation_num):
     print('constructing embedding ...')
-    entity_embedding = np.zeros((entity_num+1, config['entity_embedding_size']))
-    relation_embedding = np.zeros((relation_num+1, config['entity_embedding_size']))
-    fp_entity_embedding = open(config['datapath']+config['entity_embedding_file'], 'r', encoding='utf-8')
-    for i, line in enumerate(fp_entity_embedding):
-        entity_embedding[i+1] = np.array(line.strip().split('\t')).astype(np.float)
-    fp_relation_embedding = open(config['datapath']+config['relation_embedding_file'], 'r', encoding='utf-8')
-    for i, line in enumerate(fp_relation_embedding):
-        relation_embedding[i+1] = np.array(line.strip().split('\t')).astype(np.float)
-    return torch.tensor(entity_embedding, dtype=torch.float32), torch.tensor(relation_embedding, dtype=torch.float32)
-
-def load_news_entity(config, entity_id_dict):
-    doc2entities = {}
-    entity2doc = {}
+    embeddings = []
+    for filename, num in [(config['entity_embedding_file'], entity_num), (config['relation_embedding_file'], relation_num)]:
+        vectors = load_vec(config['datapath']+filename)#memory-mapped .npy sidecar, row 0 for padding
+        assert vectors.shape[1] == config['entity_embedding_size'] and len(vectors) <= num+1
+        if len(vectors) < num+1:#ids without a vector keep a zero embedding
+            vectors = np.concatenate([vectors, np.zeros((num+1-len(vectors), vectors.shape[1]), dtype=np.float32)])
+        embeddings.append(torch.from_numpy(vectors))
+    return embeddings[0], embeddings[1]
+
+def load_news_entity(config, entity_id_dict, news_vocab):
+    """Entities of each news as columns indexed by the rows of `news_vocab`.
+
+    Returns:
+        np.ndarray: int32 (num_news, news_entity_num) entity ids of each news, the first news_entity_num entities, padded with 0.
+        CSRMap: entity id -> rows of the news mentioning it.
+    """
+    doc_entity = np.zeros([len(news_vocab), config['news_entity_num']], dtype=np.int32)
+    entity_list = []
+    row_list = []
     fp_news_entities = open(config['datapath']+config['doc_feature_entity_file'], 'r', encoding='utf-8')
     for line in fp_news_entities:
         linesplit = line.strip().split('\t')
-        newsid = linesplit[0]
-        if len(linesplit)>1:
-            news_entities = linesplit[1].split(" ")
-        else:
-            news_entities=[]
-        doc2entities[newsid] = []
-        for entity in news_entities:
-            if entity in entity_id_dict:
-                doc2entities[newsid].append(entity_id_dict[entity])
-                if entity_id_dict[entity] not in entity2doc:
-                    entity2doc[entity_id_dict[entity]] = set()
-                entity2doc[entity_id_dict[entity]].add(newsid)
-        if len(doc2entities[newsid]) > config['news_entity_num']:
-            doc2entities[newsid] = doc2entities[newsid][:config['news_entity_num']]
-        else:
-            for i in range(config['news_entity_num']-len(doc2entities[newsid])):#todo
-                doc2entities[newsid].append(0)
-    for item in doc2entities:
-        doc2entities[item] = torch.tensor(doc2entities[item], dtype=torch.long)
-    # for item in entity2doc:
-    #     if len(entity2doc[item])>config['news_entity_num']:
-    #         entity2doc[item] = entity2doc[item][:config['news_entity_num']] #todo load entity in titles
-
-    return doc2entities, entity2doc
+        row = news_vocab.row(linesplit[0])
+        news_entities = [entity_id_dict[entity] for entity in linesplit[1].split(" ") if entity in entity_id_dict] if len(linesplit)>1 else []
+        doc_entity[row, :min(len(news_entities), config['news_entity_num'])] = news_entities[:config['news_entity_num']]
+        entity_list.extend(news_entities)
+        row_list.extend([row]*len(news_entities))
+    fp_news_entities.close()
+    entity_news = CSRMap.from_pairs(entity_list, row_list, len(entity_id_dict)+1)
+    return doc_entity, entity_news
 
 def build_doc_feature_embedding(config):
-    print('constructing doc feature embedding ...')
-    fp_doc_feature = open(config['datapath']+config['doc_feature_embedding_file'], 'r', encoding='utf-8')
-    doc_embedding_feature_dict = {}
-    for line in fp_doc_feature:
-        linesplit = line.split('\n')[0].split('\t')
-        doc_embedding_feature_dict[linesplit[0]] = torch.tensor(np.array(linesplit[1].split(' ')).astype(np.float), dtype=torch.float32)
-    return doc_embedding_feature_dict
+    print('loading doc feature embedding ...')
+    return DocEmbeddingStore.load(config['datapath']+config['doc_feature_embedding_file'], on_device=config['doc_embedding_on_device'])
 
-def build_neibor_embedding(config, entity_doc_dict, doc_feature_embedding, entity_id_dict):#return doc embedding sum and num-1 for each entity, for calculating coherence reward
+def build_neibor_embedding(config, entity_news, doc_feature_embedding, entity_id_dict):#return doc embedding sum and num-1 for each entity, for calculating coherence reward
     print('build neiborhood embedding ...')
     entity_num = len(entity_id_dict)
     #neibor_embedding and neibor_num for each entity(inlcuding id=0)
     entity_neibor_embedding_list = torch.zeros([entity_num+1, config['doc_embedding_size']],dtype=torch.float32)
-    entity_neibor_num_list = torch.ones(entity_num+1, dtype=torch.long)
-    for entity in entity_doc_dict:
-        entity_news_embedding_list = torch.zeros([len(entity_doc_dict[entity]), config['doc_embedding_size']], dtype=torch.float32)
-        for i, news in enumerate(entity_doc_dict[entity]):
-            entity_news_embedding_list[i] = doc_feature_embedding[news]
-        entity_neibor_embedding_list[entity] = torch.sum(entity_news_embedding_list, dim=0)
-        if len(entity_doc_dict[entity])>=2:
-            entity_neibor_num_list[entity] = len(entity_doc_dict[entity])-1#-1 for news ifself in forward function
+    degree = entity_news.degree()
+    entities = np.repeat(np.arange(entity_news.num_rows), degree)#(entity, doc row) pairs
+    scatter_doc_embedding(entity_neibor_embedding_list, entities, entity_news.indices, doc_feature_embedding.matrix, config['neibor_chunk_size'])
+    entity_neibor_num_list = neibor_num_from_degree(torch.from_numpy(degree))#-1 for news ifself in forward function
     return entity_neibor_embedding_list, entity_neibor_num_list#todo torch.tensor(entity_neibor_embedding_list).cuda(), torch.tensor(entity_neibor_num_list).cuda()
 
-def build_hit_dict(config):
-    print('constructing hit dict ...')
-    hit_dict = {}
-    fp_train = open(config['datapath']+config['pos_train_file'], 'r', encoding='utf-8')
-    for line in fp_train:
-        linesplit = line.split('\n')[0].split('\t')
-        if linesplit[1] not in hit_dict:
-            hit_dict[linesplit[1]] = set()
-        if linesplit[2] not in hit_dict:
-            hit_dict[linesplit[2]] = set()
-        hit_dict[linesplit[1]].add(linesplit[2])
-        hit_dict[linesplit[2]].add(linesplit[1])
-    fp_train.close()
-
-    train_val_hit_dict = copy.deepcopy(hit_dict)
-    fp_val = open(config['datapath']+config['pos_val_file'], 'r', encoding='utf-8')
-    for line in fp_val:
-        linesplit = line.split('\n')[0].split('\t')
-        if linesplit[1] not in train_val_hit_dict:
-            train_val_hit_dict[linesplit[1]] = set()
-        if linesplit[2] not in train_val_hit_dict:
-            train_val_hit_dict[linesplit[2]] = set()
-        train_val_hit_dict[linesplit[1]].add(linesplit[2])
-        train_val_hit_dict[linesplit[2]].add(linesplit[1])
-    fp_val.close()
-    return hit_dict, train_val_hit_dict
-
-def knowledge_neg_sampling():
-    pass
-    '''
-    with open(config['datapath']+config['knowledge_neg_sample_train_file'], 'w', encoding='utf-8') as kg_fp_train:
-        for item1, item2 in positive_pairs:
-            rs_fp_train.write('1\t'+item1+'\t'+item2+'\n')
-            k = random.sample([1,2,3], 1)[0]
-            if k==1:
-                one_hop_entity = set(doc_entity_dict[item1].numpy().tolist())
-                one_hop_entity.remove(0)
-                if len(one_hop_entity)==0:
-                    continue
-                neg_news_list=[]
-                for ent in one_hop_entity:
-                    try:
-                        neg_news_list.extend(entity_doc_dict[ent])
-                    except:
-                        pass
-                neg_news_list = list(set(neg_news_list)-set([item1, item2]))
-                if len(neg_news_list)==0:
-                    continue
-                neg_news = random.sample(neg_news_list, 1)[0]
-                if (item1, neg_news) not in positive_pairs and (neg_news, item1) not in positive_pairs:
-                    kg_fp_train.write('0\t'+item1+'\t'+neg_news+'\n')
-    '''         
-
-def random_neg_sampling(config, all_news, positive_pairs, data_set, fp):
-    for item1, item2 in data_set:
-        fp.write('1\t'+item1+'\t'+item2+'\n')
-        while True:
-            flag=0
-            negative_items = random.sample(all_news, config['train_neg_num'])
-            for item in negative_items:
-                if (item1, item) in positive_pairs or (item, item1) in positive_pairs:
-                    flag=1
-                    break
-            if flag==0:
-                break
-        for item in negative_items:
-            fp.write('0\t'+item1+'\t'+item+'\n')
-
-def negative_sampling(config):
-    all_news = []
+def read_pair_rows(filename, news_vocab):#rows of the (item1, item2) columns of a labeled pair file
+    with open(filename, 'r', encoding='utf-8') as fp:
+        tokens = fp.read().split()
+    return news_vocab.rows(tokens[1::3]), news_vocab.rows(tokens[2::3])
+
+def build_hit_graph(config, news_vocab):
+    """Hit graph of the train positive pairs, layered with the valid positive pairs (see HitGraph)."""
+    print('constructing hit graph ...')
+    train_pairs = read_pair_rows(config['datapath']+config['pos_train_file'], news_vocab)
+    val_pairs = read_pair_rows(config['datapath']+config['pos_val_file'], news_vocab)
+    return HitGraph.from_pairs(train_pairs, val_pairs, len(news_vocab))
+
+def negative_sampling(config, news_vocab, doc_entity, entity_news, hit_graph):
+    """Write train_file and val_file: each positive pair followed by train_neg_num negatives.
+
+    Negatives of a pair (item1, item2) are never positive pairs of item1, train pairs for the train file and
+    train + valid pairs for the valid file. knowledge_neg_num of them are hard negatives sharing an
+    entity with item1 when such news exist, the others are drawn from all_news.
+    """
+    print('negative sampling ...')
     with open(config['datapath']+config['all_news_file'], 'r', encoding='utf-8') as fp_all_news:
-        for line in fp_all_news:
-            news = line.strip()
-            all_news.append(news)
-
-    positive_pairs=set()
-    with open(config['datapath']+config['pos_train_file'], 'r', encoding='utf-8') as fp_train:
-        for line in fp_train:
-            linesplit = line.split('\n')[0].split('\t')
-            positive_pairs.add((linesplit[1], linesplit[2]))
-    
-    rs_fp_train = open(config['datapath']+config['train_file'], 'w', encoding='utf-8')
-    random_neg_sampling(config, all_news, positive_pairs, positive_pairs, rs_fp_train)
-    rs_fp_train.close()
-    
-    val_positive_pairs=set()
-    with open(config['datapath']+config['pos_val_file'], 'r', encoding='utf-8') as fp_val:
-        for line in fp_val:
-            linesplit = line.split('\n')[0].split('\t')
-            positive_pairs.add((linesplit[1], linesplit[2]))
-            val_positive_pairs.add((linesplit[1], linesplit[2]))
-
-    rs_fp_val = open(config['datapath']+config['val_file'], 'w', encoding='utf-8')
-    random_neg_sampling(config, all_news, positive_pairs, val_positive_pairs, rs_fp_val)
-    rs_fp_val.close()              
+        all_news = news_vocab.rows(fp_all_news.read().split())
+    for split, (pos_file, out_file, view) in enumerate([('pos_train_file', 'train_file', 'train'), ('pos_val_file', 'val_file', 'train_val')]):
+        item1, item2 = read_pair_rows(config['datapath']+config[pos_file], news_vocab)
+        sample_negatives(config['datapath']+config[out_file], item1, item2, [config['seed'], split], news_vocab.ids, all_news, doc_entity, entity_news,
+                         hit_graph.view(view), config['train_neg_num'], config['knowledge_neg_num'], config['num_workers'])
 
 def build_train(config):
     print('constructing train ...')